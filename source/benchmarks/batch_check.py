@@ -0,0 +1,108 @@
+"""
+Batch round-trip check.
+
+Deliver pending packages like the server answers a PING: as many packages as fit into 'batch_size' bytes
+in one BATCH package, a package that doesn't fit is sent alone as ANS. The packages are sized around the
+boundary (prefix 'ses len ' included, also with multi-byte characters). Every parsed package must equal the
+queued one in delivery order, no payload may exceed the size.
+
+Run from the source folder:
+    python -m benchmarks.batch_check [--size 65535] [--rounds 200]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from objects.pendingqueue import PendingQueue
+from protocol.protocol import YardControlChannel
+
+
+def create_packages(channel: YardControlChannel, size: int, rnd: random.Random) -> list:
+    """
+    :param channel: YardControlChannel: Creates the headers
+    :param size: int: Maximum number of bytes of a BATCH payload
+    :param rnd: random.Random: The random generator
+    :return: list: [(ses, package), ...] with payload lengths around the boundary of a batch
+    """
+    packages = []
+    for i in range(rnd.randint(1, 12)):
+        ses = rnd.randint(1, 255)
+        prefix = len(f"{ses} {size} ")
+        length = rnd.choice([0, 1, rnd.randint(2, size // 3), size - prefix - 1, size - prefix, size - prefix + 1,
+                             size - 1, size])
+        char = rnd.choice(["x", "ä"])
+        # A multi-byte character takes more bytes than its characters are counted in 'len'
+        payload = char * (length // len(char.encode()))
+        packages.append((ses, [channel.create_header(ses, channel.ANS, pl=payload), payload]))
+    return packages
+
+
+def deliver(channel: YardControlChannel, queue: PendingQueue, size: int) -> tuple:
+    """
+    Empty the queue like consecutive PINGs do.
+
+    :return: tuple: ([(ses, payload), ...] in delivery order, number of BATCH packages, number of ANS packages)
+    """
+    delivered = []
+    batches = answers = 0
+    while queue:
+        batch = channel.create_batch(queue, size)
+        if batch:
+            if len(channel.convert_to_bytes(batch)) > size:
+                raise AssertionError(f"Batch of {len(channel.convert_to_bytes(batch))} bytes exceeds {size}")
+            delivered.extend((header['ses'], data) for header, data in channel.parse_batch(batch))
+            batches += 1
+        else:
+            ses, package = queue.popleft()
+            delivered.append((ses, package[1]))
+            answers += 1
+    return delivered, batches, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the round trip of BATCH packages at the size boundary")
+    parser.add_argument('--size', type=int, default=0xFFFF)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    channel = YardControlChannel()
+    rnd = random.Random(args.seed)
+    failures = []
+    batches = answers = count = 0
+    start = time.perf_counter()
+    for i in range(args.rounds):
+        packages = create_packages(channel, args.size, rnd)
+        queue = PendingQueue(max_packages=len(packages), max_bytes=len(packages) * 2 * args.size)
+        for item in packages:
+            queue.append(item)
+        # The expected order is the delivery order of the queue (round-robin over the sessions)
+        expected = []
+        while queue:
+            ses, package = queue.popleft()
+            expected.append((ses, package[1]))
+        for item in packages:
+            queue.append(item)
+        try:
+            delivered, round_batches, round_answers = deliver(channel, queue, args.size)
+        except (AssertionError, ValueError) as e:
+            failures.append(f"round {i}: {e!r}")
+            continue
+        if delivered != expected:
+            failures.append(f"round {i}: delivered packages differ from the queued ones")
+        batches += round_batches
+        answers += round_answers
+        count += len(packages)
+    duration = time.perf_counter() - start
+
+    print(f"{count} packages in {batches} batches and {answers} plain answers, {duration:.2f} s")
+    print(f"failures: {len(failures)}")
+    for failure in failures[:10]:
+        print(f"  {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Codec benchmark.
+
+Compare encode time, decode time and size of all registered codecs on the synthetic reference content.
+
+Run from the source folder:
+    python -m benchmarks.codec_benchmark [--frames 20] [--width 1280] [--height 720]
+"""
+
+import argparse
+import time
+
+from objects.framesource import SyntheticFrameSource
+from protocol.yardcodec import registry
+
+
+def benchmark_codec(codec: str, frames: list) -> dict:
+    """
+    Encode and decode all frames with the codec.
+
+    :param codec: str: The name of the codec
+    :param frames: list: The frames
+    :return: dict: Average encode and decode time in ms and average size in bytes
+    """
+    encode_time = decode_time = size = 0
+    for frame in frames:
+        start = time.perf_counter()
+        data = registry.encode(frame, codec)
+        encode_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        registry.decode(data)
+        decode_time += time.perf_counter() - start
+        size += len(data)
+    return {'encode_ms': encode_time / len(frames) * 1000,
+            'decode_ms': decode_time / len(frames) * 1000,
+            'bytes': size // len(frames)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the frame codecs on synthetic content")
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--codecs', nargs='*', default=registry.available())
+    args = parser.parse_args()
+
+    print(f"{'content':<10} {'codec':<8} {'encode ms':>10} {'decode ms':>10} {'bytes':>10} {'ratio':>7}")
+    for content in SyntheticFrameSource.contents:
+        source = SyntheticFrameSource(content, (args.width, args.height))
+        frames = [source.grab() for _ in range(args.frames)]
+        raw_size = args.width * args.height * 3
+        for codec in args.codecs:
+            try:
+                result = benchmark_codec(codec, frames)
+            except ValueError:
+                # The content is not encodable by the codec, e.g. too many colours for the palette
+                print(f"{content:<10} {codec:<8} {'n/a':>10} {'n/a':>10} {'n/a':>10} {'n/a':>7}")
+                continue
+            print(f"{content:<10} {codec:<8} {result['encode_ms']:>10.2f} {result['decode_ms']:>10.2f} "
+                  f"{result['bytes']:>10} {raw_size / result['bytes']:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Control channel benchmark.
+
+Send thousands of small control messages over a TCP connection on localhost and measure the throughput
+of the buffered framing.
+
+Run from the source folder:
+    python -m benchmarks.control_channel_benchmark [--messages 20000] [--size 32]
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+from protocol.protocol import YardControlChannel
+
+
+def create_connection() -> tuple:
+    """
+    Create a connected pair of TCP sockets on localhost.
+
+    :return: tuple: (client, server)
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    client = socket.create_connection(listener.getsockname())
+    server, address = listener.accept()
+    listener.close()
+    for sock in (client, server):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client, server
+
+
+def benchmark_one_way(messages: int, size: int) -> float:
+    """
+    Send all messages and receive them on the other side.
+
+    :return: float: Messages per second
+    """
+    channel = YardControlChannel()
+    client, server = create_connection()
+    payload = "x" * size
+
+    def send():
+        for i in range(messages):
+            channel.send(client, channel.PING, payload, ac=i % 255 + 1)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=send)
+    thread.start()
+    for i in range(messages):
+        header, data = channel.receive(server)
+        assert header['ac'] == i % 255 + 1 and len(data) == size
+    elapsed = time.perf_counter() - start
+    thread.join()
+    client.close()
+    server.close()
+    return messages / elapsed
+
+
+def benchmark_round_trip(messages: int, size: int) -> float:
+    """
+    Send every message and wait for the answer before sending the next one (like PING).
+
+    :return: float: Round trips per second
+    """
+    channel = YardControlChannel()
+    client, server = create_connection()
+    payload = "x" * size
+
+    def answer():
+        try:
+            while True:
+                header, data = channel.receive(server)
+                channel.send(server, channel.ANS, data, ac=header['ac'])
+        except (ConnectionAbortedError, OSError):
+            pass
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    start = time.perf_counter()
+    for i in range(messages):
+        channel.send(client, channel.PING, payload, ac=1)
+        channel.receive(client)
+    elapsed = time.perf_counter() - start
+    client.close()
+    thread.join()
+    server.close()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the control channel framing")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"One way:    {benchmark_one_way(args.messages, args.size):>10.0f} messages/s")
+    print(f"Round trip: {benchmark_round_trip(args.messages // 4, args.size):>10.0f} round trips/s")
+
+
+if __name__ == '__main__':
+    main()
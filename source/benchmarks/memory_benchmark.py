@@ -0,0 +1,60 @@
+"""
+Server memory benchmark.
+
+Fill a ClientStorage with offline clients and sessions between pairs of them and report the traced
+memory per client and per session, like a server that holds many registered clients.
+
+Run from the source folder:
+    python -m benchmarks.memory_benchmark [--clients 100000] [--sessions 50000]
+"""
+
+import argparse
+import gc
+import tracemalloc
+import uuid
+
+from objects.clientobj import ClientObj
+from objects.storage import ClientStorage
+
+
+def measure(clients: int, sessions: int) -> dict:
+    """
+    :param clients: int: Number of clients
+    :param sessions: int: Number of sessions, each between two different clients
+    :return: dict: Traced bytes of the clients and of the sessions
+    """
+    # The fingerprints and ids are created before, they are the input of the server and not its state
+    keys = [(f"{i:0{ClientObj.id_len}d}", uuid.uuid4()) for i in range(clients)]
+    gc.collect()
+    tracemalloc.start()
+    storage = ClientStorage()
+    for client_id, fingerprint in keys:
+        storage.add_client(client_id, fingerprint, False, None)
+    del keys
+    gc.collect()
+    after_clients = tracemalloc.get_traced_memory()[0]
+    members = list(storage.clients.values())
+    start = tracemalloc.get_traced_memory()[0]
+    for i in range(sessions):
+        storage.create_session(members[(2 * i) % clients], members[(2 * i + 1) % clients])
+    gc.collect()
+    after_sessions = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'clients': after_clients, 'sessions': after_sessions - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory of the clients and sessions of the server")
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--sessions', type=int, default=50000)
+    args = parser.parse_args()
+
+    result = measure(args.clients, args.sessions)
+    print(f"{'clients':>8} {'sessions':>9} {'client MiB':>11} {'B/client':>9} {'session MiB':>12} {'B/session':>10}")
+    print(f"{args.clients:>8} {args.sessions:>9} {result['clients'] / (1 << 20):>11.1f} "
+          f"{result['clients'] / args.clients:>9.0f} {result['sessions'] / (1 << 20):>12.1f} "
+          f"{result['sessions'] / max(args.sessions, 1):>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Client storage benchmark.
+
+Measure the per-message lookups of the server (client by socket, client by fingerprint, client by id)
+for a growing number of registered clients. With the indexes of ClientStorage the cost stays flat,
+the linear scan is shown for comparison.
+
+The session part measures create_session, session_exists and delete_session of a support client
+that already holds many sessions.
+
+Run from the source folder:
+    python -m benchmarks.storage_benchmark [--clients 1000 10000 100000] [--lookups 100000] [--sessions 0 128 250]
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+from objects.clientobj import ClientObj
+from objects.storage import ClientStorage
+
+
+def fill_storage(count: int) -> ClientStorage:
+    """
+    :param count: int: Number of clients
+    :return: ClientStorage: Storage with count online clients, an object stands in for each socket
+    """
+    storage = ClientStorage()
+    for i in range(count):
+        storage.add_client(f"{i:0{ClientObj.id_len}d}", uuid.uuid4(), True, object())
+    return storage
+
+
+def benchmark_lookups(storage: ClientStorage, lookups: int) -> dict:
+    """
+    Look up random clients like answer_message() and create_client() do.
+
+    :param storage: ClientStorage: The filled storage
+    :param lookups: int: Number of lookups per kind
+    :return: dict: Average time per lookup in µs
+    """
+    clients = random.choices(list(storage.clients.values()), k=lookups)
+    result = {}
+    for name, lookup, keys in (('socket', storage.get_client_by_socket, [c.socket for c in clients]),
+                               ('fingerprint', storage.get_client_by_fingerprint, [c.fingerprint for c in clients]),
+                               ('id', storage.get_client, [c.client_id for c in clients])):
+        start = time.perf_counter()
+        for key in keys:
+            lookup(key)
+        result[name] = (time.perf_counter() - start) / lookups * 1e6
+    return result
+
+
+def benchmark_scan(storage: ClientStorage, lookups: int) -> float:
+    """
+    :param storage: ClientStorage: The filled storage
+    :param lookups: int: Number of lookups
+    :return: float: Average time of a linear scan by socket in µs
+    """
+    socks = [c.socket for c in random.choices(list(storage.clients.values()), k=lookups)]
+    start = time.perf_counter()
+    for sock in socks:
+        next((c for c in storage.clients.values() if c.socket == sock), None)
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def benchmark_sessions(held: int, rounds: int) -> dict:
+    """
+    Create and delete a session between a support client with 'held' sessions and other clients.
+
+    :param held: int: Number of sessions the support client holds
+    :param rounds: int: Number of created and deleted sessions
+    :return: dict: Average time of create, exists and delete in µs
+    """
+    storage = fill_storage(held + 1 + rounds)
+    support, *partners = storage.clients.values()
+    for partner in partners[:held]:
+        storage.create_session(support, partner)
+    result = {'create': 0.0, 'exists': 0.0, 'delete': 0.0}
+    for partner in partners[held:]:
+        start = time.perf_counter()
+        ses = storage.create_session(support, partner)
+        created = time.perf_counter()
+        support.session_exists(partner)
+        looked_up = time.perf_counter()
+        support.delete_session(ses)
+        deleted = time.perf_counter()
+        result['create'] += created - start
+        result['exists'] += looked_up - created
+        result['delete'] += deleted - looked_up
+    return {name: value / rounds * 1e6 for name, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the client lookups of the storage")
+    parser.add_argument('--clients', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--scan-lookups', type=int, default=200)
+    parser.add_argument('--sessions', type=int, nargs='*', default=[0, 128, 250])
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'socket µs':>10} {'fingerprint µs':>15} {'id µs':>8} {'scan µs':>10}")
+    for count in args.clients:
+        storage = fill_storage(count)
+        result = benchmark_lookups(storage, args.lookups)
+        scan = benchmark_scan(storage, args.scan_lookups)
+        print(f"{count:>8} {result['socket']:>10.3f} {result['fingerprint']:>15.3f} {result['id']:>8.3f} {scan:>10.1f}")
+
+    print()
+    print(f"{'sessions':>8} {'create µs':>10} {'exists µs':>10} {'delete µs':>10}")
+    for held in args.sessions:
+        result = benchmark_sessions(held, args.rounds)
+        print(f"{held:>8} {result['create']:>10.2f} {result['exists']:>10.3f} {result['delete']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Client storage stress test.
+
+Threads create clients, create and delete sessions, queue pending packages and reconnect clients on one
+ClientStorage at the same time, like the connection threads of the server do. Afterwards the consistency
+of the sessions and indexes is checked.
+
+Run from the source folder:
+    python -m benchmarks.storage_stress [--threads 16] [--clients 200] [--operations 20000]
+"""
+
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+from objects.storage import ClientStorage
+from objects.yardexceptions import PendingQueueFull
+
+
+class StubSocket:
+    """
+    Stands in for the socket of a client, the storage only hashes and closes it.
+    """
+
+    def close(self) -> None:
+        pass
+
+
+def worker(storage: ClientStorage, fingerprints: list, operations: int, errors: list) -> None:
+    """
+    Run random operations on the storage.
+
+    :param storage: ClientStorage: The shared storage
+    :param fingerprints: list: The fingerprints of all clients
+    :param operations: int: Number of operations
+    :param errors: list: Unexpected exceptions are appended
+    :return: None
+    """
+    rnd = random.Random()
+    for _ in range(operations):
+        try:
+            operation = rnd.random()
+            client = storage.get_client_by_fingerprint(rnd.choice(fingerprints))
+            partner = storage.get_client_by_fingerprint(rnd.choice(fingerprints))
+            if operation < 0.1 or not client or not partner:
+                # INIT of a new or reconnecting client
+                storage.create_client(rnd.choice(fingerprints), sock=StubSocket())
+            elif operation < 0.4:
+                if client is not partner:
+                    storage.create_session(client, partner)
+            elif operation < 0.6:
+                with client.locked():
+                    ses = rnd.choice(list(client.sessions) or [0])
+                    client.pending_packages.append((ses, [{'ses': ses}, 'payload']))
+            elif operation < 0.85:
+                with client.locked():
+                    sessions = list(client.sessions)
+                if sessions:
+                    client.delete_session(rnd.choice(sessions))
+            elif operation < 0.95:
+                storage.get_client_by_socket(client.socket)
+            else:
+                client.set_offline()
+        except (OverflowError, PendingQueueFull):
+            # No session id left for the pair or too many pending packages
+            pass
+        except Exception as e:
+            errors.append(e)
+
+
+def check(storage: ClientStorage) -> list:
+    """
+    :param storage: ClientStorage: The storage after the stress test
+    :return: list: Descriptions of the inconsistencies
+    """
+    problems = []
+    for client_id, client in storage.clients.items():
+        if storage.fingerprints.get(client.fingerprint_bytes, None) is not client:
+            problems.append(f"{client_id} is missing in the fingerprint index")
+        if client.socket is not None and storage.sockets.get(client.socket, None) is not client:
+            problems.append(f"{client_id} is missing in the socket index")
+        if len(client.pending_packages) != sum(1 for _ in client.pending_packages):
+            problems.append(f"Pending package count of {client_id} differs from its queues")
+        if client.used_sessions != sum(1 << ses for ses in client.sessions):
+            problems.append(f"Session id bitmap of {client_id} differs from its sessions")
+        if len(client.partner_sessions) != len(client.sessions):
+            problems.append(f"Partner index of {client_id} differs from its sessions")
+        for ses, session in client.sessions.items():
+            partner = session.get_partner(client_id)
+            if partner.sessions.get(ses, None) is not session:
+                problems.append(f"Session {ses} of {client_id} is missing at {partner.client_id}")
+    for sock, client in storage.sockets.items():
+        if client.socket is not sock:
+            problems.append(f"Stale socket index entry of {client.client_id}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the client storage with concurrent threads")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--operations', type=int, default=20000, help="Operations per thread")
+    args = parser.parse_args()
+
+    # Existing sessions are expected, keep the output readable
+    logging.getLogger('yard_server').setLevel(logging.ERROR)
+    # Short switch interval, so the threads interleave inside the storage operations
+    sys.setswitchinterval(1e-6)
+    storage = ClientStorage()
+    fingerprints = [uuid.uuid4() for _ in range(args.clients)]
+    for fingerprint in fingerprints:
+        storage.create_client(fingerprint, sock=StubSocket())
+    errors = []
+    threads = [threading.Thread(target=worker, args=(storage, fingerprints, args.operations, errors))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    problems = check(storage)
+    print(f"{args.threads * args.operations} operations in {duration:.2f} s "
+          f"({args.threads * args.operations / duration:.0f} ops/s)")
+    print(f"errors: {len(errors)}, inconsistencies: {len(problems)}")
+    for problem in (list(map(repr, errors)) + problems)[:10]:
+        print(f"  {problem}")
+    sys.exit(1 if errors or problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import logging
 
 from objects import yardlogging
@@ -34,28 +35,46 @@ class ClientCLI:
                             case 'help':
                                 print("YARD - Yet Another Remote Desktop")
                                 print("\nstart - connect to server(address in settings/conf.json) and get ID")
-                                print("\nconnect ID - connect to client and start Remote Desktop Transmission")
+                                print("\nconnect ID [PASSWORD] - connect to client and start Remote Desktop Transmission")
                                 print("\nreset - Reset connection")
                                 print("\nexit - Close Program")
                             case 'connect':
-                                if len(params) == 1:
-                                    self.clt.connect_to_client(params[0])
+                                if len(params) in (1, 2):
+                                    self.clt.connect_to_client(*params)
                                 else:
-                                    cmd_logger.warning(f"Connect needs only 1 parameter, {len(params)} were given")
+                                    cmd_logger.warning(f"Connect needs 1 or 2 parameters, {len(params)} were given")
                             case 'reset':
                                 self.clt.reset()
                             case _:
                                 cmd_logger.warning("Unknown command. Enter help to get help")
                     case _:
                         cmd_logger.warning("Unknown structure. Enter help to get help")
+            except EOFError:
+                # No interactive input (e.g. headless benchmark) -> keep running until the client is closed
+                self.clt.ping_loop_event.wait()
+                break
             except Exception as ex:
                 cmd_logger.exception(ex)
 
 
-client = ClientDaemon()
+parser = argparse.ArgumentParser(description="YARD - Yet Another Remote Desktop")
+parser.add_argument('--headless', action='store_true',
+                    help="receive and decode frames without a window and report FPS, latency and CPU")
+parser.add_argument('--record', metavar='FILE',
+                    help="in headless mode write the received frames to FILE instead of discarding them")
+parser.add_argument('--connect', metavar='ID', help="start and connect to the client with this ID")
+parser.add_argument('--password', help="password of the client passed with --connect")
+args = parser.parse_args()
+
+client = ClientDaemon(headless=args.headless, record_file=args.record)
 client_cli = ClientCLI(client)
 try:
+    if args.connect:
+        client_cli.start_client()
+        client.connect_to_client(args.connect, args.password)
     client_cli.input_loop()
+except KeyboardInterrupt:
+    client.close()
 except Exception as e:
     logging.getLogger('yard_client').exception(e)
     client.close()
@@ -9,6 +9,10 @@ class MainWindow:
     root = None
     mainframe = None
     stream_frame = None
+    stream_image = None
+    stream_image_item = None
+    cursor_item = None
+    cursor_position = (0, 0)
     stream_event_handler = None
     wait_release = None
     motion_cooldown_default = 10
@@ -20,8 +24,10 @@ class MainWindow:
         self.root.title('YARD')
         self.mainframe = ttk.Frame(self.root)
         self.mainframe.grid()
-        self.stream_frame = Label(self.mainframe, bg="black")
+        self.stream_frame = Canvas(self.mainframe, bg="black", highlightthickness=0)
         self.stream_frame.grid(column=0, row=0)
+        self.stream_image_item = self.stream_frame.create_image(0, 0, anchor=NW)
+        self.cursor_item = self.create_default_cursor()
         self.register_events()
         self.wait_release = {}
         self.reset_motion_cooldown()
@@ -83,5 +89,43 @@ class MainWindow:
             self.motion_cooldown -= 1
         # TODO: Check if positive
 
+    def create_default_cursor(self) -> int:
+        """
+        Draw the arrow cursor, the remote only sends the position of its cursor (see CursorObj).
+
+        :return: int: The id of the canvas item
+        """
+        x, y = self.cursor_position
+        return self.stream_frame.create_polygon(self.get_arrow_points(x, y), fill="white", outline="black")
+
+    @staticmethod
+    def get_arrow_points(x: int, y: int) -> list:
+        return [x, y, x, y + 16, x + 4, y + 12, x + 7, y + 18, x + 9, y + 17, x + 6, y + 11, x + 11, y + 11]
+
+    def show_frame(self, img: 'PhotoImage'):
+        """
+        Show a received frame below the cursor.
+
+        :param img: PhotoImage: The decoded frame
+        :return: None
+        """
+        if img.width() != self.stream_frame.winfo_reqwidth() or img.height() != self.stream_frame.winfo_reqheight():
+            self.stream_frame.config(width=img.width(), height=img.height())
+        self.stream_frame.itemconfig(self.stream_image_item, image=img)
+        # Keep a reference otherwise the image gets garbage collected
+        self.stream_image = img
+
+    def move_cursor(self, x: int, y: int):
+        """
+        Move the drawn cursor, this only moves a canvas item and does not redraw the frame.
+
+        :param x: int: X-coordinate of the remote cursor
+        :param y: int: Y-coordinate of the remote cursor
+        :return: None
+        """
+        self.cursor_position = (x, y)
+        self.stream_frame.coords(self.cursor_item, *self.get_arrow_points(x, y))
+        self.stream_frame.tag_raise(self.cursor_item)
+
     def start(self):
         self.root.mainloop()
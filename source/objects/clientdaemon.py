@@ -1,6 +1,7 @@
 import json
 import logging
 import pickle
+import queue
 import socket
 import threading
 import time
@@ -8,19 +9,20 @@ import uuid
 from typing import Tuple, Any
 
 import cv2
-import mss
 import numpy as np
-from PIL import ImageTk, Image
+from PIL import Image
 
-from display.mainwindow import MainWindow
 from objects import secret
 from objects.connectionobj import ConnectionObj
-from objects.inputobj import Input, Key, Mouse
+from objects.cursorobj import CursorObj
+from objects.framesource import FrameSource, create_frame_source
+from objects.headless import HeadlessViewer
 from objects.storage import ConnectionStorage
 from protocol.yardclient import YardClient
+from protocol.yardcodec import registry
 from protocol.yardtransmission import YardTransmission
-from pynput.keyboard import Controller as KeyController
-from pynput.mouse import Controller as MouseController
+
+# Tk and pynput need a display, they are imported where they are used so that the headless viewer runs without one
 
 conf = json.load(open('settings/conf.json'))
 
@@ -38,35 +40,55 @@ class ClientDaemon:
     WARN = 'WARN'
     ERR = 'ERR'
 
-    default_ping_wait = 5  # multiply by 2 to get max wait time
+    default_ping_wait = 60  # Keepalive, the server pushes the packages of the sessions
+    cursor_wait = 0.01
+    cursor_resend = 1  # Resend an unchanged cursor after x seconds in case a datagram got lost
     ping_wait = default_ping_wait
     password_len = conf['server']['password_len']
     server_socket = (conf['server']['hostname'], conf['server']['port'])
     transmission_buffer = conf['transmission']['buffer']
+    transmission_codec = conf['transmission'].get('codec', 'jpeg')
     clt_conn = None
     clt_public_ip = None
     clt = None
     clt_id = None
     clt_pass = None
     ping_loop_event = None
+    pushed_packages: 'queue.Queue[Tuple[dict, str]]' = None
     stopping = False
 
     connection_storage = None
     pending_connections = None
 
-    capture = None
-    keyboard: KeyController = None
-    mouse: MouseController = None
+    frame_source: FrameSource = None
+    frame_source_lock: threading.Lock = None
+    keyboard: 'KeyController' = None
+    mouse: 'MouseController' = None
 
     main_window = None
-
-    def __init__(self):
+    headless = False
+    headless_viewer: HeadlessViewer = None
+    record_file: str = None
+
+    def __init__(self, *, headless: bool = False, record_file: str = None, frame_source: FrameSource = None):
+        """
+        :param headless: bool(Optional, keyword-only): Receive and decode frames without a window
+        :param record_file: str(Optional, keyword-only): In headless mode write the frames to this file
+        :param frame_source: FrameSource(Optional, keyword-only): Source of the sent frames,
+        default is configured in conf['client']['frame_source']
+        """
         logging.getLogger('yard_client.starting').info("Starting YardClient ...")
         self.clt_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clt = YardClient(self.server_socket, self.clt_conn)
         self.connection_storage = ConnectionStorage()
         self.pending_connections = {}
         self.ping_loop_event = threading.Event()
+        self.pushed_packages = queue.Queue()
+        self.clt.push_callback = self.pushed_packages.put
+        self.headless = headless
+        self.record_file = record_file
+        self.frame_source = frame_source
+        self.frame_source_lock = threading.Lock()
 
     def connect(self):
         self.connection_storage.add_connection('root', 0, True)
@@ -74,11 +96,11 @@ class ClientDaemon:
             self.clt.connect()
 
     def get_client_info(self, *, pending_session: int = None, pending_password: str = None,
-                        conn: ConnectionObj = None) -> str:
+                        conn: ConnectionObj = None, password: str = None) -> str:
         fingerprint = uuid.UUID(self.clt.settings['fingerprint'])
         client_id = self.clt_id
         if pending_session is not None:
-            password = input("Enter password for client: ")
+            password = password or input("Enter password for client: ")
             pending_password = self.clt_pass = secret.create_secret(32, alphabet=(True, True))
             self.pending_connections[pending_session] = {}
             ses = self.pending_connections[pending_session]
@@ -126,7 +148,7 @@ class ClientDaemon:
                                                                                        transmission=trans_clt)
                                         ping_logger.info(f"Client [{public_ip}:{fingerprint}] connected successfully.")
 
-                                        connection = self.connection_storage.connections[cs_id]
+                                        connection = self.connection_storage.get_connection(cs_id)
                                         self.send_accept_to_client(header['ses'], pending_password, connection)
                                         trans_clt.punch_udp_hole(public_sock, udp_pass)
 
@@ -137,22 +159,26 @@ class ClientDaemon:
                                         thread = threading.Thread(target=self.send_display, args=[connection])
                                         thread.start()
 
+                                        ping_logger.info(f"Start sending Cursor to {trans_clt.transmission_target}")
+                                        thread = threading.Thread(target=self.send_cursor, args=[connection])
+                                        thread.start()
+
                                         # TODO: Start sending display
                                         # TODO: Start receiving keys
                                         # while True:
                                         #     msg = bytes(input("send>"), 'utf-8')
                                         #     trans_session.send_display(msg)
-                                        self.ping_wait = self.default_ping_wait
                                 else:
                                     # TODO: On second client wrong password
                                     ping_logger.warning("Wrong password, terminating connection.")
-                                    self.ping_wait = self.default_ping_wait
                                     self.clt.send_to_client(
                                         header['ses'],
                                         self.TERM + " " + "Not permitted")
                         case self.TERM:
-                            self.ping_wait = self.default_ping_wait
                             ping_logger.info("Session terminated: " + ' '.join(args))
+                            cs_id = self.connection_storage.get_connection_id_by_ses(header['ses'])
+                            if cs_id is not None:
+                                self.connection_storage.remove_connection(cs_id)
                         case self.ACC:
                             # On sending client (Subject -> Wants to connect)
                             if len(args) == 6:
@@ -172,34 +198,36 @@ class ClientDaemon:
                                             fingerprint=fingerprint,
                                             transmission=trans_session)
 
-                                        connection = self.connection_storage.connections[cs_id]
+                                        connection = self.connection_storage.get_connection(cs_id)
                                         ping_logger.info("Receiving transmission data")
-                                        connection.transmission.receive_display(self.handle_display)
-
-                                        ping_logger.info("Start sending keys")
-                                        thread = threading.Thread(target=self.start_gui, args=[connection])
-                                        thread.start()
+                                        if self.headless:
+                                            self.headless_viewer = HeadlessViewer(self.record_file)
+                                            connection.transmission.receive_display(
+                                                self.headless_viewer.handle_display)
+                                        else:
+                                            connection.transmission.receive_display(self.handle_display,
+                                                                                    self.handle_cursor)
+
+                                            ping_logger.info("Start sending keys")
+                                            thread = threading.Thread(target=self.start_gui, args=[connection])
+                                            thread.start()
 
                                         # TODO: Start sending keys
                                         # TODO: Receive Display
                                         # while True:
                                         #     msg = bytes(input("send>"), 'utf-8')
                                         #     trans_session.send_display(msg)
-                                        self.ping_wait = self.default_ping_wait
                                     else:
                                         ping_logger.warning(
                                             "Wrong pending_password, but correct fingerprint, terminating connection.")
-                                        self.ping_wait = self.default_ping_wait
                                         self.clt.send_to_client(
                                             header['ses'],
                                             self.TERM + " " + "Not permitted")
                                 else:
                                     ping_logger.warning("Not waiting for that connection, terminating connection")
-                                    self.ping_wait = self.default_ping_wait
                                     self.clt.send_to_client(
                                         header['ses'],
                                         self.TERM + " " + "Not permitted")
-                            self.ping_wait = self.default_ping_wait
                             ping_logger.info("Session accepted")
                         case self.WARN:
                             ping_logger.warning(f"Client received a warning from {header}: {''.join(args)}")
@@ -214,9 +242,8 @@ class ClientDaemon:
         except Exception as e:
             ping_logger.exception(e)
 
-    def send_init_to_client(self, ses: int):
-        self.clt.send_to_client(ses, "INIT " + self.get_client_info(pending_session=ses))
-        self.ping_wait = 1
+    def send_init_to_client(self, ses: int, password: str = None):
+        self.clt.send_to_client(ses, "INIT " + self.get_client_info(pending_session=ses, password=password))
 
     def send_accept_to_client(self, ses: int, pending_password: str, connection: ConnectionObj):
         self.clt.send_to_client(
@@ -225,7 +252,6 @@ class ClientDaemon:
             + " "
             + self.get_client_info(pending_password=pending_password,
                                    conn=connection))
-        self.ping_wait = 1
 
     def reset(self):
         # TODO: Reset everything
@@ -254,19 +280,32 @@ class ClientDaemon:
         thread.start()
 
     def ping_loop(self):
+        # Pushed packages are answered in this thread, the reader thread of the connection must not block
+        next_ping = time.monotonic() + self.ping_wait
         while not self.ping_loop_event.is_set():
-            pkg = self.clt.ping()
-            if pkg[1]:
-                self.answer_ping_message(*pkg)
-            self.ping_loop_event.wait(self.ping_wait)
-
-    def connect_to_client(self, client_id) -> int:
+            try:
+                self.answer_package(self.pushed_packages.get(timeout=max(next_ping - time.monotonic(), 0)))
+            except queue.Empty:
+                pass
+            # The keepalive is due even while packages are pushed, it also fetches the packages that are pending
+            if time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + self.ping_wait
+                self.answer_package(self.clt.ping())
+
+    def answer_package(self, pkg):
+        if pkg and pkg[0]['typ'] == self.clt.control_channel.BATCH:
+            for batched in self.clt.control_channel.parse_batch(pkg[1]):
+                self.answer_ping_message(*batched)
+        elif pkg and pkg[1]:
+            self.answer_ping_message(*pkg)
+
+    def connect_to_client(self, client_id, password: str = None) -> int:
         trans_clt = self.create_udp_session()
         ses, pub_sock = self.clt.req_client(client_id, trans_clt)  # TODO: Retry if failed
         if ses and pub_sock:
             trans_clt.public_sock = pub_sock
             self.connection_storage.add_connection(client_id, ses, True, transmission=trans_clt)
-            self.send_init_to_client(ses)
+            self.send_init_to_client(ses, password)
             return ses
         else:
             # TODO: Create Exceptions
@@ -278,26 +317,41 @@ class ClientDaemon:
         self.clt.close()
         self.stopping = True
         self.ping_loop_event.set()
+        self.pushed_packages.put(None)
+        if self.headless_viewer:
+            self.headless_viewer.close()
 
     def handle_display(self, display: Tuple[dict, bytes, Any]):
+        from PIL import ImageTk
         data = display[1]
         try:
-            img = cv2.imdecode(np.fromstring(data, dtype=np.uint8), 1)
+            img = registry.decode(data)
             if img is not None:
                 img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
                 img = Image.fromarray(img, mode="RGB")
                 img = ImageTk.PhotoImage(image=img)
-                self.main_window.stream_frame.config(image=img)
-                self.main_window.stream_frame.image = img
+                self.main_window.show_frame(img)
         except Exception as e:
             logging.getLogger('yard_client.receive_display').exception(e)
 
+    def handle_cursor(self, header: dict, cursor: CursorObj, address: Any):
+        # The cursor is drawn locally, so moving it does not wait for a new frame
+        if not self.main_window:
+            return
+        try:
+            self.main_window.move_cursor(*cursor.coordinates)
+        except Exception as e:
+            logging.getLogger('yard_client.receive_cursor').exception(e)
+
     def start_key_receiver(self, connection: ConnectionObj):
+        from pynput.keyboard import Controller as KeyController
+        from pynput.mouse import Controller as MouseController
         self.keyboard = KeyController()
         self.mouse = MouseController()
         connection.transmission.receive_key(self.handle_key)
 
-    def handle_key(self, header: dict, key: Input, address: Any):
+    def handle_key(self, header: dict, key: 'Input', address: Any):
+        from objects.inputobj import Key, Mouse
         key_logger = logging.getLogger('yard_client.receive_key')   # TODO: Release key if to long
         if isinstance(key, Key):
             try:
@@ -318,8 +372,9 @@ class ClientDaemon:
                         self.mouse.release(key.get_command())
 
     def start_gui(self, connection: ConnectionObj):
+        from display.mainwindow import MainWindow
 
-        def send_keys(input_obj: Input):
+        def send_keys(input_obj: 'Input'):
             nonlocal connection
             connection.transmission.send_key(pickle.dumps(input_obj))
 
@@ -327,15 +382,45 @@ class ClientDaemon:
             self.main_window = MainWindow(send_keys)
             self.main_window.start()
 
+    def get_frame_source(self) -> FrameSource:
+        # Called by send_display() and send_cursor() at the same time, the source is created once
+        with self.frame_source_lock:
+            if not self.frame_source:
+                self.frame_source = create_frame_source(conf['client'].get('frame_source', {}))
+            return self.frame_source
+
     def send_display(self, connection: ConnectionObj):
-        self.capture = mss.mss()
-        while True:
-            img = np.array(self.capture.grab(self.capture.monitors[0]))
-            connection.transmission.send_display(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 30])[1])
+        # The captured display does not contain the cursor, it is sent separately by send_cursor()
+        frame_source = self.get_frame_source()
+        last_img = None
+        while not self.stopping:
+            stamp = time.time()
+            img = frame_source.grab()
+            # Skip unchanged frames, so that cursor-only movement costs no frame encode
+            if last_img is None or not np.array_equal(img, last_img):
+                connection.transmission.send_display(connection.transmission.encode_display(img), stamp)
+                last_img = img
             time.sleep(0.001)
 
+    def send_cursor(self, connection: ConnectionObj):
+        # Only the position, the shape isn't captured (see CursorObj)
+        from pynput.mouse import Controller as MouseController
+        mouse = self.mouse or MouseController()
+        left, top = self.get_frame_source().origin
+        last_position = None
+        last_send = 0
+        while not self.stopping:
+            x, y = mouse.position
+            position = (int(x) - left, int(y) - top)
+            if position != last_position or time.time() - last_send > self.cursor_resend:
+                connection.transmission.send_cursor(CursorObj(position))
+                last_position = position
+                last_send = time.time()
+            time.sleep(self.cursor_wait)
+
     def create_udp_session(self) -> YardTransmission:
         clt_conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        trans_clt = YardTransmission(('0.0.0.0', 0), None, self.server_socket, clt_conn, self.transmission_buffer)
+        trans_clt = YardTransmission(('0.0.0.0', 0), None, self.server_socket, clt_conn, self.transmission_buffer,
+                                     self.transmission_codec)
         trans_clt.connect()
         return trans_clt
@@ -0,0 +1,381 @@
+"""
+Client directory module.
+
+The directory is shared by all workers (or nodes) of a server. It maps every client ID to the fingerprint and
+the home of the client (the worker that holds the socket) and allocates the session ids of all clients,
+so client IDs and session ids are unique across workers.
+
+Example:
+    from objects.clientdirectory import DirectoryManager
+
+    manager = DirectoryManager()
+    manager.start()
+    directory = manager.ClientDirectory()  # Proxy, can be passed to forked workers
+
+The nodes of a cluster share a SqliteClientDirectory, a database file that all nodes open on the same host:
+    directory = SqliteClientDirectory('data/directory.sqlite3')
+The database uses WAL, which needs shared memory, so it doesn't work on a network file system. This limits
+the SQLite directory to testing a cluster on one host.
+"""
+
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from multiprocessing.managers import BaseManager
+from typing import Dict, Optional, Tuple
+
+
+class ClientDirectory(ABC):
+    """
+    Directory of the clients of all workers.
+
+    clients: client_id -> (fingerprint, node)
+    sessions: client_id -> {session_id: partner_id}
+    rendezvous: password -> node where the REQ waits for the UDP message with the password
+    """
+
+    @abstractmethod
+    def register(self, client_id: str, fingerprint: uuid.UUID, node: str, *, replace: bool = False) -> bool:
+        """
+        Register a client at its home.
+
+        :param client_id: str: The id of the client
+        :param fingerprint: uuid.UUID: The fingerprint of the client
+        :param node: str: The home of the client
+        :param replace: bool(Optional, keyword-only): Move an existing client to the new home
+        :return: bool: False when the client_id is already used
+        """
+
+    @abstractmethod
+    def unregister(self, client_id: str, node: str) -> None:
+        """
+        Remove a client and its sessions, if the client still lives at the passed home.
+
+        :param client_id: str: The id of the client
+        :param node: str: The home of the client
+        :return: None
+        """
+
+    @abstractmethod
+    def unregister_node(self, node: str) -> None:
+        """
+        Remove all clients of a home, e.g. when a node restarts without its clients.
+
+        :param node: str: The home of the clients
+        :return: None
+        """
+
+    @abstractmethod
+    def get(self, client_id: str) -> Optional[Tuple[uuid.UUID, str]]:
+        """
+        :param client_id: str: The id of the client
+        :return: Tuple[fingerprint, node] | None
+        """
+
+    @abstractmethod
+    def get_by_fingerprint(self, fingerprint: uuid.UUID) -> Optional[Tuple[str, str]]:
+        """
+        :param fingerprint: uuid.UUID: The fingerprint of the client
+        :return: Tuple[client_id, node] | None
+        """
+
+    @abstractmethod
+    def create_session(self, client_id1: str, client_id2: str, max_sessions: int) -> int:
+        """
+        Allocate a session id that is free for both clients, an existing session of the pair is returned.
+
+        :param client_id1: str: The client
+        :param client_id2: str: The partner
+        :param max_sessions: int: Session ids are lower than max_sessions
+        :return: int: The session id
+        :raises OverflowError: No session left for client or partner
+        """
+
+    @abstractmethod
+    def delete_session(self, client_id1: str, client_id2: str, ses: int) -> None:
+        """
+        Release the session id of both clients.
+
+        :param client_id1: str: The client
+        :param client_id2: str: The partner
+        :param ses: int: The session id
+        :return: None
+        """
+
+    @abstractmethod
+    def add_rendezvous(self, password: str, node: str) -> None:
+        """
+        Record where a REQ waits for its UDP message, the worker that receives the UDP message forwards it there.
+
+        :param password: str: The password of the REQ
+        :param node: str: The worker of the REQ
+        :return: None
+        """
+
+    @abstractmethod
+    def get_rendezvous(self, password: str) -> Optional[str]:
+        """
+        :param password: str: The password of the UDP message
+        :return: str | None: The worker where the REQ of the password waits
+        """
+
+    @abstractmethod
+    def remove_rendezvous(self, password: str, node: str) -> None:
+        """
+        Remove a rendezvous after the REQ was answered or timed out.
+
+        :param password: str: The password of the REQ
+        :param node: str: The worker of the REQ
+        :return: None
+        """
+
+
+class LocalClientDirectory(ClientDirectory):
+    """
+    Client directory in the memory of one process.
+
+    Used by a single server and, hosted by a DirectoryManager, shared by the workers of a server.
+    """
+    clients: Dict[str, Tuple[uuid.UUID, str]] = None
+    fingerprints: Dict[uuid.UUID, str] = None
+    sessions: Dict[str, Dict[int, str]] = None
+    rendezvous: Dict[str, str] = None
+    lock: threading.Lock = None
+
+    def __init__(self):
+        self.clients = {}
+        self.fingerprints = {}
+        self.sessions = {}
+        self.rendezvous = {}
+        self.lock = threading.Lock()
+
+    def register(self, client_id: str, fingerprint: uuid.UUID, node: str, *, replace: bool = False) -> bool:
+        with self.lock:
+            if client_id in self.clients and not replace:
+                return False
+            self.clients[client_id] = (fingerprint, node)
+            self.fingerprints[fingerprint] = client_id
+            return True
+
+    def unregister(self, client_id: str, node: str) -> None:
+        with self.lock:
+            entry = self.clients.get(client_id, None)
+            if not entry or entry[1] != node:
+                return
+            self.clients.pop(client_id)
+            if self.fingerprints.get(entry[0], None) == client_id:
+                self.fingerprints.pop(entry[0])
+            for ses, partner_id in self.sessions.pop(client_id, {}).items():
+                self.sessions.get(partner_id, {}).pop(ses, None)
+
+    def unregister_node(self, node: str) -> None:
+        for client_id, (_, home) in list(self.clients.items()):
+            if home == node:
+                self.unregister(client_id, node)
+        with self.lock:
+            for password, home in list(self.rendezvous.items()):
+                if home == node:
+                    del self.rendezvous[password]
+
+    def get(self, client_id: str) -> Optional[Tuple[uuid.UUID, str]]:
+        return self.clients.get(client_id, None)
+
+    def get_by_fingerprint(self, fingerprint: uuid.UUID) -> Optional[Tuple[str, str]]:
+        with self.lock:
+            client_id = self.fingerprints.get(fingerprint, None)
+            return (client_id, self.clients[client_id][1]) if client_id else None
+
+    def create_session(self, client_id1: str, client_id2: str, max_sessions: int) -> int:
+        with self.lock:
+            sessions1 = self.sessions.setdefault(client_id1, {})
+            sessions2 = self.sessions.setdefault(client_id2, {})
+            for ses, partner_id in sessions1.items():
+                if partner_id == client_id2:
+                    return ses
+            for ses in range(1, max_sessions):
+                if ses not in sessions1 and ses not in sessions2:
+                    sessions1[ses] = client_id2
+                    sessions2[ses] = client_id1
+                    return ses
+            raise OverflowError("Too many sessions for client or partner")
+
+    def delete_session(self, client_id1: str, client_id2: str, ses: int) -> None:
+        with self.lock:
+            if self.sessions.get(client_id1, {}).get(ses, None) == client_id2:
+                self.sessions[client_id1].pop(ses)
+                self.sessions.get(client_id2, {}).pop(ses, None)
+
+    def add_rendezvous(self, password: str, node: str) -> None:
+        with self.lock:
+            self.rendezvous[password] = node
+
+    def get_rendezvous(self, password: str) -> Optional[str]:
+        return self.rendezvous.get(password, None)
+
+    def remove_rendezvous(self, password: str, node: str) -> None:
+        with self.lock:
+            if self.rendezvous.get(password, None) == node:
+                del self.rendezvous[password]
+
+
+class SqliteClientDirectory(ClientDirectory):
+    """
+    Client directory in a SQLite database, shared by the nodes of a cluster on the same host (see the module).
+
+    Every change is one transaction, session ids are allocated in an immediate transaction, so two nodes
+    can't allocate the same id for a client. A transaction may wait up to 'busy_timeout' seconds for the other
+    nodes, the server calls the directory outside its storage lock and, in asyncio mode, outside the event loop.
+
+    SqliteClientDirectory(path) -> SqliteClientDirectory
+
+    :param path: str: The path of the database file
+    """
+    busy_timeout = 5.0
+
+    path: str = None
+    connection: sqlite3.Connection = None
+    lock: threading.Lock = None
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit, the transactions are started explicitly
+        self.connection = sqlite3.connect(path, timeout=self.busy_timeout, isolation_level=None,
+                                          check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS clients (
+                    client_id TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL UNIQUE,
+                    node TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS clients_node ON clients (node);
+                CREATE TABLE IF NOT EXISTS sessions (
+                    client_id TEXT NOT NULL,
+                    ses INTEGER NOT NULL,
+                    partner_id TEXT NOT NULL,
+                    PRIMARY KEY (client_id, ses)
+                );
+                CREATE TABLE IF NOT EXISTS rendezvous (
+                    password TEXT PRIMARY KEY,
+                    node TEXT NOT NULL
+                );
+            """)
+
+    def register(self, client_id: str, fingerprint: uuid.UUID, node: str, *, replace: bool = False) -> bool:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                exists = self.connection.execute("SELECT 1 FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+                if exists and not replace:
+                    return False
+                # A fingerprint belongs to one client, the old entry of a fingerprint is replaced
+                self.connection.execute("DELETE FROM clients WHERE fingerprint = ? AND client_id != ?",
+                                        (str(fingerprint), client_id))
+                self.connection.execute("INSERT OR REPLACE INTO clients VALUES (?, ?, ?)",
+                                        (client_id, str(fingerprint), node))
+                return True
+            finally:
+                self.connection.execute("COMMIT")
+
+    def unregister(self, client_id: str, node: str) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.connection.execute("DELETE FROM clients WHERE client_id = ? AND node = ?",
+                                           (client_id, node)).rowcount:
+                    self.delete_sessions_of(client_id)
+            finally:
+                self.connection.execute("COMMIT")
+
+    def unregister_node(self, node: str) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                client_ids = [row[0] for row in
+                              self.connection.execute("SELECT client_id FROM clients WHERE node = ?", (node,))]
+                self.connection.execute("DELETE FROM clients WHERE node = ?", (node,))
+                for client_id in client_ids:
+                    self.delete_sessions_of(client_id)
+                self.connection.execute("DELETE FROM rendezvous WHERE node = ?", (node,))
+            finally:
+                self.connection.execute("COMMIT")
+
+    def delete_sessions_of(self, client_id: str) -> None:
+        """
+        Delete the sessions of a client on both sides, must be called in a transaction.
+
+        :param client_id: str: The id of the client
+        :return: None
+        """
+        self.connection.execute("DELETE FROM sessions WHERE partner_id = ?", (client_id,))
+        self.connection.execute("DELETE FROM sessions WHERE client_id = ?", (client_id,))
+
+    def get(self, client_id: str) -> Optional[Tuple[uuid.UUID, str]]:
+        with self.lock:
+            row = self.connection.execute("SELECT fingerprint, node FROM clients WHERE client_id = ?",
+                                          (client_id,)).fetchone()
+        return (uuid.UUID(row[0]), row[1]) if row else None
+
+    def get_by_fingerprint(self, fingerprint: uuid.UUID) -> Optional[Tuple[str, str]]:
+        with self.lock:
+            row = self.connection.execute("SELECT client_id, node FROM clients WHERE fingerprint = ?",
+                                          (str(fingerprint),)).fetchone()
+        return tuple(row) if row else None
+
+    def create_session(self, client_id1: str, client_id2: str, max_sessions: int) -> int:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT ses FROM sessions WHERE client_id = ? AND partner_id = ?",
+                                              (client_id1, client_id2)).fetchone()
+                if row:
+                    return row[0]
+                used = {row[0] for row in self.connection.execute(
+                    "SELECT ses FROM sessions WHERE client_id IN (?, ?)", (client_id1, client_id2))}
+                for ses in range(1, max_sessions):
+                    if ses not in used:
+                        self.connection.executemany("INSERT INTO sessions VALUES (?, ?, ?)",
+                                                    [(client_id1, ses, client_id2), (client_id2, ses, client_id1)])
+                        return ses
+                raise OverflowError("Too many sessions for client or partner")
+            finally:
+                self.connection.execute("COMMIT")
+
+    def delete_session(self, client_id1: str, client_id2: str, ses: int) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "DELETE FROM sessions WHERE ses = ? AND ((client_id = ? AND partner_id = ?) "
+                    "OR (client_id = ? AND partner_id = ?))", (ses, client_id1, client_id2, client_id2, client_id1))
+            finally:
+                self.connection.execute("COMMIT")
+
+    def add_rendezvous(self, password: str, node: str) -> None:
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO rendezvous VALUES (?, ?)", (password, node))
+
+    def get_rendezvous(self, password: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute("SELECT node FROM rendezvous WHERE password = ?", (password,)).fetchone()
+        return row[0] if row else None
+
+    def remove_rendezvous(self, password: str, node: str) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM rendezvous WHERE password = ? AND node = ?", (password, node))
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class DirectoryManager(BaseManager):
+    """
+    Hosts a LocalClientDirectory in a separate process, the workers use it through a proxy.
+    """
+
+
+DirectoryManager.register('ClientDirectory', LocalClientDirectory)
@@ -1,9 +1,10 @@
-import json
+import contextlib
 import logging
 import socket
 import uuid
-from typing import Optional, Tuple
+from typing import Optional, Tuple, ContextManager, Dict
 
+from objects.pendingqueue import PendingQueue
 from objects.yardexceptions import SessionAlreadyExists
 
 
@@ -11,13 +12,18 @@ class ClientObj:
     """
     An object-class for saving information about a client.
 
-    id_len: int = The required length of the client_id
+    id_len: int = The required length of the client_id, set by the server from 'id_len' of the settings
 
-    pending_packages =  [
-        (ses, package),
-        (ses, package),
+    The attributes are slots, a server holds many clients. The fingerprint is kept as its 16 bytes
+    (fingerprint_bytes), the property fingerprint returns it as uuid.UUID.
+
+    pending_packages = PendingQueue(
+        ses: deque([(ses, package), ...]),
         ...
-    ]
+    ) -> Bounded per session, delivered round-robin, see PendingQueue
+
+    used_sessions: Bit i is set when session id i is used
+    partner_sessions: Dict[partner_id: session_id] -> Index of the sessions by partner
 
     :param client_id: str: The id of the client. (e.g. ABCD1234)
     :param fingerprint: uuid.UUID: The unique id for the client -> UUIDv4
@@ -25,25 +31,33 @@ class ClientObj:
     :param sock: socket.socket(Optional): If the client is connected then sock is the current socket
     :raises ValueError: If you pass the wrong format of the client_id or fingerprint an error will be raised.
     """
-    conf = json.load(open('settings/conf.json'))['server']
-    id_len: int = conf['id_len']
+    __slots__ = ('client_id', 'fingerprint_bytes', 'sessions', 'used_sessions', 'partner_sessions', 'online',
+                 'socket', 'pending_packages', 'storage')
 
-    client_id: str = None
-    fingerprint: uuid.UUID = None
-    sessions: dict[int: 'SessionObj'] = None
-    online: bool = None
-    socket: Optional['socket.socket'] = None
-    pending_packages: list[Tuple[int, list]] = None
+    id_len: int = 8
+
+    client_id: str
+    fingerprint_bytes: bytes
+    sessions: dict[int: 'SessionObj']
+    used_sessions: int
+    partner_sessions: Dict[str, int]
+    online: bool
+    socket: Optional['socket.socket']
+    pending_packages: PendingQueue
+    storage: Optional['ClientStorage']  # The storage that holds the client, it is notified about sessions and sockets
 
     def __init__(self, client_id: str, fingerprint: uuid.UUID, online: bool = False, sock=None):
         if len(client_id) == self.id_len:
             if fingerprint.version == 4:
                 self.client_id = client_id
-                self.fingerprint = fingerprint
+                self.fingerprint_bytes = fingerprint.bytes
                 self.sessions = {}
+                self.used_sessions = 0
+                self.partner_sessions = {}
                 self.online = online
                 self.socket = sock
-                self.pending_packages = []
+                self.pending_packages = PendingQueue()
+                self.storage = None
             else:
                 raise ValueError('Client fingerprint is not version 4')
         else:
@@ -56,6 +70,24 @@ class ClientObj:
                     'pending_packages': str(self.pending_packages),
                     'online': str(self.online)})
 
+    @property
+    def fingerprint(self) -> uuid.UUID:
+        return uuid.UUID(bytes=self.fingerprint_bytes)
+
+    @fingerprint.setter
+    def fingerprint(self, fingerprint: uuid.UUID) -> None:
+        self.fingerprint_bytes = fingerprint.bytes
+
+    def locked(self, *partners: 'ClientObj') -> ContextManager:
+        """
+        Lock the client and its partners in the storage, e.g. to change the sessions of both sides at once.
+        Without storage nothing is locked.
+
+        :param partners: ClientObj: Clients that are locked together with the client
+        :return: ContextManager
+        """
+        return self.storage.client_lock(self, *partners) if self.storage else contextlib.nullcontext()
+
     def add_session(self, session: 'SessionObj'):
         """
         Add a session to clients sessions.
@@ -66,6 +98,10 @@ class ClientObj:
 
         if not self.sessions.get(session.session_id, None):
             self.sessions[session.session_id] = session
+            self.used_sessions |= 1 << session.session_id
+            partner = session.get_partner(self.client_id)
+            if partner:
+                self.partner_sessions[partner.client_id] = session.session_id
         else:
             raise SessionAlreadyExists(f"Client has already a session with this ID: {session.session_id}")
 
@@ -81,11 +117,39 @@ class ClientObj:
         if partner:
             logging.getLogger('yard_server.client').debug(
                 f"Delete session {ses} of {self.client_id} and {partner.client_id}")
-            return self.sessions.pop(ses), partner.sessions.pop(ses)
+            return self.remove_session(ses), partner.remove_session(ses)
         else:
             logging.getLogger('yard_server.client').debug(
                 f"Delete session {ses} of {self.client_id}")
-            return self.sessions.pop(ses), None
+            return self.remove_session(ses), None
+
+    def remove_session(self, ses: int) -> 'SessionObj':
+        """
+        Remove the session of the passed id from this client only.
+
+        :param ses: int: The id of the session
+        :return: SessionObj
+        :raises KeyError: The client has no session with this id
+        """
+        session = self.sessions.pop(ses)
+        self.used_sessions &= ~(1 << ses)
+        partner = session.get_partner(self.client_id)
+        if partner and self.partner_sessions.get(partner.client_id, None) == ses:
+            del self.partner_sessions[partner.client_id]
+        return session
+
+    def set_sessions(self, sessions: Dict[int, 'SessionObj']) -> None:
+        """
+        Replace all sessions of the client and rebuild the session id bitmap and the partner index.
+
+        :param sessions: dict[session_id: SessionObj]: The new sessions
+        :return: None
+        """
+        self.sessions = {}
+        self.used_sessions = 0
+        self.partner_sessions = {}
+        for session in sessions.values():
+            self.add_session(session)
 
     def set_online(self, sock: 'socket.socket') -> None:
         """
@@ -98,8 +162,11 @@ class ClientObj:
         """
 
         self.set_offline(leave_sock=True)
-        self.online = True
-        self.socket = sock
+        with self.locked():
+            self.online = True
+            old_sock, self.socket = self.socket, sock
+            if self.storage:
+                self.storage.socket_changed(self, old_sock)
         logging.getLogger('yard_server.client').info(f"{self.fingerprint} is now online")
 
     def set_offline(self, *, leave_sock: bool = False) -> None:
@@ -114,13 +181,18 @@ class ClientObj:
         :param leave_sock: bool: Delete sock or not
         :return: None
         """
-        if not leave_sock:
-            self.socket.close()
-            self.socket = None
-        self.online = False
+        with self.locked():
+            if not leave_sock and self.socket is not None:
+                old_sock = self.socket
+                self.socket.close()
+                self.socket = None
+                if self.storage:
+                    self.storage.socket_changed(self, old_sock)
+            self.online = False
+        # Locks the client and the partner of each session
         self.delete_all_sessions()
-        self.sessions = {}
-        self.pending_packages = []
+        with self.locked():
+            self.pending_packages.clear()
         logging.getLogger('yard_server.client').info(f"{self.fingerprint} is now offline")
 
     def is_initialized(self, sock: 'socket.socket'):
@@ -129,7 +201,7 @@ class ClientObj:
         :param sock: The socket that the client must have
         :return:
         """
-        return self.socket == sock and self.online and self.fingerprint and self.client_id
+        return self.socket == sock and self.online and self.fingerprint_bytes and self.client_id
 
     ######################
     #     Sessions       #
@@ -155,11 +227,7 @@ class ClientObj:
         :param target: ClientObj: The target
         :return: int: The session or 0
         """
-        for session in self.sessions.values():
-            if session.connection[0] == target or session.connection[1] == target:
-                return session.session_id
-        else:
-            return 0
+        return self.partner_sessions.get(target.client_id, 0)
 
     def delete_pending_packages_per_session(self, ses: int) -> None:
         """
@@ -168,10 +236,10 @@ class ClientObj:
         :param ses: int: ID of the session
         :return: None
         """
-        for index, package in enumerate(self.pending_packages or []):
-            if package[0] == ses:
-                logging.getLogger('yard_server.client').debug(
-                    f"Delete pending packages {self.pending_packages.pop(index)}")
+        with self.locked():
+            deleted = self.pending_packages.purge(ses)
+        if deleted:
+            logging.getLogger('yard_server.client').debug(f"Deleted {deleted} pending packages of session {ses}")
 
     def delete_session(self, ses: int) -> bool:
         """
@@ -183,22 +251,54 @@ class ClientObj:
 
         logging.getLogger('yard_server.client').debug(f"Terminate session: {ses}")
 
-        # First clear the already pending packages for the given session
-        self.delete_pending_packages_per_session(ses)
-
-        # If session exists, pop session, get partner and do the same -> return True
-        if self.sessions.get(ses, None):
+        # Client and partner are locked together, so the session is deleted on both sides at once.
+        # The partner is read again under the locks, the session may have changed in the meantime.
+        while True:
             target_client = self.get_partner_of_session(ses)
-            self.pop_session(ses)
-            if target_client:
-                target_client.delete_pending_packages_per_session(ses)
-            return True
+            with self.locked(*((target_client,) if target_client else ())):
+                if self.get_partner_of_session(ses) is not target_client:
+                    continue
+                # First clear the already pending packages for the given session
+                self.delete_pending_packages_per_session(ses)
+
+                # If session exists, pop session, get partner and do the same -> return True
+                if not self.sessions.get(ses, None):
+                    return False
+                self.pop_session(ses)
+                if target_client:
+                    target_client.delete_pending_packages_per_session(ses)
+            break
+        if self.storage:
+            self.storage.session_deleted(self, target_client, ses)
+        return True
 
     def delete_all_sessions(self) -> None:
         """
         Delete all sessions and pending packages.
+        Must not be called while the client is locked, each session locks the client and its partner.
 
         :return: None
         """
-        for key in tuple(self.sessions.keys()):
+        with self.locked():
+            keys = tuple(self.sessions.keys())
+        for key in keys:
             self.delete_session(key)
+
+
+class RemoteClientObj(ClientObj):
+    """
+    A client whose socket is held by another worker or node (its home).
+
+    It is the partner in the sessions of local clients, packages for it are forwarded to its home.
+
+    :param client_id: str: The id of the client. (e.g. ABCD1234)
+    :param fingerprint: uuid.UUID: The unique id for the client -> UUIDv4
+    :param node: str: The home of the client
+    """
+    __slots__ = ('node',)
+
+    node: str
+
+    def __init__(self, client_id: str, fingerprint: uuid.UUID, node: str):
+        super().__init__(client_id, fingerprint, online=True)
+        self.node = node
@@ -0,0 +1,162 @@
+"""
+Client registry module.
+
+The registry keeps the client IDs and fingerprints of a server across restarts. Changes are collected
+in memory and written to SQLite in batches by a writer thread (write-behind), so the connection threads
+never wait for the disk. On startup the storage loads all registered clients.
+
+Example:
+    registry = ClientRegistry('data/registry.sqlite3').start()
+    storage = ClientStorage(registry=registry)  # Loads the clients
+    ...
+    registry.close()  # Writes the last changes
+"""
+
+import logging
+import sqlite3
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+
+class ClientRegistry:
+    """
+    Persistent mapping client_id <-> fingerprint in a SQLite database (WAL mode) with write-behind.
+
+    ClientRegistry(path, flush_interval, batch_size) -> ClientRegistry
+
+    :param path: str: The path of the database file
+    :param flush_interval: float(Optional): Seconds between two writes of the collected changes
+    :param batch_size: int(Optional): Number of collected changes that triggers an early write
+    """
+    path: str = None
+    flush_interval: float = None
+    batch_size: int = None
+
+    connection: sqlite3.Connection = None
+    changes: Dict[str, Optional[uuid.UUID]] = None  # client_id -> fingerprint, None deletes the client
+    lock: threading.Lock = None
+    flush_lock: threading.Lock = None
+    wakeup: threading.Event = None
+    stopping: bool = False
+    thread: threading.Thread = None
+
+    written: int = 0
+    flushes: int = 0
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # The connection is used by the writer thread, load() and close()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS clients ("
+                                "client_id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL UNIQUE)")
+        self.connection.commit()
+        self.changes = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.written = 0
+        self.flushes = 0
+
+    def start(self) -> 'ClientRegistry':
+        """
+        Start the writer thread.
+
+        :return: ClientRegistry: self
+        """
+        self.thread = threading.Thread(target=self.run, name='client-registry', daemon=True)
+        self.thread.start()
+        return self
+
+    def load(self) -> List[Tuple[str, uuid.UUID]]:
+        """
+        :return: List[Tuple[client_id, fingerprint]]: All registered clients
+        """
+        with self.flush_lock:
+            rows = self.connection.execute("SELECT client_id, fingerprint FROM clients").fetchall()
+        return [(client_id, uuid.UUID(fingerprint)) for client_id, fingerprint in rows]
+
+    def put(self, client_id: str, fingerprint: uuid.UUID) -> None:
+        """
+        Register a client, it is written with the next batch.
+
+        :param client_id: str: The id of the client
+        :param fingerprint: uuid.UUID: The fingerprint of the client
+        :return: None
+        """
+        self.change(client_id, fingerprint)
+
+    def delete(self, client_id: str) -> None:
+        """
+        Remove a client, it is removed with the next batch.
+
+        :param client_id: str: The id of the client
+        :return: None
+        """
+        self.change(client_id, None)
+
+    def change(self, client_id: str, fingerprint: Optional[uuid.UUID]) -> None:
+        with self.lock:
+            # Only the last change of a client is written
+            self.changes.pop(client_id, None)
+            self.changes[client_id] = fingerprint
+            if len(self.changes) >= self.batch_size:
+                self.wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Write the collected changes in one transaction.
+
+        :return: int: Number of written changes
+        """
+        with self.flush_lock:
+            with self.lock:
+                changes, self.changes = self.changes, {}
+            if not changes:
+                return 0
+            try:
+                with self.connection:
+                    for client_id, fingerprint in changes.items():
+                        if fingerprint is None:
+                            self.connection.execute("DELETE FROM clients WHERE client_id = ?", (client_id,))
+                        else:
+                            # A fingerprint belongs to one client, e.g. after a renewed ID
+                            self.connection.execute("DELETE FROM clients WHERE fingerprint = ? AND client_id != ?",
+                                                    (str(fingerprint), client_id))
+                            self.connection.execute("INSERT OR REPLACE INTO clients VALUES (?, ?)",
+                                                    (client_id, str(fingerprint)))
+            except sqlite3.Error as e:
+                # Keep the changes for the next try, newer changes of the same clients win
+                logging.getLogger('yard_server.registry').error(f"Writing {len(changes)} changes failed: {e}")
+                with self.lock:
+                    changes.update(self.changes)
+                    self.changes = changes
+                return 0
+            self.written += len(changes)
+            self.flushes += 1
+            return len(changes)
+
+    def run(self) -> None:
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """
+        Stop the writer thread and write the last changes.
+
+        :return: None
+        """
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        with self.flush_lock:
+            self.connection.close()
@@ -5,11 +5,25 @@ from protocol.yardtransmission import YardTransmission
 
 
 class ConnectionObj:
-    client_id: str = None
-    fingerprint: Optional[uuid.UUID] = None
-    session_id: int = None
-    online: bool = None
-    transmission: Optional[YardTransmission] = None
+    """
+    An object-class for saving information about a connection of the client to a partner.
+
+    The attributes are slots, the fingerprint is kept as its 16 bytes (fingerprint_bytes).
+
+    :param client_id: str: The id of the partner
+    :param session_id: int: The id of the session
+    :param fingerprint: uuid.UUID(Optional): The fingerprint of the partner -> UUIDv4
+    :param online: bool(Optional): If the connection is established or not
+    :param transmission: YardTransmission(Optional): The transmission of the connection
+    :raises ValueError: If the fingerprint is not version 4
+    """
+    __slots__ = ('client_id', 'fingerprint_bytes', 'session_id', 'online', 'transmission')
+
+    client_id: str
+    fingerprint_bytes: Optional[bytes]
+    session_id: int
+    online: bool
+    transmission: Optional[YardTransmission]
 
     def __init__(self,
                  client_id: str,
@@ -32,3 +46,11 @@ class ConnectionObj:
                     'session_id': str(self.session_id),
                     'online': str(self.online),
                     'transmission': str(self.transmission)})
+
+    @property
+    def fingerprint(self) -> Optional[uuid.UUID]:
+        return uuid.UUID(bytes=self.fingerprint_bytes) if self.fingerprint_bytes else None
+
+    @fingerprint.setter
+    def fingerprint(self, fingerprint: Optional[uuid.UUID]) -> None:
+        self.fingerprint_bytes = fingerprint.bytes if fingerprint else None
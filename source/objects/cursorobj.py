@@ -0,0 +1,45 @@
+import struct
+from typing import Tuple
+
+
+class CursorObj:
+    """
+    An object-class for transmitting the remote cursor.
+
+    The cursor is not part of the captured display, it is sent as its own small message and drawn by the viewer.
+    Only the position is sent: the sending client doesn't capture the cursor shape (mss has no access to it),
+    so the viewer draws its default arrow, also for text or resize cursors.
+
+    Package definition
+    -----------
+    x(4) + y(4)
+
+    :param coordinates: Tuple[int, int]: Position of the cursor relative to the captured display
+    """
+    package = struct.Struct('<ii')
+
+    coordinates: Tuple[int, int] = None
+
+    def __init__(self, coordinates: Tuple[int, int]):
+        self.coordinates = coordinates
+
+    def __str__(self):
+        return str({'coordinates': self.coordinates})
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: bytes: The payload of a CURSOR message
+        :raises struct.error: If a coordinate doesn't fit in 4 bytes
+        """
+        return self.package.pack(*self.coordinates)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'CursorObj':
+        """
+        :param data: bytes: The payload of a CURSOR message
+        :return: CursorObj
+        :raises ValueError: If the payload is not a cursor
+        """
+        if len(data) != CursorObj.package.size:
+            raise ValueError(f"Cursor message has {len(data)} bytes instead of {CursorObj.package.size}")
+        return CursorObj(CursorObj.package.unpack(data))
@@ -0,0 +1,241 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Tuple, Literal
+
+import cv2
+import numpy as np
+
+from objects.recording import FrameReader
+from protocol.yardcodec import registry
+
+
+class FrameSource(ABC):
+    """
+    Source of the frames that are sent to the viewer.
+
+    A frame is a np.ndarray with the shape (height, width, 4) in BGRA, like it is returned by mss.
+    """
+    origin: Tuple[int, int] = (0, 0)  # Position of the frame on the screen (for the cursor)
+
+    @abstractmethod
+    def grab(self) -> np.ndarray:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MssFrameSource(FrameSource):
+    """
+    Capture the screen with mss.
+
+    The handles of mss belong to the thread that opened them, so the capture is opened by the first grab()
+    and grab() must always be called by that thread.
+
+    :param monitor: int: The index of the monitor, 0 are all monitors together
+    """
+    capture = None
+    monitor: dict = None
+
+    def __init__(self, monitor: int = 0):
+        import mss
+        with mss.mss() as capture:
+            self.monitor = capture.monitors[monitor]
+        self.origin = (self.monitor['left'], self.monitor['top'])
+
+    def grab(self) -> np.ndarray:
+        if self.capture is None:
+            import mss
+            self.capture = mss.mss()
+        return np.array(self.capture.grab(self.monitor))
+
+    def close(self) -> None:
+        if self.capture is not None:
+            self.capture.close()
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Generate deterministic frames with NumPy, so the pipeline can be benchmarked without a display.
+
+    Content
+    -----------
+    'static': The same desktop-like frame every time
+    'scrolling': A text page that scrolls by 'scroll_speed' pixels per frame
+    'video': Smooth moving colours with noise, like a photo or video
+    'text': A text page where one line is typed per frame
+
+    :param content: str: The kind of content
+    :param size: Tuple[width, height]: The size of the frames
+    :param seed: int: Seed for the random generator, the same seed creates the same frames
+    """
+    contents = ('static', 'scrolling', 'video', 'text')
+    glyph_size = (8, 12)    # (width, height) of a character including spacing
+    scroll_speed = 4
+
+    content: str = None
+    size: Tuple[int, int] = None
+    frame_count: int = 0
+
+    def __init__(self,
+                 content: Literal['static', 'scrolling', 'video', 'text'] = 'static',
+                 size: Tuple[int, int] = (1280, 720),
+                 seed: int = 0):
+        if content not in self.contents:
+            raise ValueError(f"Unknown synthetic content: {content}")
+        self.content = content
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.frame_count = 0
+        # 7x5 random glyphs, some of them are empty (space)
+        self.glyphs = self.rng.random((64, 7, 5)) > 0.55
+        self.glyphs[:8] = False
+        self.background = self.create_desktop()
+        if content in ('scrolling', 'text'):
+            self.page = self.create_text_page(self.size[1] * 3 if content == 'scrolling' else self.size[1])
+
+    def create_desktop(self) -> np.ndarray:
+        width, height = self.size
+        # Gradient background with a few windows and bars
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        frame[..., 0] = np.linspace(120, 200, height, dtype=np.uint8)[:, None]
+        frame[..., 1] = np.linspace(60, 120, width, dtype=np.uint8)[None, :]
+        frame[..., 2] = 40
+        frame[..., 3] = 255
+        frame[:24] = (50, 50, 50, 255)
+        for i in range(4):
+            x, y = int(self.rng.integers(0, width // 2)), int(self.rng.integers(24, height // 2))
+            w, h = int(self.rng.integers(width // 6, width // 2)), int(self.rng.integers(height // 6, height // 2))
+            frame[y:y + h, x:x + w] = (235, 235, 235, 255)
+            frame[y:y + 20, x:x + w] = (180, 120, 60, 255)
+        return frame
+
+    def create_text_line(self, chars: int) -> np.ndarray:
+        glyph_w, glyph_h = self.glyph_size
+        line = np.zeros((glyph_h, chars * glyph_w), dtype=bool)
+        indexes = self.rng.integers(0, len(self.glyphs), chars)
+        for i, index in enumerate(indexes):
+            line[2:9, i * glyph_w + 1:i * glyph_w + 6] = self.glyphs[index]
+        return line
+
+    def create_text_page(self, height: int) -> np.ndarray:
+        width = self.size[0]
+        chars = width // self.glyph_size[0]
+        lines = height // self.glyph_size[1]
+        mask = np.zeros((height, width), dtype=bool)
+        for i in range(lines):
+            length = int(self.rng.integers(chars // 4, chars))
+            line = self.create_text_line(length)
+            mask[i * self.glyph_size[1]:(i + 1) * self.glyph_size[1], :line.shape[1]] = line
+        page = np.full((height, width, 4), 255, dtype=np.uint8)
+        page[mask] = (30, 30, 30, 255)
+        return page
+
+    def grab(self) -> np.ndarray:
+        width, height = self.size
+        n = self.frame_count
+        self.frame_count += 1
+        match self.content:
+            case 'static':
+                return self.background.copy()
+            case 'scrolling':
+                offset = (n * self.scroll_speed) % (self.page.shape[0] - height)
+                return self.page[offset:offset + height].copy()
+            case 'video':
+                y = np.linspace(0, 4 * np.pi, height, dtype=np.float32)[:, None]
+                x = np.linspace(0, 4 * np.pi, width, dtype=np.float32)[None, :]
+                t = n / 10
+                frame = np.empty((height, width, 4), dtype=np.uint8)
+                noise = self.rng.integers(0, 24, (height, width), dtype=np.uint8)
+                frame[..., 0] = (np.sin(x + t) * np.cos(y - t) * 100 + 120).astype(np.uint8) + noise
+                frame[..., 1] = (np.sin(x * 0.5 - t) * 100 + 120).astype(np.uint8) + noise
+                frame[..., 2] = (np.cos(y * 0.7 + t) * 100 + 120).astype(np.uint8) + noise
+                frame[..., 3] = 255
+                return frame
+            case 'text':
+                # Type one line per frame, when the page is full start again
+                glyph_h = self.glyph_size[1]
+                line = n % (height // glyph_h)
+                if line == 0:
+                    self.page[:] = 255
+                text = self.create_text_line(self.size[0] // self.glyph_size[0])
+                self.page[line * glyph_h:(line + 1) * glyph_h, :text.shape[1]][text] = (30, 30, 30, 255)
+                return self.page.copy()
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Replay the frames of a recording (see objects.recording.FrameRecorder).
+
+    :param path: str: The path of the recording
+    :param loop: bool: Start again at the end of the recording, otherwise raise EOFError
+    :param realtime: bool: Keep the timing of the recording
+    :raises ValueError: If the file is not a recording
+    """
+    max_skipped = 16  # Undecodable frames in a row until grab() gives up
+
+    reader: FrameReader = None
+    loop = True
+    realtime = False
+
+    def __init__(self, path: str, loop: bool = True, realtime: bool = False):
+        self.reader = FrameReader(path)
+        self.loop = loop
+        self.realtime = realtime
+        self.frames = iter(self.reader)
+        self.last_stamp = None
+        self.last_grab = None
+
+    def grab(self) -> np.ndarray:
+        """
+        :return: np.ndarray: The next decodable frame
+        :raises EOFError: At the end of the recording if it is not looped
+        :raises ValueError: If 'max_skipped' frames in a row could not be decoded
+        """
+        for _ in range(self.max_skipped + 1):
+            try:
+                stamp, data = next(self.frames)
+            except StopIteration:
+                if not self.loop:
+                    raise EOFError(f"End of recording {self.reader.path}")
+                self.frames = iter(self.reader)
+                self.last_stamp = None
+                stamp, data = next(self.frames)
+
+            if self.realtime and self.last_stamp is not None:
+                time.sleep(max(0.0, (stamp - self.last_stamp) - (time.time() - self.last_grab)))
+            self.last_stamp = stamp
+            self.last_grab = time.time()
+
+            try:
+                img = registry.decode(data)
+            except ValueError as e:
+                logging.getLogger('yard_client.frame_source').warning(f"Could not decode recorded frame: {e}")
+                continue
+            return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+        raise ValueError(f"{self.max_skipped + 1} frames in a row of {self.reader.path} could not be decoded")
+
+
+def create_frame_source(conf: dict) -> FrameSource:
+    """
+    Create the frame source from the configuration.
+
+    {"type": "mss" | "synthetic" | "replay", "monitor": 0, "content": "static", "width": 1280, "height": 720,
+     "seed": 0, "file": "data/frames.yrec"}
+
+    :param conf: dict: The configuration of the frame source
+    :return: FrameSource
+    :raises ValueError: If the type is unknown
+    """
+    match conf.get('type', 'mss'):
+        case 'mss':
+            return MssFrameSource(conf.get('monitor', 0))
+        case 'synthetic':
+            return SyntheticFrameSource(conf.get('content', 'static'),
+                                        (conf.get('width', 1280), conf.get('height', 720)),
+                                        conf.get('seed', 0))
+        case 'replay':
+            return ReplayFrameSource(conf['file'], realtime=conf.get('realtime', False))
+        case unknown:
+            raise ValueError(f"Unknown frame source: {unknown}")
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from typing import Tuple, Any, Optional
+
+from objects.recording import FrameRecorder
+from protocol.yardcodec import registry
+
+
+class HeadlessViewer:
+    """
+    Viewer without a window for benchmarking the receive path.
+
+    Frames are reassembled and decoded like in the normal viewer, but they are discarded or written to a file.
+    FPS, latency and CPU usage are reported periodically.
+
+    The latency is measured from capture on the host to the decoded frame on the viewer,
+    so it is only meaningful if both clocks are synchronized (e.g. same machine).
+
+    :param record_file: str(Optional): Write the received frames to this file instead of discarding them
+    """
+    report_interval = 10
+
+    recorder: Optional[FrameRecorder] = None
+    lock: threading.Lock = None
+
+    frames = 0
+    failed = 0
+    received_bytes = 0
+    latency_sum = 0.0
+    latency_max = 0.0
+
+    def __init__(self, record_file: str = None):
+        self.recorder = FrameRecorder(record_file) if record_file else None
+        self.lock = threading.Lock()
+        self.start_time = self.last_report = time.time()
+        self.start_cpu = self.last_cpu = time.process_time()
+        self.reset()
+
+    def reset(self) -> None:
+        self.frames = 0
+        self.failed = 0
+        self.received_bytes = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def handle_display(self, display: Tuple[dict, bytes, Any]) -> None:
+        """
+        Decode the frame and update the statistics.
+
+        :param display: Tuple[header, data, address]: The reassembled frame
+        :return: None
+        """
+        header, data, address = display
+        try:
+            img = registry.decode(data)
+        except ValueError:
+            img = None
+        now = time.time()
+        stamp = header.get('stamp', None)
+        with self.lock:
+            self.received_bytes += len(data)
+            if img is None:
+                self.failed += 1
+                return
+            self.frames += 1
+            if stamp:
+                latency = now - stamp
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+            if self.recorder:
+                self.recorder.write(data, stamp)
+            if now - self.last_report >= self.report_interval:
+                self.report(now)
+
+    def report(self, now: float = None) -> dict:
+        """
+        Log the statistics since the last report and reset them.
+
+        :param now: float(Optional): The current time
+        :return: dict: The reported statistics
+        """
+        now = now or time.time()
+        cpu = time.process_time()
+        elapsed = max(now - self.last_report, 1e-9)
+        stats = {
+            'fps': self.frames / elapsed,
+            'failed': self.failed,
+            'kbit_s': self.received_bytes * 8 / elapsed / 1000,
+            'latency_avg_ms': self.latency_sum / self.frames * 1000 if self.frames else 0.0,
+            'latency_max_ms': self.latency_max * 1000,
+            'cpu_percent': (cpu - self.last_cpu) / elapsed * 100
+        }
+        logging.getLogger('yard_client.headless').info(
+            "FPS: {fps:.1f} === Failed: {failed} === {kbit_s:.0f} kbit/s === "
+            "Latency avg: {latency_avg_ms:.1f} ms, max: {latency_max_ms:.1f} ms === CPU: {cpu_percent:.1f} %".format(
+                **stats))
+        self.last_report = now
+        self.last_cpu = cpu
+        self.reset()
+        return stats
+
+    def close(self) -> None:
+        with self.lock:
+            self.report()
+            if self.recorder:
+                self.recorder.close()
+                logging.getLogger('yard_client.headless').info(
+                    f"Recorded {self.recorder.frames} frames to {self.recorder.path}")
@@ -0,0 +1,126 @@
+from collections import deque
+from typing import Deque, Dict, Iterator, Tuple
+
+from objects.yardexceptions import PendingQueueFull
+
+
+class PendingQueue:
+    """
+    The pending packages of a client, one bounded deque per session.
+
+    Sessions with pending packages take turns (round-robin): after a package of a session was taken,
+    the session moves to the end, so a busy session can't hold back the packages of the other sessions.
+    Purging the packages of a session drops its deque in O(1). The sessions are kept in a plain dict
+    (insertion ordered), an empty queue costs less than with an OrderedDict.
+
+    The queue is guarded by the lock of its client, it has no lock of its own.
+
+    sessions = {
+        ses: deque([(ses, package), ...]),  # The next session to deliver is the first
+        ...
+    }
+
+    :param max_packages: int(Optional): Maximum number of pending packages per session
+    :param max_bytes: int(Optional): Maximum payload length of all pending packages
+    """
+    __slots__ = ('max_packages', 'max_bytes', 'sessions', 'session_bytes', 'size', 'count')
+
+    max_packages: int
+    max_bytes: int
+    sessions: Dict[int, Deque[Tuple[int, list]]]
+    session_bytes: Dict[int, int]
+    size: int
+    count: int
+
+    def __init__(self, max_packages: int = 256, max_bytes: int = 1 << 20):
+        self.max_packages = max_packages
+        self.max_bytes = max_bytes
+        self.sessions = {}
+        self.session_bytes = {}
+        self.size = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self) -> Iterator[Tuple[int, list]]:
+        for packages in self.sessions.values():
+            yield from packages
+
+    def __str__(self):
+        return str(list(self))
+
+    def append(self, item: Tuple[int, list]) -> None:
+        """
+        Queue a package at the end of its session.
+
+        :param item: Tuple[session_id, package]: The package
+        :return: None
+        :raises PendingQueueFull: The session or the client has too many pending packages
+        """
+        ses, package = item
+        packages = self.sessions.get(ses, None)
+        if packages and len(packages) >= self.max_packages:
+            raise PendingQueueFull(f"Session {ses} has {len(packages)} pending packages")
+        length = len(package[1])
+        if self.size + length > self.max_bytes:
+            raise PendingQueueFull(f"Pending packages exceed {self.max_bytes} bytes")
+        if packages is None:
+            packages = self.sessions[ses] = deque()
+            self.session_bytes[ses] = 0
+        packages.append(item)
+        self.session_bytes[ses] += length
+        self.size += length
+        self.count += 1
+
+    def peek(self) -> Tuple[int, list]:
+        """
+        :return: Tuple[session_id, package]: The next package
+        :raises IndexError: The queue is empty
+        """
+        if not self.sessions:
+            raise IndexError("peek from an empty queue")
+        return next(iter(self.sessions.values()))[0]
+
+    def popleft(self) -> Tuple[int, list]:
+        """
+        Take the next package, its session moves to the end of the delivery order.
+
+        :return: Tuple[session_id, package]: The package
+        :raises IndexError: The queue is empty
+        """
+        if not self.sessions:
+            raise IndexError("pop from an empty queue")
+        ses, packages = next(iter(self.sessions.items()))
+        item = packages.popleft()
+        length = len(item[1][1])
+        self.session_bytes[ses] -= length
+        self.size -= length
+        self.count -= 1
+        if packages:
+            # Move the session to the end
+            self.sessions[ses] = self.sessions.pop(ses)
+        else:
+            del self.sessions[ses]
+            del self.session_bytes[ses]
+        return item
+
+    def purge(self, ses: int) -> int:
+        """
+        Delete all pending packages of a session.
+
+        :param ses: int: The id of the session
+        :return: int: Number of deleted packages
+        """
+        packages = self.sessions.pop(ses, None)
+        if not packages:
+            return 0
+        self.size -= self.session_bytes.pop(ses)
+        self.count -= len(packages)
+        return len(packages)
+
+    def clear(self) -> None:
+        self.sessions.clear()
+        self.session_bytes.clear()
+        self.size = 0
+        self.count = 0
@@ -0,0 +1,82 @@
+import heapq
+import threading
+from typing import Dict, Hashable, List
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key (e.g. client_id or source ip).
+
+    A bucket holds up to 'burst' tokens and is refilled with 'rate' tokens per second, every allowed message
+    takes one token. Buckets that are full again carry no state, they are dropped when the limiter holds
+    more than 'max_keys' buckets. If all buckets are in use, the least recently used ones are evicted, so the
+    limiter never grows beyond 'max_keys' buckets.
+
+    TokenBucketLimiter(rate, burst, max_keys) -> TokenBucketLimiter
+
+    :param rate: float: Tokens per second
+    :param burst: float: Size of a bucket
+    :param max_keys: int(Optional): Maximum number of buckets
+    """
+    rate: float = None
+    burst: float = None
+    max_keys: int = None
+    buckets: Dict[Hashable, List[float]] = None  # key -> [tokens, time of the last refill]
+    lock: threading.Lock = None
+
+    limited: int = 0
+    evicted: int = 0
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 65536):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.limited = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def allow(self, key: Hashable, now: float) -> bool:
+        """
+        Take a token of the bucket of the key.
+
+        :param key: Hashable: The key of the bucket
+        :param now: float: The current time (time.monotonic())
+        :return: bool: False when the bucket is empty
+        """
+        with self.lock:
+            bucket = self.buckets.get(key, None)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.prune(now)
+                bucket = self.buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                self.limited += 1
+                return False
+            bucket[0] -= 1
+            return True
+
+    def prune(self, now: float) -> None:
+        """
+        Drop the buckets that are full again, then the least recently used buckets until a new bucket fits.
+        Must be called with the lock held.
+
+        :param now: float: The current time (time.monotonic())
+        :return: None
+        """
+        full = [key for key, (tokens, last) in self.buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for key in full:
+            del self.buckets[key]
+        excess = len(self.buckets) - self.max_keys + 1
+        if excess > 0:
+            # Evict a tenth at once, so a flood of new keys doesn't sort the buckets for every key
+            excess = max(excess, self.max_keys // 10)
+            for key in heapq.nsmallest(excess, self.buckets, key=lambda k: self.buckets[k][1]):
+                del self.buckets[key]
+            self.evicted += excess
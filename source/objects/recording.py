@@ -0,0 +1,78 @@
+import struct
+import time
+from typing import Iterator, Optional, Tuple
+
+
+class FrameRecorder:
+    """
+    Write received frames to a file.
+
+    The frames are saved like they are received (encoded), so recording costs no additional encode.
+
+    File definition
+    -----------
+    magic(4) + [stamp(8, double) + length(4) + frame(length)] * n
+
+    :param path: str: The path of the recording
+    """
+    magic = b'YREC'
+    entry_header = struct.Struct('<dI')
+
+    path: str = None
+    file = None
+    frames: int = 0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(self.magic)
+        self.frames = 0
+
+    def write(self, frame: bytes, stamp: Optional[float] = None) -> None:
+        """
+        Append a frame to the recording.
+
+        :param frame: bytes: The encoded frame
+        :param stamp: float(Optional): The capture time of the frame, default is now
+        :return: None
+        """
+        self.file.write(self.entry_header.pack(stamp or time.time(), len(frame)))
+        self.file.write(frame)
+        self.frames += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class FrameReader:
+    """
+    Read the frames of a recording created by FrameRecorder.
+
+    :param path: str: The path of the recording
+    :raises ValueError: If the file is not a recording
+    """
+    path: str = None
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(FrameRecorder.magic)) != FrameRecorder.magic:
+                raise ValueError(f"{path} is not a frame recording")
+
+    def __iter__(self) -> Iterator[Tuple[float, bytes]]:
+        """
+        Iterate over all frames.
+
+        :return: Iterator[Tuple[stamp, frame]]
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(len(FrameRecorder.magic))
+            while True:
+                entry = f.read(FrameRecorder.entry_header.size)
+                if len(entry) < FrameRecorder.entry_header.size:
+                    break
+                stamp, length = FrameRecorder.entry_header.unpack(entry)
+                frame = f.read(length)
+                if len(frame) < length:
+                    break
+                yield stamp, frame
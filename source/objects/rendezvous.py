@@ -0,0 +1,174 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Any, List
+
+Address = Tuple[str, int]
+
+
+class RendezvousWaiter:
+    """
+    A REQ that waits for the UDP message with its password.
+
+    :param password: str: The password of the UDP message
+    :param ip: str: The UDP message must come from this ip (the ip of the control connection)
+    :param callback: Callable[[address | None], Any]: Called with the UDP address or None on timeout
+    """
+    password: str = None
+    ip: str = None
+    callback: Callable[[Optional[Address]], Any] = None
+
+    def __init__(self, password: str, ip: str, callback: Callable[[Optional[Address]], Any]):
+        self.password = password
+        self.ip = ip
+        self.callback = callback
+
+
+class RendezvousTable:
+    """
+    Table of the REQs that wait for their UDP message and of the UDP messages that wait for their REQ,
+    both keyed by password.
+
+    A waiter is completed only by the UDP message with its password, so concurrent REQs don't interfere.
+    All entries expire through one min-heap that is serviced by the UDP loop (see expire()),
+    removed entries stay in the heap until their deadline and are skipped then.
+    Both tables are bounded and every source ip may only send 'rate_limit' UDP messages per 'rate_window'.
+    The callbacks are called outside the lock in the thread that completes the waiter, usually the UDP loop, so they
+    must not block, the server hands the answers to its workers.
+
+    RendezvousTable(wait_timeout, save_timeout) -> RendezvousTable
+
+    :param wait_timeout: float: Seconds a waiter waits for its UDP message
+    :param save_timeout: float: Seconds a UDP message waits for its REQ
+    :param max_size: int(Optional): Maximum number of waiters and of UDP messages
+    """
+    tick = 0.5           # Maximum seconds between two calls of expire() by the UDP loop
+    rate_limit = 50      # UDP messages per source ip and window
+    rate_window = 1.0    # Seconds
+
+    wait_timeout: float = None
+    save_timeout: float = None
+    max_size: int = None
+    waiters: Dict[str, RendezvousWaiter] = None
+    received: Dict[str, Address] = None
+    deadlines: List[Tuple[float, int, str, Any]] = None  # Heap of (deadline, counter, password, entry)
+    counter: itertools.count = None
+    sources: Dict[str, int] = None  # ip -> UDP messages in the current window
+    window_end: float = 0
+    lock: threading.Lock = None
+
+    expired: int = 0
+    dropped: int = 0
+    rate_limited: int = 0
+
+    def __init__(self, wait_timeout: float = 10, save_timeout: float = 10, max_size: int = 65536):
+        self.wait_timeout = wait_timeout
+        self.save_timeout = save_timeout
+        self.max_size = max_size
+        self.waiters = {}
+        self.received = {}
+        self.deadlines = []
+        self.counter = itertools.count()
+        self.sources = {}
+        self.window_end = 0
+        self.lock = threading.Lock()
+        self.expired = 0
+        self.dropped = 0
+        self.rate_limited = 0
+
+    def __len__(self):
+        return len(self.waiters) + len(self.received)
+
+    def push_deadline(self, timeout: float, password: str, entry: Any) -> None:
+        heapq.heappush(self.deadlines, (time.monotonic() + timeout, next(self.counter), password, entry))
+
+    def wait(self, password: str, ip: str, callback: Callable[[Optional[Address]], Any]) -> bool:
+        """
+        Register a waiter for the password, complete it at once if the UDP message is already there.
+
+        :param password: str: The password of the UDP message
+        :param ip: str: The expected source ip of the UDP message
+        :param callback: Callable[[address | None], Any]: Called with the UDP address or None on timeout
+        :return: bool: False when there is already a waiter for the password
+        :raises OverflowError: When the table of the waiters is full
+        """
+        with self.lock:
+            if password in self.waiters:
+                return False
+            address = self.received.get(password, None)
+            if address and address[0] == ip:
+                self.received.pop(password)
+            else:
+                if len(self.waiters) >= self.max_size:
+                    raise OverflowError("Rendezvous table is full")
+                address = None
+                waiter = self.waiters[password] = RendezvousWaiter(password, ip, callback)
+                self.push_deadline(self.wait_timeout, password, waiter)
+        if address:
+            callback(address)
+        return True
+
+    def allow(self, ip: str, now: float) -> bool:
+        """
+        Count a UDP message of the source ip.
+
+        :param ip: str: The source ip
+        :param now: float: The current time (time.monotonic())
+        :return: bool: False when the source sent too many UDP messages in the current window
+        """
+        with self.lock:
+            if now >= self.window_end:
+                self.sources.clear()
+                self.window_end = now + self.rate_window
+            count = self.sources[ip] = self.sources.get(ip, 0) + 1
+            if count > self.rate_limit:
+                self.rate_limited += 1
+                return False
+            return True
+
+    def receive(self, password: str, address: Address) -> bool:
+        """
+        Complete the waiter of the password if the address matches, else keep the UDP message for a later REQ.
+
+        :param password: str: The password of the received UDP message
+        :param address: Tuple[ip, port]: The source of the UDP message
+        :return: bool: True -> a waiter was completed
+        """
+        with self.lock:
+            waiter = self.waiters.get(password, None)
+            if not waiter or waiter.ip != address[0]:
+                if password not in self.received:
+                    if len(self.received) >= self.max_size:
+                        self.dropped += 1
+                    else:
+                        self.received[password] = address
+                        self.push_deadline(self.save_timeout, password, address)
+                return False
+            self.waiters.pop(password)
+        waiter.callback(address)
+        return True
+
+    def expire(self, now: float) -> None:
+        """
+        Remove all entries whose deadline passed, the waiters are called with None.
+
+        :param now: float: The current time (time.monotonic())
+        :return: None
+        """
+        expired = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, _, password, entry = heapq.heappop(self.deadlines)
+                if isinstance(entry, RendezvousWaiter):
+                    if self.waiters.get(password, None) is entry:
+                        self.waiters.pop(password)
+                        expired.append(entry)
+                        self.expired += 1
+                elif self.received.get(password, None) is entry:
+                    self.received.pop(password)
+                    self.expired += 1
+        for waiter in expired:
+            logging.getLogger('yard_server.udp').info(f"No corresponding UDP message from {waiter.ip}")
+            waiter.callback(None)
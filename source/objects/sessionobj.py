@@ -10,8 +10,10 @@ class SessionObj:
     :param session_id: int:
     :param connection: tuple['Clientobj', 'Clientobj']
     """
-    session_id: int = None
-    connection: Tuple['ClientObj', 'ClientObj'] = None
+    __slots__ = ('session_id', 'connection')
+
+    session_id: int
+    connection: Tuple['ClientObj', 'ClientObj']
 
     def __init__(self, session_id: int, connection: Tuple['ClientObj', 'ClientObj']):
         self.session_id = session_id
@@ -1,12 +1,17 @@
+import contextlib
 import logging
 import socket
+import threading
 import uuid
-from typing import Optional, Dict, Tuple, List
+from typing import Optional, Dict, Tuple, List, Iterable, Iterator
 
 from objects import secret
-from objects.clientobj import ClientObj
+from objects.clientdirectory import ClientDirectory
+from objects.clientregistry import ClientRegistry
+from objects.clientobj import ClientObj, RemoteClientObj
 from objects.sessionobj import SessionObj
 from objects.connectionobj import ConnectionObj
+from protocol.yardforwarder import YardForwarder
 from protocol.yardtransmission import YardTransmission
 
 
@@ -15,22 +20,124 @@ class ClientStorage:
     ClientStorage to save clients while operation.
 
     clients: Dict[str: ClientObj] -> The saved clients in dict format.
+    fingerprints: Dict[bytes: ClientObj] -> Index of the clients by the 16 bytes of the fingerprint.
+    sockets: Dict[socket.socket: ClientObj] -> Index of the clients by socket, clients notify socket changes.
+
+    The storage is used by all connection threads at once. The state of a client (sessions, pending packages,
+    socket) is guarded by one of 'stripes' locks, chosen by the client_id, see client_lock(). Sessions are
+    created and deleted with the locks of both clients held. The dicts and indexes are guarded by 'lock',
+    which is never held while acquiring a client lock or while waiting for the directory. Clients are created
+    with one of 'stripes' locks held, chosen by the fingerprint, see create_client().
+
+    With a directory and a forwarder the storage is one part of the clients of several workers.
+    Client IDs and session ids are allocated in the directory, clients of other workers are represented
+    by RemoteClientObj and deleted sessions are forwarded to the home of the partner.
+
+    With a registry the clients are kept across restarts: the registered clients are loaded as offline
+    clients and created, renewed and removed clients are written to the registry in the background.
+
+    :param directory: ClientDirectory(Optional): The directory shared by all workers
+    :param forwarder: YardForwarder(Optional): The forwarder to the other workers, required with a directory
+    :param registry: ClientRegistry(Optional): The persistent registry of a single server
     """
     max_session_per_client = 256
+    session_ids = (1 << max_session_per_client) - 2  # Bitmap of the valid session ids 1 ... 255
+    stripes = 64
     clients: Dict['str', 'ClientObj'] = None
-
-    def __init__(self):
+    fingerprints: Dict[bytes, 'ClientObj'] = None
+    sockets: Dict[socket.socket, 'ClientObj'] = None
+    remote_clients: Dict[str, RemoteClientObj] = None
+    directory: Optional[ClientDirectory] = None
+    forwarder: Optional[YardForwarder] = None
+    registry: Optional[ClientRegistry] = None
+    lock: threading.RLock = None
+    client_locks: List[threading.RLock] = None
+    fingerprint_locks: List[threading.Lock] = None
+
+    def __init__(self,
+                 directory: ClientDirectory = None,
+                 forwarder: YardForwarder = None,
+                 registry: ClientRegistry = None):
+        self.lock = threading.RLock()
+        self.client_locks = [threading.RLock() for _ in range(self.stripes)]
+        self.fingerprint_locks = [threading.Lock() for _ in range(self.stripes)]
         self.clients = {}
+        self.fingerprints = {}
+        self.sockets = {}
+        self.remote_clients = {}
+        self.directory = directory
+        self.forwarder = forwarder
+        self.registry = registry
+        if registry:
+            self.load_registry()
+
+    def load_registry(self) -> None:
+        """
+        Add all clients of the registry as offline clients, a client gets its old ID with the next INIT.
+
+        :return: None
+        """
+        clients = self.registry.load()
+        for client_id, fingerprint in clients:
+            self.add_client(client_id, fingerprint, False, None)
+        logging.getLogger('yard_server.storage').info(f"Loaded {len(clients)} clients from the registry")
+
+    def close(self) -> None:
+        """
+        Write the last changes of the registry.
+
+        :return: None
+        """
+        if self.registry:
+            self.registry.close()
+
+    @contextlib.contextmanager
+    def client_lock(self, *clients: 'ClientObj') -> Iterator[None]:
+        """
+        Lock the passed clients.
+
+        The locks are acquired in a fixed order, so two threads that lock the same pair of clients can't deadlock.
+        A thread that holds a client lock must not lock further clients, it may only re-enter its own locks.
+
+        :param clients: ClientObj: The clients
+        :return: Iterator[None]: Context manager
+        """
+        stripes = sorted({hash(client.client_id) % self.stripes for client in clients})
+        with contextlib.ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self.client_locks[stripe])
+            yield
 
     def get_client(self, client_id: str) -> Optional['ClientObj']:
         """
         Get Client by id or None.
 
         :param client_id: str: The id of the client
-        :return: ClientObj | None
+        :return: ClientObj | RemoteClientObj | None
         """
 
-        return self.clients.get(client_id, None)
+        client = self.clients.get(client_id, None)
+        if client or not self.directory:
+            return client
+        return self.get_remote_client(client_id)
+
+    def get_remote_client(self, client_id: str) -> Optional[RemoteClientObj]:
+        """
+        Get the client of another worker by id or None.
+
+        :param client_id: str: The id of the client
+        :return: RemoteClientObj | None
+        """
+        entry = self.directory.get(client_id)
+        if not entry or entry[1] == self.forwarder.node:
+            return None
+        fingerprint, node = entry
+        with self.lock:
+            client = self.remote_clients.get(client_id, None)
+            if not client or client.fingerprint != fingerprint:
+                client = self.remote_clients[client_id] = RemoteClientObj(client_id, fingerprint, node)
+            client.node = node
+        return client
 
     def get_client_by_fingerprint(self, fingerprint: uuid.UUID) -> Optional['ClientObj']:
         """
@@ -40,9 +147,7 @@ class ClientStorage:
         :return: ClientObj | None
         """
 
-        for client_id, client in self.clients.items():
-            if client.fingerprint == fingerprint:
-                return client
+        return self.fingerprints.get(fingerprint.bytes, None)
 
     def get_client_by_socket(self, sock: 'socket.socket') -> Optional['ClientObj']:
         """
@@ -52,9 +157,21 @@ class ClientStorage:
         :return: ClientObj | None
         """
 
-        for client_id, client in self.clients.items():
-            if client.socket == sock:
-                return client
+        return self.sockets.get(sock, None)
+
+    def socket_changed(self, client: 'ClientObj', old_sock: Optional[socket.socket]) -> None:
+        """
+        Called by the client when its socket changed, moves the client in the socket index.
+
+        :param client: ClientObj: The client
+        :param old_sock: socket.socket | None: The previous socket of the client
+        :return: None
+        """
+        with self.lock:
+            if old_sock is not None and self.sockets.get(old_sock, None) is client:
+                del self.sockets[old_sock]
+            if client.socket is not None:
+                self.sockets[client.socket] = client
 
     def add_client(self, client_id: str, fingerprint: uuid.UUID, online: bool, sock: socket.socket) -> 'ClientObj':
         """
@@ -69,8 +186,42 @@ class ClientStorage:
         """
         logging.getLogger('yard_server.client').debug(
             f"Adding client: ID: {client_id}, Fingerprint: {fingerprint}, Online: {online}")
-        self.clients[client_id] = ClientObj(client_id, fingerprint, online, sock)
-        return self.clients[client_id]
+        client = ClientObj(client_id, fingerprint, online, sock)
+        client.storage = self
+        with self.lock:
+            self.clients[client_id] = client
+            self.fingerprints[client.fingerprint_bytes] = client
+            self.socket_changed(client, None)
+        return client
+
+    def register_client(self, client_id: str, fingerprint: uuid.UUID) -> bool:
+        """
+        Reserve the client_id in the directory.
+
+        :param client_id: str: The id of the client
+        :param fingerprint: uuid.UUID: The fingerprint of the client
+        :return: bool: False when the id is already used by a client of another worker
+        """
+        return not self.directory or self.directory.register(client_id, fingerprint, self.forwarder.node)
+
+    def take_over_client(self, fingerprint: uuid.UUID, sock: socket.socket) -> Optional['ClientObj']:
+        """
+        Move a client that reconnected to this worker from its old home, it keeps its client_id.
+
+        :param fingerprint: uuid.UUID: The fingerprint of the client
+        :param sock: socket.socket: The new socket of the client
+        :return: ClientObj | None: The moved client, None if no worker knows the fingerprint
+        """
+        entry = self.directory.get_by_fingerprint(fingerprint) if self.directory else None
+        if not entry:
+            return None
+        client_id, node = entry
+        self.directory.register(client_id, fingerprint, self.forwarder.node, replace=True)
+        if node != self.forwarder.node:
+            self.forwarder.send(node, ('evict', client_id))
+        self.remote_clients.pop(client_id, None)
+        logging.getLogger('yard_server.client').info(f"Take over client {client_id} from {node}")
+        return self.add_client(client_id, fingerprint, True, sock)
 
     def create_client(self,
                       fingerprint: uuid.UUID,
@@ -85,17 +236,25 @@ class ClientStorage:
         :raises ValueError: If you pass the wrong format of the fingerprint an error will be raised.
         """
 
-        clt = self.get_client_by_fingerprint(fingerprint)
-        if not clt:
+        # Two INITs with the same fingerprint must not create two clients, the INITs of other fingerprints
+        # go on while this one waits for the directory
+        with self.fingerprint_locks[hash(fingerprint) % self.stripes]:
+            clt = self.get_client_by_fingerprint(fingerprint) or self.take_over_client(fingerprint, sock)
             # As long as the id is not unique
-            while True:
+            while not clt:
                 client_id = secret.create_secret(ClientObj.id_len, numbers=True, alphabet=(False, True))
-                if not self.get_client(client_id):
-                    # ID is unique
+                if self.get_client(client_id) or not self.register_client(client_id, fingerprint):
+                    continue
+                with self.lock:
+                    # Without a directory the id is reserved here
+                    if client_id in self.clients:
+                        continue
                     clt = self.add_client(client_id, fingerprint, True, sock)
-                    logging.getLogger('yard_server.client').info(f"Created client: {clt}")
-                    return clt
-        else:
+                if self.registry:
+                    self.registry.put(client_id, fingerprint)
+                logging.getLogger('yard_server.client').info(f"Created client: {clt}")
+                return clt
+        if clt:
             # Client already exists
             logging.getLogger('yard_server.client').debug(f"Client already exists: {fingerprint}, {clt.client_id}")
             clt.set_online(sock)
@@ -106,7 +265,7 @@ class ClientStorage:
                       *,
                       fingerprint: uuid.UUID = None,
                       sessions: dict[int: 'SessionObj'] = None,
-                      pending_packages: list[Tuple[int, list]] = None,
+                      pending_packages: Iterable[Tuple[int, list]] = None,
                       online: bool = None,
                       sock: socket.socket = None) -> 'ClientObj':
         """
@@ -115,23 +274,35 @@ class ClientStorage:
         :param client_id: str: The ID of the client
         :param fingerprint: uuid.UUID: The fingerprint of the client
         :param sessions: dict[session_id: SessionObj]: The desired sessions
-        :param pending_packages: list[Tuple[session_id, package]]: The desired pending_packages
+        :param pending_packages: Iterable[Tuple[session_id, package]]: The desired pending_packages
         :param online: bool: True -> online; False -> offline
         :param sock: socket.socket: The socket of the client
         :return: ClientObj: The update client
+        :raises PendingQueueFull: More pending_packages than a client can hold
         """
 
         client = self.get_client(client_id)
-        if fingerprint:
-            client.fingerprint = fingerprint
-        if sessions:
-            client.sessions = sessions
-        if pending_packages:
-            client.pending_packages = pending_packages
-        if online is not None:
-            client.online = online
-        if sock:
-            client.socket = sock
+        with self.client_lock(client):
+            if fingerprint:
+                with self.lock:
+                    if self.fingerprints.get(client.fingerprint_bytes, None) is client:
+                        del self.fingerprints[client.fingerprint_bytes]
+                    client.fingerprint = fingerprint
+                    self.fingerprints[client.fingerprint_bytes] = client
+                if self.registry:
+                    self.registry.put(client_id, fingerprint)
+            if sessions:
+                client.set_sessions(sessions)
+            if pending_packages:
+                client.pending_packages.clear()
+                for package in pending_packages:
+                    # raises PendingQueueFull
+                    client.pending_packages.append(package)
+            if online is not None:
+                client.online = online
+            if sock:
+                old_sock, client.socket = client.socket, sock
+                self.socket_changed(client, old_sock)
         return client
 
     def pop_client(self, client_id: str) -> 'ClientObj':
@@ -142,19 +313,42 @@ class ClientStorage:
         :return: ClientObj
         """
 
-        return self.clients.pop(client_id)
+        if self.directory:
+            self.directory.unregister(client_id, self.forwarder.node)
+        with self.lock:
+            client = self.clients.pop(client_id)
+            if self.fingerprints.get(client.fingerprint_bytes, None) is client:
+                del self.fingerprints[client.fingerprint_bytes]
+            if client.socket is not None and self.sockets.get(client.socket, None) is client:
+                del self.sockets[client.socket]
+        if self.registry:
+            self.registry.delete(client_id)
+        return client
 
     def create_session(self, client1: 'ClientObj', client2: 'ClientObj') -> int:
         """
         Create a session and return id.
 
         It will be ensured that the session number is not used by client and partner.
+        Both clients are locked while the session is created.
 
         :param client1: ClientObj: The client
         :param client2: ClientObj: The partner
         :return: int: The ID of the created session
         :raises OverflowError: No session left for client. MAX is 255 (sum of client and target).
         """
+        with self.client_lock(client1, client2):
+            return self.create_session_locked(client1, client2)
+
+    def create_session_locked(self, client1: 'ClientObj', client2: 'ClientObj') -> int:
+        """
+        Create a session while client and partner are locked, see create_session().
+
+        :param client1: ClientObj: The client
+        :param client2: ClientObj: The partner
+        :return: int: The ID of the created session
+        :raises OverflowError: No session left for client or partner
+        """
         storage_logger = logging.getLogger('yard_server.storage')
         exist1 = client1.session_exists(client2)
         exist2 = client2.session_exists(client1)
@@ -169,81 +363,197 @@ class ClientStorage:
             storage_logger.warning(f"Session already exists for: {client1.fingerprint}, {client2.fingerprint}")
             return session_exist
 
-        for i in range(1, self.max_session_per_client):
+        if self.directory:
+            # The id must be free at the workers of both clients
+            # raises OverflowError
+            i = self.directory.create_session(client1.client_id, client2.client_id, self.max_session_per_client)
             if not client1.sessions.get(i, None):
-                if not client2.sessions.get(i, None):
-                    session = SessionObj(i, (client1, client2))
-                    client1.add_session(session)
-                    client2.add_session(session)
-                    return i
-        else:
+                session = SessionObj(i, (client1, client2))
+                client1.add_session(session)
+                client2.add_session(session)
+            return i
+
+        # Ids that are free for both clients, id 0 is not a session
+        free = ~(client1.used_sessions | client2.used_sessions) & self.session_ids
+        if not free:
             storage_logger.error(f"No session id left for: {client1.fingerprint}, {client2.fingerprint}")
             raise OverflowError("Too many sessions for client or partner")
+        # Lowest set bit
+        i = (free & -free).bit_length() - 1
+        session = SessionObj(i, (client1, client2))
+        client1.add_session(session)
+        client2.add_session(session)
+        return i
+
+    def session_deleted(self, client: 'ClientObj', partner: Optional['ClientObj'], ses: int) -> None:
+        """
+        Called by ClientObj.delete_session(), releases the session id and tells the home of a remote partner.
+
+        :param client: ClientObj: The client that deleted the session
+        :param partner: ClientObj | None: The partner of the session
+        :param ses: int: The session id
+        :return: None
+        """
+        if not self.directory or not partner:
+            return
+        self.directory.delete_session(client.client_id, partner.client_id, ses)
+        if isinstance(partner, RemoteClientObj):
+            self.forwarder.send(partner.node, ('terminate', partner.client_id, ses, client.client_id))
+
+    def terminate_session(self, client_id: str, ses: int, partner_id: str) -> None:
+        """
+        Delete a session whose remote partner already deleted it, without notifying the partner again.
+
+        :param client_id: str: The id of the local client
+        :param ses: int: The session id
+        :param partner_id: str: The id of the partner that deleted the session
+        :return: None
+        """
+        client = self.clients.get(client_id, None)
+        if not client or not client.sessions.get(ses, None):
+            return
+        partner = client.get_partner_of_session(ses)
+        if partner and partner.client_id == partner_id:
+            with self.client_lock(client, partner):
+                if client.get_partner_of_session(ses) is partner:
+                    client.delete_pending_packages_per_session(ses)
+                    client.pop_session(ses)
 
 
 class ConnectionStorage:
-    connections: List['ConnectionObj'] = None
+    """
+    ConnectionStorage to save the connections of the client daemon.
+
+    connections: Dict[int: ConnectionObj] -> The connections by their id, an id is never reused.
+    ids: Dict[str: int] -> Index of the connection ids by client_id.
+    fingerprints: Dict[bytes: int] -> Index of the connection ids by the 16 bytes of the fingerprint.
+    sessions: Dict[int: int] -> Index of the connection ids by session id, session 0 is not indexed.
+    transmissions: Dict[YardTransmission: int] -> Index of the connection ids by transmission.
+
+    The daemon threads use the storage at once, the connections and indexes are guarded by 'lock'.
+    """
+    connections: Dict[int, 'ConnectionObj'] = None
+    ids: Dict[str, int] = None
+    fingerprints: Dict[bytes, int] = None
+    sessions: Dict[int, int] = None
+    transmissions: Dict['YardTransmission', int] = None
+    next_id: int = 0
+    lock: threading.RLock = None
 
     def __init__(self):
-        self.connections = []
+        self.connections = {}
+        self.ids = {}
+        self.fingerprints = {}
+        self.sessions = {}
+        self.transmissions = {}
+        self.next_id = 0
+        self.lock = threading.RLock()
 
     def __str__(self):
         string = "["
-        for conn in self.connections:
+        for conn in self.connections.values():
             string += str(conn) + " "
         return string[:-1] + "]"
 
+    def __len__(self):
+        return len(self.connections)
+
+    def index_keys(self, conn: 'ConnectionObj') -> Iterator[Tuple[dict, object]]:
+        """
+        :param conn: ConnectionObj: The connection
+        :return: Iterator[Tuple[index, key]]: The keys of the connection in the indexes
+        """
+        if conn.client_id:
+            yield self.ids, conn.client_id
+        if conn.fingerprint_bytes:
+            yield self.fingerprints, conn.fingerprint_bytes
+        if conn.session_id:
+            yield self.sessions, conn.session_id
+        if conn.transmission is not None:
+            yield self.transmissions, conn.transmission
+
+    def index(self, conn_id: int) -> None:
+        for index, key in self.index_keys(self.connections[conn_id]):
+            index[key] = conn_id
+
+    def unindex(self, conn_id: int) -> None:
+        for index, key in self.index_keys(self.connections[conn_id]):
+            if index.get(key, None) == conn_id:
+                del index[key]
+
     def add_connection(self,
                        client_id: str,
                        ses: int, online: bool,
                        *,
                        fingerprint: Optional['uuid.UUID'] = None,
-                       transmission: Optional['YardTransmission'] = None):
-        conn_id = None
-        conn_fp = None
-
-        if fingerprint:
-            conn_fp = self.get_connection_by_fingerprint(fingerprint)
-        if client_id:
-            conn_id = self.get_connection_by_id(client_id)
+                       transmission: Optional['YardTransmission'] = None) -> int:
+        """
+        Add a connection or update the connection with the same client_id or fingerprint.
 
-        if conn_id:
-            if not fingerprint or not conn_id.fingerprint or conn_id.fingerprint == fingerprint:
+        :param client_id: str: The id of the partner
+        :param ses: int: The session id
+        :param online: bool: True -> online; False -> offline
+        :param fingerprint: uuid.UUID(Optional, keyword-only): The fingerprint of the partner
+        :param transmission: YardTransmission(Optional, keyword-only): The transmission of the connection
+        :return: int: The id of the connection
+        """
+        with self.lock:
+            conn_id = self.ids.get(client_id, None) if client_id else None
+            if conn_id is not None:
+                conn = self.connections[conn_id]
+                if fingerprint and conn.fingerprint_bytes and conn.fingerprint_bytes != fingerprint.bytes:
+                    # TODO: Throw exception
+                    raise Exception
+                    # Client exists with same id but fingerprint is different
                 # Update based on id
                 # Or Update connection based on same id and fp
-                conn = conn_id
+            elif fingerprint and fingerprint.bytes in self.fingerprints:
+                # Update based on fp, update client_id
+                conn_id = self.fingerprints[fingerprint.bytes]
             else:
-                # TODO: Throw exception
-                raise Exception
-                # Client exists with same id but fingerprint is different
-        elif conn_fp:
-            conn = conn_fp
-            # Update based on fp, update client_id
-        else:
-            # Not already existing -> add
-            self.connections.append(ConnectionObj(client_id, ses, fingerprint, online, transmission))
-            return len(self.connections) - 1
-
-        if conn:
+                # Not already existing -> add
+                conn_id, self.next_id = self.next_id, self.next_id + 1
+                self.connections[conn_id] = ConnectionObj(client_id, ses, fingerprint, online, transmission)
+                self.index(conn_id)
+                return conn_id
+
+            conn = self.connections[conn_id]
+            self.unindex(conn_id)
             conn.client_id = client_id
             conn.fingerprint = fingerprint
             conn.session_id = ses
             conn.online = online
             conn.transmission = transmission
-            return self.connections.index(conn)
+            self.index(conn_id)
+            return conn_id
+
+    def remove_connection(self, conn_id: int) -> Optional['ConnectionObj']:
+        """
+        Remove the connection with the id.
+
+        :param conn_id: int: The id of the connection
+        :return: ConnectionObj | None: The removed connection
+        """
+        with self.lock:
+            if conn_id not in self.connections:
+                return None
+            self.unindex(conn_id)
+            return self.connections.pop(conn_id)
+
+    def get_connection(self, conn_id: int) -> Optional['ConnectionObj']:
+        return self.connections.get(conn_id, None)
+
+    def get_connection_by_id(self, client_id: str) -> Optional['ConnectionObj']:
+        return self.connections.get(self.ids.get(client_id, None), None)
 
-    def get_connection_by_id(self, client_id: str):
-        x = [x for x in self.connections if x.client_id == client_id]
-        return x[0] if x else None
+    def get_connection_by_fingerprint(self, fingerprint: uuid.UUID) -> Optional['ConnectionObj']:
+        return self.connections.get(self.fingerprints.get(fingerprint.bytes, None), None)
 
-    def get_connection_by_fingerprint(self, fingerprint: uuid.UUID):
-        x = [x for x in self.connections if x.fingerprint == fingerprint]
-        return x[0] if x else None
+    def get_connection_by_ses(self, ses: int) -> Optional['ConnectionObj']:
+        return self.connections.get(self.sessions.get(ses, None), None)
 
-    def get_connection_by_ses(self, ses: int):
-        x = [x for x in self.connections if x.session_id == ses]
-        return x[0] if x else None
+    def get_connection_id_by_ses(self, ses: int) -> Optional[int]:
+        return self.sessions.get(ses, None)
 
-    def get_connection_by_transmission(self, transmission: 'YardTransmission'):
-        x = [x for x in self.connections if x.transmission == transmission]
-        return x[0] if x else None
+    def get_connection_by_transmission(self, transmission: 'YardTransmission') -> Optional['ConnectionObj']:
+        return self.connections.get(self.transmissions.get(transmission, None), None)
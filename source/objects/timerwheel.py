@@ -0,0 +1,141 @@
+import logging
+import math
+import threading
+import time
+from typing import Callable, Any, List, Set
+
+
+class TimerHandle:
+    """
+    Handle of a scheduled callback, see TimerWheel.schedule().
+    """
+    deadline: float = None
+    callback: Callable[..., Any] = None
+    args: tuple = None
+    slot: int = None
+    cancelled = False
+
+    def __init__(self, deadline: float, callback: Callable[..., Any], args: tuple, slot: int):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.slot = slot
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel that runs many timeouts in one thread.
+
+    Scheduling and cancelling are O(1). Callbacks are executed in the thread of the wheel,
+    so they must be short and must not block.
+
+    TimerWheel(tick, slots, logger) -> TimerWheel
+
+    :param tick: float: Resolution of the timeouts in seconds
+    :param slots: int: Number of slots, timeouts longer than tick * slots need more than one round
+    :param logger: str: Name of the logger for failing callbacks (e.g. 'yard_server.timer_wheel')
+    """
+    tick: float = None
+    slots: List[Set[TimerHandle]] = None
+    position: int = 0       # Next slot to process
+    next_time: float = None  # Time when the next slot is due
+    lock: threading.Lock = None
+    stopping: threading.Event = None
+    thread: threading.Thread = None
+
+    def __init__(self, tick: float = 0.1, slots: int = 512, logger: str = 'yard.timer_wheel'):
+        self.tick = tick
+        self.logger = logger
+        self.slots = [set() for _ in range(slots)]
+        self.position = 0
+        self.next_time = time.monotonic() + tick
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def start(self) -> 'TimerWheel':
+        """
+        Start the thread of the wheel.
+
+        :return: TimerWheel: self
+        """
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run, name='timer-wheel', daemon=True)
+            self.thread.start()
+        return self
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args) -> TimerHandle:
+        """
+        Call the callback after delay seconds.
+
+        :param delay: float: The delay in seconds
+        :param callback: Callable: The callback
+        :param args: The arguments of the callback
+        :return: TimerHandle: Handle for cancelling
+        """
+        deadline = time.monotonic() + delay
+        with self.lock:
+            ticks = max(0, math.ceil((deadline - self.next_time) / self.tick))
+            slot = (self.position + ticks) % len(self.slots)
+            handle = TimerHandle(deadline, callback, args, slot)
+            self.slots[slot].add(handle)
+            self.count += 1
+        return handle
+
+    def cancel(self, handle: TimerHandle) -> bool:
+        """
+        Cancel a scheduled callback.
+
+        :param handle: TimerHandle: The handle returned by schedule()
+        :return: bool: True -> cancelled, False -> already executed or cancelled
+        """
+        with self.lock:
+            if handle.cancelled or handle not in self.slots[handle.slot]:
+                return False
+            self.slots[handle.slot].discard(handle)
+            handle.cancelled = True
+            self.count -= 1
+            return True
+
+    def advance(self, now: float) -> None:
+        """
+        Execute all callbacks that are due.
+
+        :param now: float: The current time (time.monotonic())
+        :return: None
+        """
+        due = []
+        with self.lock:
+            while self.next_time <= now:
+                slot = self.slots[self.position]
+                for handle in [x for x in slot if x.deadline <= now]:
+                    slot.discard(handle)
+                    due.append(handle)
+                self.position = (self.position + 1) % len(self.slots)
+                self.next_time += self.tick
+            self.count -= len(due)
+        for handle in due:
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                logging.getLogger(self.logger).exception(e)
+
+    def run(self) -> None:
+        while not self.stopping.wait(self.tick):
+            self.advance(time.monotonic())
+
+    def stop(self) -> None:
+        """
+        Stop the thread, pending callbacks are not executed.
+
+        :return: None
+        """
+        self.stopping.set()
+        with self.lock:
+            for slot in self.slots:
+                slot.clear()
+            self.count = 0
@@ -1,2 +1,6 @@
 class SessionAlreadyExists(Exception):
     pass
+
+
+class PendingQueueFull(Exception):
+    pass
@@ -0,0 +1,92 @@
+"""
+Yard metrics module.
+
+Thread-safe counters, observations and gauges for monitoring the size of internal structures.
+
+Example:
+    from objects.yardmetrics import YardMetrics
+
+    metrics = YardMetrics()
+    metrics.increment('server.pushed_packages')
+    metrics.observe('server.handshake_seconds', 0.02)
+    metrics.register_gauge('control.readers', lambda: len(readers))
+    metrics.log('yard_server.metrics')
+"""
+
+import logging
+import threading
+from typing import Callable, Dict
+
+
+class YardMetrics:
+    """
+    Collection of metrics.
+
+    counters: name -> int
+    observations: name -> {'count': int, 'sum': float, 'max': float}
+    gauges: name -> function that returns the current value
+    """
+    counters: Dict[str, int] = None
+    observations: Dict[str, dict] = None
+    gauges: Dict[str, Callable[[], float]] = None
+    lock: threading.Lock = None
+
+    def __init__(self):
+        self.counters = {}
+        self.observations = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            observation = self.observations.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            observation['count'] += 1
+            observation['sum'] += value
+            observation['max'] = max(observation['max'], value)
+
+    def register_gauge(self, name: str, function: Callable[[], float]) -> None:
+        with self.lock:
+            self.gauges[name] = function
+
+    def get(self, name: str) -> float:
+        """
+        Get the value of a counter or gauge.
+
+        :param name: str: The name of the metric
+        :return: float: The value, 0 if it does not exist
+        """
+        with self.lock:
+            gauge = self.gauges.get(name, None)
+            if not gauge:
+                return self.counters.get(name, 0)
+        return gauge()
+
+    def snapshot(self) -> dict:
+        """
+        Get all metrics.
+
+        :return: dict: name -> value (observations are dicts with count, sum, avg and max)
+        """
+        with self.lock:
+            result = dict(self.counters)
+            for name, observation in self.observations.items():
+                result[name] = observation | {
+                    'avg': observation['sum'] / observation['count'] if observation['count'] else 0.0}
+            gauges = dict(self.gauges)
+        for name, gauge in gauges.items():
+            result[name] = gauge()
+        return result
+
+    def log(self, logger: str) -> None:
+        """
+        Log all metrics.
+
+        :param logger: str: Name of the logger
+        :return: None
+        """
+        logging.getLogger(logger).info(
+            ' === '.join(f"{name}: {value}" for name, value in sorted(self.snapshot().items())))
@@ -1,8 +1,59 @@
 import logging
 import socket
+import threading
 import time
-from threading import Timer
-from typing import Union, Literal, Dict, Tuple, Any
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from typing import Union, Literal, Dict, Tuple, Any, Deque, Callable, Optional, Set, List
+
+from objects.pendingqueue import PendingQueue
+from objects.timerwheel import TimerWheel
+from objects.yardmetrics import YardMetrics
+
+
+class AnswerCodeAllocator:
+    """
+    Allocate free answer codes in O(1).
+
+    Codes are taken from a counter until all were used once, afterwards from a free-list of released codes.
+    The free-list is FIFO, so a released code is reused as late as possible.
+
+    :param size: int: The highest answer code (0 is reserved for messages without answer)
+    """
+    size: int = None
+    next_code: int = 1
+    free: Deque[int] = None
+    used: Set[int] = None
+
+    def __init__(self, size: int):
+        self.size = size
+        self.next_code = 1
+        self.free = deque()
+        self.used = set()
+
+    def __len__(self):
+        return len(self.used)
+
+    def allocate(self) -> int:
+        """
+        :return: int: A free answer code
+        :raises OverflowError: When there is no answer-code left
+        """
+        if self.free:
+            ac = self.free.popleft()
+        elif self.next_code <= self.size:
+            ac = self.next_code
+            self.next_code += 1
+        else:
+            raise OverflowError("No answer-code left")
+        self.used.add(ac)
+        return ac
+
+    def release(self, ac: int) -> None:
+        if ac in self.used:
+            self.used.remove(ac)
+            self.free.append(ac)
 
 
 class YardControlChannel:
@@ -23,18 +74,35 @@ class YardControlChannel:
     'ANS': 0x07
     'ERR': 0x08
     'WARN': 0x09
+    'BATCH': 0x0A
 
     Package definition
     -----------
     pkg = [{'ver': version_number, 'ses': session_number, 'typ': message_type, 'len': length_of_payload}, payload]
+
+    Header
+    -----------
+    Version 0: ver(1) + ses(1) + typ(1) + ac(1) + len(2)
+    Version 1: ver(1) + ses(1) + typ(1) + ac(2) + len(2)
+
+    Both versions are accepted. Answers are sent in the version of the last received package of the socket,
+    so a client chooses its version with the first message and the server follows.
+
+    Batch
+    -----------
+    The payload of a BATCH package contains several packages: 'ses len payload' for each one without separator,
+    where len is the number of characters of the payload. See 'self.create_batch()' and 'self.parse_batch()'.
     """
-    version: int = 0
-    header_len: int = 6
+    version: int = 1
+    versions = {0: {'header_len': 6, 'ac_len': 1},
+                1: {'header_len': 7, 'ac_len': 2}}
+    header_len: int = versions[version]['header_len']
+    min_header_len: int = min(x['header_len'] for x in versions.values())
     receive_timeout = 10
     encoding = "utf-8"
     byteorder: Literal['little', 'big'] = 'little'
 
-    types = ['CLOSE', 'INIT', 'PING', 'REQ', 'CONN', 'TERM', 'REN', 'ANS', 'ERR', 'WARN']
+    types = ['CLOSE', 'INIT', 'PING', 'REQ', 'CONN', 'TERM', 'REN', 'ANS', 'ERR', 'WARN', 'BATCH']
 
     CLOSE = 0x00
     INIT = 0x01
@@ -46,15 +114,28 @@ class YardControlChannel:
     ANS = 0x07
     ERR = 0x08
     WARN = 0x09
+    BATCH = 0x0A
 
-    cached_packages: Dict[int, Tuple[dict, str]] = None
-    waiting_ac: list = None
-    timers: list = None
+    answer_codes: AnswerCodeAllocator = None
+    readers: 'weakref.WeakKeyDictionary[socket.socket, YardControlReader]' = None
+    send_locks: 'weakref.WeakKeyDictionary[socket.socket, threading.Lock]' = None
+    lock: threading.Lock = None
+    metrics: YardMetrics = None
 
-    def __init__(self):
-        self.cached_packages = {}
-        self.waiting_ac = []
-        self.timers = []
+    def __init__(self, version: int = None, metrics: YardMetrics = None):
+        """
+        :param version: int(Optional): The version of the sent packages, default is the newest
+        :param metrics: YardMetrics(Optional): Where the sizes of the internal structures are reported
+        """
+        self.version = self.version if version is None else version
+        self.header_len = self.versions[self.version]['header_len']
+        self.answer_codes = AnswerCodeAllocator((1 << self.versions[self.version]['ac_len'] * 8) - 1)
+        self.readers = weakref.WeakKeyDictionary()
+        self.send_locks = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.metrics = metrics or YardMetrics()
+        self.metrics.register_gauge('control.waiting_answer_codes', lambda: len(self.answer_codes))
+        self.metrics.register_gauge('control.readers', lambda: len(self.readers))
 
     def convert_to_bytes(self, data: Union[str, bytes]) -> bytes:
         """
@@ -93,9 +174,12 @@ class YardControlChannel:
         """
         pl = self.convert_to_bytes(pl)
         length = length or len(pl)
+        ver = self.version if ver is None else ver
+        version = self.versions.get(ver, None)
 
-        if ses.bit_length() <= 8 and typ.bit_length() <= 8 and length.bit_length() <= 16:
-            return {'ver': ver or self.version, 'ses': ses, 'ac': ac, 'typ': typ, 'len': length}
+        if (version and ses.bit_length() <= 8 and typ.bit_length() <= 8 and length.bit_length() <= 16
+                and ac.bit_length() <= version['ac_len'] * 8):
+            return {'ver': ver, 'ses': ses, 'ac': ac, 'typ': typ, 'len': length}
         else:
             raise OverflowError("Bit-length of one or more parameters to long; Header could not be created")
 
@@ -106,14 +190,14 @@ class YardControlChannel:
         Normally you use directly 'self.send()'
 
         :param header: dict: Header created by 'create_header()'
-        :return: bytes: b'\\x01\\x01\\x01\\0x01\\x05\\x00'
+        :return: bytes: b'\\x01\\x01\\x01\\0x01\\x00\\x05\\x00'
         """
 
         # Convert int to bytes and concatenate
         return (int(header['ver']).to_bytes(1, self.byteorder)
                 + int(header['ses']).to_bytes(1, self.byteorder)
                 + int(header['typ']).to_bytes(1, self.byteorder)
-                + int(header['ac']).to_bytes(1, self.byteorder)
+                + int(header['ac']).to_bytes(self.versions[header['ver']]['ac_len'], self.byteorder)
                 + int(header['len']).to_bytes(2, self.byteorder))
 
     def send(self, sock: socket.socket, typ: int, data: Union[str, bytes], *, ses: int = 0, ac: int = 0) -> None:
@@ -129,156 +213,470 @@ class YardControlChannel:
         :raises OverflowError: When Parameters could not be converted to their byte-representation
         """
 
+        # Answer in the version of the peer
+        package = self.create_package(ses, typ, data, ac=ac, ver=self.get_version(sock))
+        # Send header and payload in one write, other threads may push to the same socket
+        with self.get_send_lock(sock):
+            sock.sendall(package)
+
+    def get_send_lock(self, sock: socket.socket) -> threading.Lock:
+        """
+        Get the lock that serializes the writes to the socket, it is created on first use.
+
+        :param sock: socket.socket: The socket
+        :return: threading.Lock
+        """
+        with self.lock:
+            send_lock = self.send_locks.get(sock, None)
+            if not send_lock:
+                send_lock = self.send_locks[sock] = threading.Lock()
+            return send_lock
+
+    def get_version(self, sock: socket.socket) -> Optional[int]:
+        """
+        :param sock: socket.socket: The socket
+        :return: int | None: Version of the last package received from the socket, None if nothing was received
+        """
+        reader = self.readers.get(sock, None)
+        return reader.version if reader else None
+
+    def create_package(self,
+                       ses: int,
+                       typ: int,
+                       data: Union[str, bytes],
+                       *,
+                       ac: int = 0,
+                       ver: int = None) -> bytes:
+        """
+        Create the byte representation of a package (header + payload).
+
+        :param ses: int: The desired session
+        :param typ: int: The desired message type
+        :param data: str | bytes: The payload
+        :param ac: int(Optional, keyword-only): If answer add answer code
+        :param ver: int(Optional, keyword-only): Instead of predefined version pass desired version number
+        :return: bytes: The package
+        :raises OverflowError: When Parameters could not be converted to their byte-representation
+        """
         # Ensure that data is in byte-form
         data = self.convert_to_bytes(data)
-        # Send header and payload
-        sock.send(self.create_byte_header(self.create_header(ses, typ, pl=data, ac=ac)))
-        sock.send(data)
+        return self.create_byte_header(self.create_header(ses, typ, pl=data, ac=ac, ver=ver)) + data
+
+    def create_batch(self, packages: PendingQueue, size: int = 0xFFFF) -> str:
+        """
+        Take packages in delivery order from the queue and join them to the payload of a BATCH package.
+        The payload never exceeds 'size' bytes, when the next package doesn't fit even into an empty batch
+        it stays in the queue and the payload is empty, it has to be sent as a plain ANS package.
+
+        :param packages: PendingQueue: The packages, the taken ones are removed
+        :param size: int(Optional): Maximum number of bytes of the payload
+        :return: str: The payload
+        """
+        entries = []
+        length = 0
+        while packages:
+            ses, package = packages.peek()
+            entry = f"{ses} {len(package[1])} {package[1]}"
+            entry_length = len(self.convert_to_bytes(entry))
+            if length + entry_length > size:
+                break
+            packages.popleft()
+            entries.append(entry)
+            length += entry_length
+        return ''.join(entries)
+
+    def parse_batch(self, payload: str) -> List[Tuple[dict, str]]:
+        """
+        Split the payload of a BATCH package into its packages.
+
+        :param payload: str: The payload created by 'self.create_batch()'
+        :return: List[Tuple[header, payload]]: The packages as ANS packages
+        :raises ValueError: When the payload is malformed
+        """
+        packages = []
+        position = 0
+        while position < len(payload):
+            ses, length, _ = payload[position:position + 16].split(' ', 2)
+            position += len(ses) + len(length) + 2
+            data = payload[position:position + int(length)]
+            if len(data) != int(length):
+                raise ValueError("Batch is truncated")
+            packages.append((self.create_header(int(ses), self.ANS, pl=data), data))
+            position += int(length)
+        return packages
+
+    def get_header_len(self, ver: int) -> int:
+        """
+        :param ver: int: The version of the package
+        :return: int: The length of the header
+        :raises ConnectionAbortedError: When the version is not supported
+        """
+        version = self.versions.get(ver, None)
+        if not version:
+            raise ConnectionAbortedError(f"Unsupported protocol version {ver}")
+        return version['header_len']
+
+    def parse_header(self, data: Union[bytes, memoryview]) -> dict:
+        """
+        Convert the received header to a dict.
+
+        :param data: bytes: The header (see 'self.get_header_len()')
+        :return: dict: The header see 'self.create_header()'
+        :raises ConnectionAbortedError: When the header is invalid, the connection is treated as aborted
+        """
+        header_len = self.get_header_len(data[0])
+        ac_len = self.versions[data[0]]['ac_len']
+        try:
+            header = self.create_header(ver=data[0],
+                                        ses=data[1],
+                                        typ=data[2],
+                                        ac=int.from_bytes(data[3:3 + ac_len], self.byteorder),
+                                        length=int.from_bytes(data[3 + ac_len:header_len], self.byteorder))
+        except OverflowError as e:
+            raise ConnectionAbortedError(e)
+        if header['typ'] >= len(self.types):
+            raise ConnectionAbortedError(f"Unknown message type {header['typ']}")
+        return header
+
+    def get_reader(self, sock: socket.socket) -> 'YardControlReader':
+        """
+        Get the buffered reader of the socket, it is created on first use.
+
+        :param sock: socket.socket: The socket
+        :return: YardControlReader
+        """
+        with self.lock:
+            reader = self.readers.get(sock, None)
+            if not reader:
+                reader = self.readers[sock] = YardControlReader(self)
+            return reader
 
     def receive(self, sock: socket.socket) -> Tuple[dict, str]:
         """
         Receive a package from the client.
 
         Socket needs to be initialized and bound.
+        The data is read with a buffered reader, so short reads and multiple packages per read are handled.
 
         :param sock: socket.socket: The socket where it receives the package
         :return: tuple: (header, payload)
         :raises ConnectionAbortedError: When there is a problem with the header, the connection is treated as aborted
         """
-        header = {}
-        payload = ""
+        return self.get_reader(sock).receive(sock)
 
-        # Receive the header as data
-        data = sock.recv(self.header_len)
-        if data:
-            try:
-                # Convert to header
-                header = self.create_header(ver=data[0],
-                                            ses=data[1],
-                                            typ=data[2],
-                                            ac=data[3],
-                                            length=int.from_bytes(data[4:], self.byteorder))
-                if header['ver'] != self.version:
-                    raise Exception     # TODO: Create Version exception
-                if header['typ'] >= len(self.types):
-                    raise Exception     # TODO: Create type not recognised
-            except OverflowError as e:
-                raise ConnectionAbortedError(e)
-        if not header:
-            raise ConnectionAbortedError("Connection has been aborted due to missing header")
-        else:
-            # Get payload
-            if header['len'] > 0:
-                payload = str(sock.recv(header['len']).decode(self.encoding))
-        return header, payload
+    def get_access_code(self) -> int:
+        """
+        Get a free access code.
 
-    def send_receive(self, sock: 'socket.socket', ses: int, typ: int, data: Union[str, bytes]) -> Tuple[dict, str]:
+        :return: int: The access code
+        :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
         """
-        Send a message and wait for the corresponding answer.
+        return self.answer_codes.allocate()
+
+    def release_access_code(self, ac: int) -> None:
+        """
+        Release an access code, so it can be used again.
+
+        :param ac: int: The access code
+        :return: None
+        """
+        self.answer_codes.release(ac)
+
+
+class YardControlDemultiplexer:
+    """
+    Demultiplexer for the control channel of one connection.
+
+    A single reader thread receives all packages of the socket and routes the answers by their answer code
+    to the future of the request. Packages that nobody waits for are passed to the push callback.
+    Timeouts of all requests are handled by one timer wheel. So send_receive() can be called from any thread.
+
+    YardControlDemultiplexer(channel, sock) -> YardControlDemultiplexer
+
+    :param channel: YardControlChannel: The protocol
+    :param sock: socket.socket: The connected socket
+    :param push_callback: Callable[[package], Any](Optional): Called in the reader thread for not requested packages
+    :param timer_wheel: TimerWheel(Optional): The wheel for the timeouts, default is a new wheel
+    :param logger: str(Optional): Name of the logger
+    """
+    channel: YardControlChannel = None
+    sock: socket.socket = None
+    push_callback: Optional[Callable[[Tuple[dict, str]], Any]] = None
+    timer_wheel: TimerWheel = None
+    waiting: Dict[int, Tuple[Future, Any]] = None
+    lock: threading.Lock = None
+    thread: threading.Thread = None
+    stopping = False
+
+    def __init__(self,
+                 channel: YardControlChannel,
+                 sock: socket.socket,
+                 push_callback: Callable[[Tuple[dict, str]], Any] = None,
+                 timer_wheel: TimerWheel = None,
+                 logger: str = 'yard_client.protocol.demultiplexer'):
+        self.channel = channel
+        self.sock = sock
+        self.push_callback = push_callback
+        self.timer_wheel = timer_wheel or TimerWheel(logger=logger)
+        self.logger = logger
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+
+    def start(self) -> None:
+        """
+        Start the reader thread.
+
+        :return: None
+        """
+        self.timer_wheel.start()
+        self.thread = threading.Thread(target=self.reader_loop, name='control-demultiplexer', daemon=True)
+        self.thread.start()
+
+    def send(self, typ: int, data: Union[str, bytes], *, ses: int = 0, ac: int = 0) -> None:
+        """
+        Send a package, writes of different threads do not interleave.
+
+        :raises OverflowError: When Parameters could not be converted to their byte-representation
+        """
+        package = self.channel.create_package(ses, typ, data, ac=ac)
+        with self.channel.get_send_lock(self.sock):
+            self.sock.sendall(package)
+
+    def request(self, ses: int, typ: int, data: Union[str, bytes], timeout: float = None) -> Future:
+        """
+        Send a message and return the future of the answer.
 
-        :param sock: socket.socket: The socket where it sends and receives the package
         :param ses: int: The desired session
         :param typ: int: The desired message type
         :param data: str | bytes: The payload
-        :return: list: [header, payload]
-        :raises ConnectionAbortedError: When there is a problem with the header, the connection is treated as aborted
+        :param timeout: float(Optional): Seconds until the future fails with TimeoutError,
+        default is channel.receive_timeout
+        :return: Future: Result is the answer package (header, payload)
+        :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
+        :raises OverflowError: When Parameters could not be converted to their byte-representation
+        :raises ConnectionAbortedError: When the demultiplexer is closed
+        """
+        future = Future()
+        with self.lock:
+            if self.stopping:
+                raise ConnectionAbortedError("Control connection is closed")
+            ac = self.channel.get_access_code()
+            handle = self.timer_wheel.schedule(timeout or self.channel.receive_timeout, self.expire, ac, future)
+            self.waiting[ac] = (future, handle)
+        try:
+            self.send(typ, data, ses=ses, ac=ac)
+        except Exception as e:
+            self.fail(ac, e)
+        return future
+
+    def send_receive(self, ses: int, typ: int, data: Union[str, bytes], timeout: float = None) -> Tuple[dict, str]:
+        """
+        Send a message and wait for the corresponding answer.
+
+        :return: tuple: (header, payload)
+        :raises ConnectionAbortedError: When the connection was aborted
         :raises TimeoutError: When it doesn't receive an answer in a defined time-period
         :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
         :raises OverflowError: When Parameters could not be converted to their byte-representation
         """
-        # Send the message and get access code
-        ac = self.send_ac(sock, ses, typ, data)
-        # Receive message
-        return self.receive_ac(sock, ac)
+        return self.request(ses, typ, data, timeout).result()
 
-    def get_access_code(self) -> int:
+    def pop_waiting(self, ac: int, future: Future = None) -> Optional[Future]:
+        with self.lock:
+            waiting = self.waiting.get(ac, None)
+            if not waiting or (future and waiting[0] is not future):
+                return None
+            self.waiting.pop(ac)
+            self.channel.release_access_code(ac)
+        self.timer_wheel.cancel(waiting[1])
+        return waiting[0]
+
+    def expire(self, ac: int, future: Future) -> None:
+        if self.pop_waiting(ac, future):
+            future.set_exception(TimeoutError("Waited to long for answer"))
+
+    def fail(self, ac: int, exception: Exception) -> None:
+        future = self.pop_waiting(ac)
+        if future:
+            future.set_exception(exception)
+
+    def route(self, package: Tuple[dict, str]) -> None:
         """
-        Get a free access code.
+        Complete the request of the package or pass it to the push callback.
 
-        :return: int: The access code
-        :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
+        :param package: Tuple[header, payload]: The received package
+        :return: None
         """
-        # Get free access code
-        for i in range(1, 256):
-            if not self.waiting_ac.count(i):
-                ac = i
-                self.waiting_ac.append(ac)
-                return ac
+        future = self.pop_waiting(package[0]['ac']) if package[0]['ac'] else None
+        if future:
+            future.set_result(package)
+        elif self.push_callback:
+            self.push_callback(package)
         else:
-            raise OverflowError("No answer-code left")
+            logging.getLogger(self.logger).warning(f"Dropping not requested package {package}")
 
-    def send_ac(self, sock: 'socket.socket', ses: int, typ: int, data: Union[str, bytes]) -> int:
+    def reader_loop(self) -> None:
+        try:
+            while not self.stopping:
+                self.route(self.channel.receive(self.sock))
+        except Exception as e:
+            if not self.stopping:
+                logging.getLogger(self.logger).warning(f"Control connection aborted: {e}")
+            self.close(ConnectionAbortedError(e))
+
+    def join(self, timeout: float = None) -> None:
         """
-        Send a message and return the access code.
+        Wait until the reader thread stopped.
 
-        :param sock: socket.socket: The socket where it sends the package
-        :param ses: int: The desired session
-        :param typ: int: The desired message type
-        :param data: str | bytes: The payload
-        :return: int: The access code
-        :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
-        :raises OverflowError: When Parameters could not be converted to their byte-representation
+        :param timeout: float(Optional): Seconds to wait
+        :return: None
         """
-        ac = self.get_access_code()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
 
-        # Send the message
-        self.send(sock, typ, data, ses=ses, ac=ac)
+    def close(self, exception: Exception = None) -> None:
+        """
+        Stop routing and fail all waiting requests.
 
-        return ac
+        :param exception: Exception(Optional): The exception for the waiting requests
+        :return: None
+        """
+        with self.lock:
+            self.stopping = True
+            waiting = list(self.waiting.keys())
+        for ac in waiting:
+            self.fail(ac, exception or ConnectionAbortedError("Control connection is closed"))
+
+
+class YardControlReader:
+    """
+    Buffered reader for the packages of one control channel connection.
 
-    def receive_ac(self, sock: 'socket.socket', ac) -> Tuple[dict, str]:
+    The data is received with recv_into into a reusable buffer. Every read parses as many packages as available,
+    incomplete packages stay in the buffer until the rest is received.
+    The header length is chosen by the version byte of every package, the last version is kept in 'version'.
+
+    YardControlReader(channel) -> YardControlReader
+    """
+    initial_size = 4096
+
+    channel: YardControlChannel = None
+    version: int = None  # Version of the last received package
+    buffer: bytearray = None
+    start: int = 0  # Begin of the not parsed data
+    end: int = 0    # End of the received data
+    packages: Deque[Tuple[dict, str]] = None
+
+    def __init__(self, channel: YardControlChannel, size: int = None):
+        self.channel = channel
+        self.buffer = bytearray(size or self.initial_size)
+        self.start = 0
+        self.end = 0
+        self.packages = deque()
+
+    def reserve(self, size: int) -> memoryview:
+        """
+        Make room for at least 'size' bytes after the received data.
+
+        :param size: int: The needed free space
+        :return: memoryview: The free space of the buffer
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.end < size:
+            # Move the not parsed data to the beginning and grow if it is still not enough
+            pending = self.end - self.start
+            if pending + size > len(self.buffer):
+                buffer = bytearray(max(pending + size, len(self.buffer) * 2))
+            else:
+                buffer = self.buffer
+            buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+            self.start, self.end = 0, pending
+        return memoryview(self.buffer)[self.end:]
+
+    def get_needed(self) -> int:
         """
-        Receive a message by an access code.
+        :return: int: Number of bytes that are at least missing for the next package
+        """
+        available = self.end - self.start
+        if available < 1:
+            return self.channel.min_header_len + 1024
+        header_len = self.channel.get_header_len(self.buffer[self.start])
+        if available < header_len:
+            return header_len + 1024 - available
+        length = int.from_bytes(self.buffer[self.start + header_len - 2:self.start + header_len],
+                                self.channel.byteorder)
+        return max(header_len + length - available, 1024)
 
-        :param sock: socket.socket: The socket where it sends and receives the package
-        :param ac: int: The access code
-        :return: list: [header, payload]
+    def parse(self) -> None:
+        """
+        Parse all complete packages in the buffer.
+
+        :return: None
         :raises ConnectionAbortedError: When there is a problem with the header, the connection is treated as aborted
-        :raises TimeoutError: When it doesn't receive an answer in a defined time-period
         """
-        timeout = False
-
-        # Function to tell when timeout is over
-        def start_timeout():
-            nonlocal timeout
-            timeout = True
-
-        # Start timeout
-        timer = Timer(self.receive_timeout, start_timeout)
-        self.timers.append(timer)
-        timer.start()
-
-        # As long as no timeout -> wait for answer
-        while not timeout:
-            # If already in cache return
-            cached = self.cached_packages.get(ac, None)
-            if cached:
-                timer.cancel()
-                return cached
-
-            # Receive a package
-            pkg = self.receive(sock)
-
-            # If access code corresponds to the requested
-            if pkg[0]['ac'] == ac:
-                self.waiting_ac.remove(ac)
-                return pkg
-            else:
-                # Cache the package
-                self.cached_packages[pkg[0]['ac']] = pkg
-        else:
-            # Timeout exceeded
-            self.waiting_ac.remove(ac)
-            raise TimeoutError("Waited to long for answer")
+        view = memoryview(self.buffer)
+        try:
+            while self.end > self.start:
+                header_len = self.channel.get_header_len(view[self.start])
+                if self.end - self.start < header_len:
+                    break
+                header = self.channel.parse_header(view[self.start:self.start + header_len])
+                package_end = self.start + header_len + header['len']
+                if package_end > self.end:
+                    break
+                payload = str(view[self.start + header_len:package_end], self.channel.encoding)
+                self.version = header['ver']
+                self.packages.append((header, payload))
+                self.start = package_end
+        finally:
+            view.release()
+
+    def feed(self, data: bytes) -> None:
+        """
+        Add received data and parse the packages (e.g. for asyncio streams).
+
+        :param data: bytes: The received data
+        :return: None
+        :raises ConnectionAbortedError: When there is a problem with the header, the connection is treated as aborted
+        """
+        free = self.reserve(len(data))
+        free[:len(data)] = data
+        free.release()
+        self.end += len(data)
+        self.parse()
 
-    def close(self) -> None:
+    def fill(self, sock: socket.socket) -> None:
         """
-        Close the protocol and all it's threads
+        Receive available data from the socket and parse the packages.
 
+        :param sock: socket.socket: The socket
         :return: None
+        :raises ConnectionAbortedError: When the connection was closed or the header is invalid
+        """
+        free = self.reserve(self.get_needed())
+        try:
+            received = sock.recv_into(free)
+        finally:
+            free.release()
+        if not received:
+            raise ConnectionAbortedError("Connection has been aborted due to missing header")
+        self.end += received
+        self.parse()
+
+    def receive(self, sock: socket.socket) -> Tuple[dict, str]:
+        """
+        Return the next package, receive from the socket until one is complete.
+
+        :param sock: socket.socket: The socket
+        :return: tuple: (header, payload)
+        :raises ConnectionAbortedError: When the connection was closed or the header is invalid
         """
-        for timer in self.timers:
-            timer.cancel()
+        while not self.packages:
+            self.fill(sock)
+        return self.packages.popleft()
 
 
 class YardTransmissionChannel:
@@ -292,6 +690,7 @@ class YardTransmissionChannel:
     'CLOSE': 0x00
     'DISPLAY': 0x01
     'KEY': 0x02
+    'CURSOR': 0x03
 
     Package definition
     -----------
@@ -305,11 +704,12 @@ class YardTransmissionChannel:
     encoding = "utf-8"
     byteorder: Literal['little', 'big'] = 'little'
 
-    types = ['CLOSE', 'DISPLAY', 'KEY']
+    types = ['CLOSE', 'DISPLAY', 'KEY', 'CURSOR']
 
     CLOSE = 0x00
     DISPLAY = 0x01
     KEY = 0x02
+    CURSOR = 0x03
 
     parent = 0
     last_send = time.time()
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from typing import Tuple, Any, Set, Union, Callable
+
+from protocol.yardserver import YardServer
+
+
+class YardStreamConnection:
+    """
+    Socket-like wrapper of an asyncio stream.
+
+    The clients, the control channel and answer_message() use it like the socket of the threaded server.
+    Writes are buffered by the transport, so sendall() never blocks the event loop. Pushes stop at 'high_water'
+    buffered bytes (see YardAsyncServer.writable()), a peer that lets the buffer grow beyond 'max_buffer'
+    is aborted. The transport isn't thread-safe, writes of other threads (the workers of the server)
+    are passed to the event loop.
+
+    YardStreamConnection(writer) -> YardStreamConnection, must be created in the event loop
+
+    :param writer: asyncio.StreamWriter: The writer of the connection
+    """
+    high_water = 1 << 20
+    max_buffer = 4 << 20
+
+    writer: asyncio.StreamWriter = None
+    loop: asyncio.AbstractEventLoop = None
+    loop_thread: int = None
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+
+    def sendall(self, data: bytes) -> None:
+        """
+        :raises ConnectionAbortedError: The write buffer would exceed 'max_buffer', the connection is aborted
+        """
+        if self.buffered() + len(data) > self.max_buffer:
+            self.abort()
+            raise ConnectionAbortedError(f"Write buffer of {self.getpeername()} exceeds {self.max_buffer} bytes")
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.write, data)
+
+    def write(self, data: bytes) -> None:
+        # The write of another thread, the connection may be closed in the meantime
+        if not self.writer.transport.is_closing():
+            self.writer.write(data)
+
+    def buffered(self) -> int:
+        """
+        :return: int: Bytes written but not yet sent to the peer
+        """
+        return self.writer.transport.get_write_buffer_size()
+
+    def getpeername(self) -> Tuple[Any, ...]:
+        return self.writer.get_extra_info('peername')
+
+    def close(self) -> None:
+        self.writer.close()
+
+    def abort(self) -> None:
+        # Closes without the TLS shutdown, that waits for an answer of the peer
+        if threading.get_ident() == self.loop_thread:
+            self.writer.transport.abort()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+
+class YardHandshakeProtocol(asyncio.Protocol):
+    """
+    Protocol of an accepted plain TCP connection until YardAsyncServer.handshake() upgrades it to TLS.
+
+    Reading is paused at once, so the ClientHello stays in the socket until the TLS protocol reads it.
+
+    :param server: YardAsyncServer: The server
+    """
+    server: 'YardAsyncServer' = None
+
+    def __init__(self, server: 'YardAsyncServer'):
+        self.server = server
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        transport.pause_reading()
+        self.server.start_handshake(transport)
+
+
+class YardDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Passes the UDP messages to YardServer.handle_datagram().
+
+    :param server: YardAsyncServer: The server
+    """
+    server: 'YardAsyncServer' = None
+
+    def __init__(self, server: 'YardAsyncServer'):
+        self.server = server
+
+    def datagram_received(self, data: bytes, address: Tuple[str, int]) -> None:
+        try:
+            self.server.handle_datagram(data, address, time.monotonic())
+        except Exception as e:
+            logging.getLogger('yard_server.udp').exception(e)
+
+    def error_received(self, exc: Exception) -> None:
+        logging.getLogger('yard_server.udp').warning(exc)
+
+
+class YardAsyncServer(YardServer):
+    """
+    YardServer that serves all connections in one asyncio event loop instead of a thread per connection.
+
+    The packages are framed by the buffered reader of the control channel and answered by the same
+    answer_message() as in the threaded server. The event loop runs in its own thread, see start().
+    With a client directory the packages are answered in the workers, see run_blocking().
+
+    YardAsyncServer(control_socket, control_server, transmission_server, cert_path, key_path)
+    """
+    read_size = 65536
+    stop_timeout = 5
+
+    loop: asyncio.AbstractEventLoop = None
+    stopped: asyncio.Event = None
+    thread: threading.Thread = None
+    handshake_slots: asyncio.Semaphore = None
+    handshake_tasks: Set[asyncio.Task] = None
+
+    async def handle_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Handle the client of a connection.
+        Evaluate the action based on receiving messages.
+
+        :param reader: asyncio.StreamReader: The reader of the connection
+        :param writer: asyncio.StreamWriter: The writer of the connection
+        :return: None
+        """
+        connection_logger = logging.getLogger('yard_server.connection')
+        connection = YardStreamConnection(writer)
+        address = connection.getpeername()
+        self.track_connection(connection)
+        channel_reader = self.control_channel.get_reader(connection)
+        try:
+            connection_logger.info("Accepting {}:{}".format(*address))
+            while not self.stopping:
+                data = await reader.read(self.read_size)
+                if not data:
+                    raise ConnectionAbortedError("Connection has been aborted due to missing header")
+                self.connections[connection] = time.monotonic()
+                channel_reader.feed(data)
+                while channel_reader.packages:
+                    package = channel_reader.packages.popleft()
+                    connection_logger.info(  # TODO: Change to debug in production
+                        "Received data from {}:{} || Header: {} || Payload: {}".format(*address, *package))
+                    if not self.admit(connection, address, package):
+                        continue
+                    # If answer_message returns false close connection
+                    if not await self.run_blocking(self.answer_message, connection, package):
+                        return
+                await writer.drain()
+        except (ConnectionAbortedError, ConnectionResetError) as e:
+            # When there is a problem with the header, the connection is treated as aborted
+            connection_logger.warning(e)
+        except asyncio.CancelledError:
+            # The event loop is shutting down, the handler is the outermost task of the connection
+            connection_logger.debug("Connection {}:{} cancelled".format(*address))
+        except Exception as e:
+            # Catch all unexpected Exceptions
+            connection_logger.exception(e)
+        finally:
+            connection_logger.info("Closing connection {}:{}".format(*address))
+
+            # Close connection and set client offline
+            cl = self.client_storage.get_client_by_socket(connection)
+            if cl:
+                # Deletes the sessions in the directory
+                await self.run_blocking(cl.set_offline)
+            connection.close()
+            self.connections.pop(connection, None)
+
+    async def run_blocking(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run a function that may wait for the client directory in the workers, so the event loop goes on.
+        Without a directory or while the server stops, the function runs in the event loop.
+
+        :param func: Callable: The function
+        :param args: The arguments
+        :return: Any: The result of the function
+        """
+        if self.client_storage.directory and not self.stopping:
+            return await self.loop.run_in_executor(self.workers, func, *args)
+        return func(*args)
+
+    def start_handshake(self, transport: asyncio.Transport) -> None:
+        """
+        Start the TLS handshake of an accepted connection in a new task.
+
+        :param transport: asyncio.Transport: The plain TCP transport, reading is paused
+        :return: None
+        """
+        task = self.loop.create_task(self.handshake(transport))
+        # The loop keeps only weak references to its tasks
+        self.handshake_tasks.add(task)
+        task.add_done_callback(self.handshake_tasks.discard)
+
+    async def handshake(self, transport: asyncio.Transport) -> None:
+        """
+        Perform the TLS handshake of an accepted connection and pass the stream to handle_stream().
+        Like YardServer.handshake(), at most 'max_handshakes' handshakes run at the same time, waiting for a slot
+        and the handshake itself are limited by 'handshake_timeout'.
+
+        :param transport: asyncio.Transport: The plain TCP transport, reading is paused
+        :return: None
+        """
+        connection_logger = logging.getLogger('yard_server.connection')
+        address = transport.get_extra_info('peername')
+        try:
+            await asyncio.wait_for(self.handshake_slots.acquire(), self.handshake_timeout)
+        except asyncio.TimeoutError:
+            connection_logger.warning("Too many TLS handshakes, rejecting {}:{}".format(*address))
+            self.metrics.increment('server.handshake_rejected')
+            transport.close()
+            return
+        start = time.perf_counter()
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader, self.handle_stream)
+        try:
+            tls_transport = await self.loop.start_tls(transport,
+                                                      protocol,
+                                                      self.ssl_context,
+                                                      server_side=True,
+                                                      ssl_handshake_timeout=self.handshake_timeout)
+        except (ssl.SSLError, OSError, asyncio.TimeoutError) as e:
+            connection_logger.warning("TLS handshake with {}:{} failed: {}".format(*address, e))
+            self.metrics.increment('server.handshake_failures')
+            transport.close()
+            return
+        finally:
+            self.handshake_slots.release()
+        self.metrics.observe('server.handshake_seconds', time.perf_counter() - start)
+        # Creates the writer and starts handle_stream()
+        protocol.connection_made(tls_transport)
+
+    def writable(self, sock: YardStreamConnection, size: int) -> bool:
+        # sendall() never blocks the event loop, but the packages for a slow peer are pending above the high water
+        return sock.buffered() + size <= sock.high_water
+
+    def send_answer(self, sock: YardStreamConnection, typ: int, *, data: Union[str, bytes] = b"", ac: int = 0) -> bool:
+        # The event loop writes the answer, so it never waits for a send lock that a worker holds
+        self.loop.call_soon_threadsafe(self.write_answer, sock, typ, data, ac)
+        return True
+
+    def write_answer(self, sock: YardStreamConnection, typ: int, data: Union[str, bytes], ac: int) -> None:
+        """
+        Write an answer of a worker in the event loop, see send_answer().
+
+        :param sock: YardStreamConnection: The connection of the requester
+        :param typ: int: The desired message type
+        :param data: str | bytes: The payload
+        :param ac: int: The answer code
+        :return: None
+        """
+        try:
+            # raises ConnectionAbortedError: The buffer of the connection exceeds its maximum
+            self.send(sock=sock, typ=typ, ac=ac, data=data)
+        except OSError as e:
+            logging.getLogger('yard_server.session').warning(f"Dropped an answer, the client doesn't read: {e}")
+            self.metrics.increment('server.rendezvous_unanswered')
+
+    def reap(self, connection: YardStreamConnection) -> None:
+        """
+        Abort the connection in the event loop, the handler reads the end of the stream and sets the client offline.
+
+        :param connection: YardStreamConnection: The connection
+        :return: None
+        """
+        self.loop.call_soon_threadsafe(connection.abort)
+
+    async def expire_loop(self) -> None:
+        """
+        Expire the entries of the rendezvous table every 'rendezvous.tick' seconds.
+
+        :return: None
+        """
+        while not self.stopping:
+            await asyncio.sleep(self.rendezvous.tick)
+            self.rendezvous.expire(time.monotonic())
+
+    async def serve(self) -> None:
+        """
+        Serve the control and UDP server until stop() is called.
+
+        :return: None
+        """
+        start_logger = logging.getLogger('yard_server.starting')
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.ssl_context = self.create_ssl_context()
+        self.handshake_slots = asyncio.Semaphore(self.max_handshakes)
+        self.handshake_tasks = set()
+
+        start_logger.info("Control server is starting")
+        # The connections are accepted as plain TCP and upgraded by handshake(), see YardHandshakeProtocol
+        server = await self.loop.create_server(lambda: YardHandshakeProtocol(self), sock=self.control_server)
+        start_logger.info("Control server is now listening")
+
+        start_logger.info("Transmission server is starting")
+        transport, _ = await self.loop.create_datagram_endpoint(lambda: YardDatagramProtocol(self),
+                                                                sock=self.transmission_server)
+        expire_task = asyncio.create_task(self.expire_loop())
+        self.timer_wheel.start()
+        if self.forwarder:
+            # Like in the threaded server the thread of the forwarder handles the messages in order,
+            # they use the directory
+            self.forwarder.start(self.handle_forwarded)
+        try:
+            await self.stopped.wait()
+        finally:
+            expire_task.cancel()
+            transport.close()
+            server.close()
+            for i in list(self.connections):
+                i.close()
+            if self.forwarder:
+                self.forwarder.close()
+            self.client_storage.close()
+            self.timer_wheel.stop()
+            self.workers.shutdown(wait=False, cancel_futures=True)
+
+    def start(self) -> None:
+        """
+        Start the yard-Server in a new thread that runs the event loop.
+
+        :return: None
+        """
+        logging.getLogger('yard_server.starting').debug("Server starts event loop thread")
+        self.thread = threading.Thread(target=asyncio.run, args=[self.serve()], name='yard-asyncio')
+        self.thread.start()
+
+    def stop(self) -> None:
+        logging.getLogger('yard_server.client').info("Control server is now stopping")
+        self.stopping = True
+        if self.loop and self.stopped:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(self.stop_timeout)
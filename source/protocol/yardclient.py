@@ -6,8 +6,11 @@ import ssl
 import time
 import uuid
 import logging
-from typing import Union, Tuple, Any
+from concurrent.futures import Future
+from typing import Union, Tuple, Any, Callable
 
+from objects.timerwheel import TimerWheel
+from objects.yardmetrics import YardMetrics
 from protocol import protocol
 
 # TODO: On exit close everything
@@ -16,16 +19,19 @@ from protocol.yardtransmission import YardTransmission
 
 
 class YardClient:
-    # TODO: PROBLEM if receive it receives of other request
-
     control_socket = None
     control_client = None
     control_channel = None
+    demultiplexer: protocol.YardControlDemultiplexer = None
+    timer_wheel: TimerWheel = None
+    metrics: YardMetrics = None
+    push_callback: Callable[[Tuple[dict, str]], Any] = None
 
     settings = None
     defaultSettings = {"fingerprint": str(uuid.uuid4())}
 
     is_connected = False
+    close_timeout = 1  # Seconds to wait for the reader thread on close
 
     # {"fingerprint": uuid}
 
@@ -34,7 +40,9 @@ class YardClient:
         init_logger.debug("Initializing Control client")
         self.control_socket = control_socket
         self.control_client = control_client
-        self.control_channel = protocol.YardControlChannel()
+        self.metrics = YardMetrics()
+        self.control_channel = protocol.YardControlChannel(metrics=self.metrics)
+        self.timer_wheel = TimerWheel(logger='yard_client.protocol.timer_wheel')
 
     def get_settings(self):
         # TODO Create Settings
@@ -58,34 +66,31 @@ class YardClient:
         :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
         :raises OverflowError: When Parameters could not be converted to their byte-representation
         """
-        package = self.control_channel.send_receive(self.control_client, ses, typ, data)
-        logging.getLogger('yard_client.protocol.conn').debug(
-            "Received data from {}:{} | Header: {} || Payload: {}".format(*self.control_socket, *package))
-        return package
+        return self.receive(self.request(ses, typ, data))
 
-    def send_ac(self, ses: int, typ: int, data: Union[str, bytes]) -> int:
+    def request(self, ses: int, typ: int, data: Union[str, bytes]) -> Future:
         """
-        Send a message and return the access code.
+        Send a message and return the future of the answer.
 
         :param ses: int: The desired session
         :param typ: int: The desired message type
         :param data: str | bytes: The payload
-        :return: int: The access code
+        :return: Future: The future of the answer, use self.receive() to wait for it
         :raises OverflowError: When there is no answer-code left. So it is waiting for to many answers
         :raises OverflowError: When Parameters could not be converted to their byte-representation
         """
-        return self.control_channel.send_ac(self.control_client, ses, typ, data)
+        return self.demultiplexer.request(ses, typ, data)
 
-    def receive_ac(self, ac: int) -> Tuple[dict, str]:
+    def receive(self, future: Future) -> Tuple[dict, str]:
         """
-        Receive a message by an access code.
+        Wait for the answer of a request.
 
-        :param ac: int: The access code
-        :return: list: [header, payload]
+        :param future: Future: The future returned by self.request()
+        :return: tuple: (header, payload)
         :raises ConnectionAbortedError: When there is a problem with the header, the connection is treated as aborted
         :raises TimeoutError: When it doesn't receive an answer in a defined time-period
         """
-        package = self.control_channel.receive_ac(self.control_client, ac)
+        package = future.result()
         logging.getLogger('yard_client.protocol.conn').debug(
             "Received data from {}:{} | Header: {} || Payload: {}".format(*self.control_socket, *package))
         return package
@@ -101,12 +106,33 @@ class YardClient:
 
         connect_logger.info("Connecting to {}:{}".format(*self.control_socket))
         self.control_client.connect(self.control_socket)
+        # Control messages are small, send them immediately
+        self.control_client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         self.control_client = context.wrap_socket(self.control_client, server_hostname=self.control_socket[0])
         connect_logger.info(f"Connected with {self.control_client.version()}")
         connect_logger.debug(f"Added Certificate {self.control_client.getpeercert()}")  # ATTENTION: MiTM attack
+
+        # One thread reads the socket and routes the answers, so requests can be sent from any thread
+        self.demultiplexer = protocol.YardControlDemultiplexer(self.control_channel,
+                                                               self.control_client,
+                                                               self.handle_push,
+                                                               self.timer_wheel)
+        self.demultiplexer.start()
         self.is_connected = True
 
+    def handle_push(self, package: Tuple[dict, str]) -> None:
+        """
+        Handle a package that was not requested.
+
+        :param package: Tuple[header, payload]: The package
+        :return: None
+        """
+        if self.push_callback:
+            self.push_callback(package)
+        else:
+            logging.getLogger('yard_client.protocol.conn').warning(f"Received not requested package {package}")
+
     def send_init(self) -> str:
         logging.getLogger('yard_client.protocol.send').debug(f"Sending INIT message to {self.control_socket}")
         return self.send_receive(0, self.control_channel.INIT, self.settings['fingerprint'])[1]
@@ -119,20 +145,23 @@ class YardClient:
         logging.getLogger('yard_client.protocol.send').debug(f"Sending REQ message to {self.control_socket}")
         password = secrets.token_hex()
         msg = f"{client_id} {password}"
-        ac = self.send_ac(0, self.control_channel.REQ, msg)
+        future = self.request(0, self.control_channel.REQ, msg)
         trans_clt.send_server_ping(password)
         trans_clt.send_server_ping(password)
-        header, data = self.receive_ac(ac)
+        header, data = self.receive(future)
         data = str(data).split(' ')
         if len(data) == 3:
             session, ip, port = data
             return int(session), (ip, port)
         return 0, ('', 0)
 
-    def send_to_client(self, session: int, message: str):
+    def send_to_client(self, session: int, message: str) -> Tuple[dict, str]:
+        """
+        :return: Tuple[header, payload]: The answer, ERR when the partner doesn't drain its pending packages
+        """
         # TODO: check if session
         logging.getLogger('yard_client.protocol.send').debug(f"Sending CONN message to {self.control_socket}: {message}")
-        self.send_receive(session, self.control_channel.CONN, message)
+        return self.send_receive(session, self.control_channel.CONN, message)
 
     def terminate_session(self, session: int):
         # TODO: Delete session
@@ -154,6 +183,13 @@ class YardClient:
     def close(self):
         # TODO: Delete sessions, close server connection
         logging.getLogger('yard_client.protocol.send').debug(f"Sending CLOSE message to {self.control_socket}")
-        self.control_channel.send(self.control_client, self.control_channel.CLOSE, "")
+        self.demultiplexer.close()      # Fail waiting requests
+        self.demultiplexer.send(self.control_channel.CLOSE, "")
+        try:
+            # Wake the reader thread before the file descriptor is released, a new socket could reuse it
+            self.control_client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.demultiplexer.join(self.close_timeout)
         self.control_client.close()     # Close socket
-        self.control_channel.close()    # Stop internal timers, stop timeouts
+        self.timer_wheel.stop()
@@ -0,0 +1,477 @@
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import lz4.frame
+except ImportError:
+    # lz4 is optional, without it the lz4 codec is not registered
+    lz4 = None
+
+
+class YardCodec(ABC):
+    """
+    Codec for encoding and decoding frames or tiles.
+
+    Frames are np.ndarray with the shape (height, width, channels) in BGR(A).
+    Decoded frames are always BGR. Corrupt data may raise any error of the underlying library,
+    YardCodecRegistry.decode() converts them to ValueError.
+    """
+    codec_id: int = None
+    name: str = None
+    lossless: bool = None
+
+    @abstractmethod
+    def encode(self, img: np.ndarray) -> bytes:
+        ...
+
+    @abstractmethod
+    def decode(self, data: bytes) -> np.ndarray:
+        ...
+
+    def encode_tagged(self, img: np.ndarray) -> bytes:
+        """
+        Encode the image and tag it with the codec id, see YardCodecRegistry.encode().
+
+        :param img: np.ndarray: The image
+        :return: bytes: codec_id + encoded data
+        """
+        return self.codec_id.to_bytes(1, 'little') + self.encode(img)
+
+    @staticmethod
+    def to_bgr(img: np.ndarray) -> np.ndarray:
+        return img[..., :3] if img.ndim == 3 and img.shape[2] == 4 else img
+
+
+class ImageCodec(YardCodec):
+    """
+    Codec based on cv2.imencode and cv2.imdecode.
+
+    :param params: list: Parameters for cv2.imencode
+    """
+    extension: str = None
+    params: list = None
+
+    def __init__(self, params: list = None):
+        self.params = params or []
+
+    def encode(self, img: np.ndarray) -> bytes:
+        success, data = cv2.imencode(self.extension, self.to_bgr(img), self.params)
+        if not success:
+            raise ValueError(f"Could not encode image with {self.name}")
+        return data.tobytes()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Could not decode image with {self.name}")
+        return img
+
+
+class JpegCodec(ImageCodec):
+    codec_id = 0x01
+    name = 'jpeg'
+    lossless = False
+    extension = '.jpg'
+
+    def __init__(self, quality: int = 30):
+        super().__init__([cv2.IMWRITE_JPEG_QUALITY, quality])
+
+
+class WebpCodec(ImageCodec):
+    codec_id = 0x02
+    name = 'webp'
+    lossless = False
+    extension = '.webp'
+
+    def __init__(self, quality: int = 50):
+        super().__init__([cv2.IMWRITE_WEBP_QUALITY, quality])
+
+
+class PngCodec(ImageCodec):
+    codec_id = 0x03
+    name = 'png'
+    lossless = True
+    extension = '.png'
+
+    def __init__(self, compression: int = 1):
+        super().__init__([cv2.IMWRITE_PNG_COMPRESSION, compression])
+
+
+class RawCodec(YardCodec):
+    """
+    Codec that compresses the raw pixels.
+
+    Package definition
+    -----------
+    height(2) + width(2) + channels(1) + compressed pixels
+    """
+    lossless = True
+    shape = struct.Struct('<HHB')
+
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+    def encode(self, img: np.ndarray) -> bytes:
+        img = np.ascontiguousarray(self.to_bgr(img))
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        return self.shape.pack(height, width, channels) + self.compress(img.tobytes())
+
+    def decode(self, data: bytes) -> np.ndarray:
+        height, width, channels = self.shape.unpack_from(data)
+        pixels = self.decompress(data[self.shape.size:])
+        return np.frombuffer(pixels, dtype=np.uint8).reshape((height, width, channels))
+
+
+class ZlibCodec(RawCodec):
+    codec_id = 0x04
+    name = 'zlib'
+
+    def __init__(self, level: int = 1):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class Lz4Codec(RawCodec):
+    codec_id = 0x05
+    name = 'lz4'
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+class PaletteCodec(YardCodec):
+    """
+    Lossless codec for images with at most 256 colours (text, UI).
+
+    Package definition
+    -----------
+    height(2) + width(2) + colours(2) + palette(colours * 3) + zlib(indexes)
+    """
+    codec_id = 0x06
+    name = 'palette'
+    lossless = True
+    max_colours = 256
+    shape = struct.Struct('<HHH')
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def encode(self, img: np.ndarray) -> bytes:
+        """
+        :raises ValueError: If the image has more than 256 colours
+        """
+        img = np.ascontiguousarray(self.to_bgr(img))
+        height, width = img.shape[:2]
+        packed = (img[..., 0].astype(np.uint32)
+                  | img[..., 1].astype(np.uint32) << 8
+                  | img[..., 2].astype(np.uint32) << 16)
+        palette, indexes = np.unique(packed, return_inverse=True)
+        if len(palette) > self.max_colours:
+            raise ValueError(f"Too many colours for {self.name}: {len(palette)}")
+        colours = np.stack([palette & 0xFF, palette >> 8 & 0xFF, palette >> 16 & 0xFF], axis=-1).astype(np.uint8)
+        return (self.shape.pack(height, width, len(palette))
+                + colours.tobytes()
+                + zlib.compress(indexes.astype(np.uint8).tobytes(), self.level))
+
+    def decode(self, data: bytes) -> np.ndarray:
+        height, width, count = self.shape.unpack_from(data)
+        start = self.shape.size
+        colours = np.frombuffer(data[start:start + count * 3], dtype=np.uint8).reshape((count, 3))
+        indexes = np.frombuffer(zlib.decompress(data[start + count * 3:]), dtype=np.uint8)
+        return colours[indexes].reshape((height, width, 3))
+
+
+class TileClassifier:
+    """
+    Classify the tiles of a frame into text-like (lossless) and photographic (lossy) content.
+
+    All features are computed for all tiles at once with NumPy:
+    - colour count: flat tiles and UI use few colours, photos many
+    - edge density: text has many hard edges
+    Smooth tiles with more colours, like gradients, are cheaper in the lossy image.
+
+    :param tile_size: int: Width and height of a tile (multiple of 16, so tiles match the JPEG blocks)
+    """
+    text_colours = 8  # Tiles with fewer colours are lossless even without edges
+    max_colours = 256
+    edge_threshold = 64
+    text_edge_density = 0.05
+
+    tile_size: int = None
+
+    def __init__(self, tile_size: int = 64):
+        self.tile_size = tile_size
+
+    def pad(self, img: np.ndarray) -> np.ndarray:
+        """
+        Pad the image to a multiple of the tile size.
+
+        :param img: np.ndarray: The image (height, width, channels)
+        :return: np.ndarray: The padded image
+        """
+        size = self.tile_size
+        height, width = img.shape[:2]
+        bottom, right = -height % size, -width % size
+        if bottom or right:
+            img = cv2.copyMakeBorder(img, 0, bottom, 0, right, cv2.BORDER_REPLICATE)
+        return img
+
+    def split(self, img: np.ndarray) -> np.ndarray:
+        """
+        Split a padded image into tiles.
+
+        :param img: np.ndarray: The image from self.pad() (height, width, ...)
+        :return: np.ndarray: The tiles (rows, cols, tile_size, tile_size, ...)
+        """
+        size = self.tile_size
+        height, width = img.shape[:2]
+        return img.reshape((height // size, size, width // size, size) + img.shape[2:]).swapaxes(1, 2)
+
+    def get_colours(self, tiles: np.ndarray) -> np.ndarray:
+        """
+        Estimate the colour count of each tile on every second pixel.
+
+        :param tiles: np.ndarray: The tiles from self.split()
+        :return: np.ndarray: The colour count (rows, cols)
+        """
+        sample = tiles[:, :, ::2, ::2]
+        packed = (sample[..., 0].astype(np.uint32)
+                  | sample[..., 1].astype(np.uint32) << 8
+                  | sample[..., 2].astype(np.uint32) << 16)
+        packed = np.sort(packed.reshape(packed.shape[:2] + (-1,)), axis=-1)
+        return 1 + np.count_nonzero(np.diff(packed, axis=-1), axis=-1)
+
+    def classify(self, img: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify the tiles of the image.
+
+        :param img: np.ndarray: The image in BGR(A)
+        :return: Tuple[lossless, colours]: bool and int arrays with the shape (rows, cols)
+        """
+        img = self.pad(img)
+        tiles = self.split(img)
+        size = self.tile_size
+        rows, cols = tiles.shape[:2]
+        gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        edges = np.abs(np.diff(gray.astype(np.int16), axis=1)) > self.edge_threshold
+        edges = np.pad(edges, ((0, 0), (0, 1))).reshape((rows, size, cols, size)).mean(axis=(1, 3))
+        colours = self.get_colours(tiles)
+        lossless = ((colours <= self.text_colours)
+                    | ((colours <= self.max_colours) & (edges >= self.text_edge_density)))
+        return lossless, colours
+
+
+class TileCodec(YardCodec):
+    """
+    Codec that chooses lossless or lossy coding per tile.
+
+    Photographic tiles are packed in index order into one lossy image that is 'cols' tiles wide, the tiles match
+    the JPEG blocks, so neighbours in the packed image don't bleed into each other.
+    Text-like tiles are encoded one by one with the palette codec, or png if they have too many colours.
+    A frame without text-like tiles is tagged as a frame of the lossy codec, see encode_tagged().
+
+    Package definition
+    -----------
+    height(2) + width(2) + tile_size(2) + tiles(4) + base_length(4) + base(tagged)
+    + [index(4) + length(4) + tile(tagged)] * tiles
+
+    :param registry: YardCodecRegistry: The registry of the tile codecs
+    :param classifier: TileClassifier(Optional): The classifier
+    :param lossy: str(Optional): The codec for photographic tiles
+    """
+    codec_id = 0x10
+    name = 'tiled'
+    lossless = False
+    shape = struct.Struct('<HHHII')
+    tile_header = struct.Struct('<II')
+
+    registry: 'YardCodecRegistry' = None
+    classifier: TileClassifier = None
+    lossy: str = None
+
+    def __init__(self, registry: 'YardCodecRegistry', classifier: TileClassifier = None, lossy: str = 'jpeg'):
+        self.registry = registry
+        self.classifier = classifier or TileClassifier()
+        self.lossy = lossy
+
+    def encode_tagged(self, img: np.ndarray) -> bytes:
+        img = self.to_bgr(img)
+        lossless, colours = self.classifier.classify(img)
+        if not lossless.any():
+            # The tile headers would only add to the size of the lossy image
+            return self.registry.encode(img, self.lossy)
+        return self.codec_id.to_bytes(1, 'little') + self.pack(img, lossless, colours)
+
+    def encode(self, img: np.ndarray) -> bytes:
+        img = self.to_bgr(img)
+        return self.pack(img, *self.classifier.classify(img))
+
+    def pack(self, img: np.ndarray, lossless: np.ndarray, colours: np.ndarray) -> bytes:
+        """
+        Encode the classified tiles of the image.
+
+        :param img: np.ndarray: The image in BGR
+        :param lossless: np.ndarray: The lossless tiles from TileClassifier.classify()
+        :param colours: np.ndarray: The colour counts from TileClassifier.classify()
+        :return: bytes: The package
+        """
+        height, width = img.shape[:2]
+        size = self.classifier.tile_size
+        tiles = self.classifier.split(self.classifier.pad(img))
+        rows, cols = lossless.shape
+
+        packages = []
+        for row, col in zip(*np.nonzero(lossless)):
+            tile = tiles[row, col]
+            data = None
+            if colours[row, col] <= PaletteCodec.max_colours:
+                try:
+                    data = self.registry.encode(tile, PaletteCodec.name)
+                except ValueError:
+                    # The colour count is only estimated
+                    pass
+            data = data or self.registry.encode(tile, PngCodec.name)
+            packages.append(self.tile_header.pack(row * cols + col, len(data)) + data)
+
+        base = b''
+        lossy = tiles[~lossless]
+        if len(lossy):
+            base_rows = -(-len(lossy) // cols)
+            base_cols = min(len(lossy), cols)
+            grid = np.zeros((base_rows * base_cols, size, size, 3), dtype=np.uint8)
+            grid[:len(lossy)] = lossy
+            base_img = grid.reshape((base_rows, base_cols, size, size, 3)).swapaxes(1, 2)
+            base = self.registry.encode(base_img.reshape((base_rows * size, base_cols * size, 3)), self.lossy)
+
+        return self.shape.pack(height, width, size, len(packages), len(base)) + base + b''.join(packages)
+
+    def decode(self, data: bytes) -> np.ndarray:
+        height, width, size, count, base_length = self.shape.unpack_from(data)
+        start = self.shape.size
+        rows, cols = -(-height // size), -(-width // size)
+        img = np.zeros((rows * size, cols * size, 3), dtype=np.uint8)
+        base = self.registry.decode(data[start:start + base_length]) if base_length else None
+        start += base_length
+        lossy = np.ones(rows * cols, dtype=bool)
+        for _ in range(count):
+            index, length = self.tile_header.unpack_from(data, start)
+            start += self.tile_header.size
+            y, x = index // cols * size, index % cols * size
+            img[y:y + size, x:x + size] = self.registry.decode(data[start:start + length])
+            lossy[index] = False
+            start += length
+        if base is not None:
+            # The lossy tiles are packed in index order
+            base_cols = base.shape[1] // size
+            for i, index in enumerate(np.flatnonzero(lossy)):
+                y, x = index // cols * size, index % cols * size
+                by, bx = i // base_cols * size, i % base_cols * size
+                img[y:y + size, x:x + size] = base[by:by + size, bx:bx + size]
+        return img[:height, :width]
+
+
+class YardCodecRegistry:
+    """
+    Registry of all available codecs.
+
+    Encoded frames are tagged with the id of the codec, so the receiver can decode them without knowing
+    which codec the sender has chosen.
+
+    Package definition
+    -----------
+    codec_id(1) + encoded data
+    """
+    # Raised by the codecs for truncated or corrupt data (lz4 raises RuntimeError)
+    decode_errors = (zlib.error, struct.error, IndexError, RuntimeError, cv2.error)
+
+    codecs: Dict[int, YardCodec] = None
+    names: Dict[str, YardCodec] = None
+
+    def __init__(self):
+        self.codecs = {}
+        self.names = {}
+
+    def register(self, codec: YardCodec) -> None:
+        """
+        Register a codec, an already registered codec with the same id or name is replaced.
+
+        :param codec: YardCodec: The codec
+        :return: None
+        :raises OverflowError: If the codec id does not fit in one byte
+        """
+        if codec.codec_id.bit_length() > 8:
+            raise OverflowError(f"Codec id of {codec.name} is to long")
+        self.codecs[codec.codec_id] = codec
+        self.names[codec.name] = codec
+
+    def get(self, codec: int | str) -> YardCodec:
+        """
+        Get a codec by id or name.
+
+        :param codec: int | str: The id or name of the codec
+        :return: YardCodec
+        :raises ValueError: If the codec is unknown
+        """
+        result = self.codecs.get(codec, None) if isinstance(codec, int) else self.names.get(codec, None)
+        if not result:
+            raise ValueError(f"Unknown codec: {codec}")
+        return result
+
+    def available(self) -> List[str]:
+        return list(self.names.keys())
+
+    def encode(self, img: np.ndarray, codec: int | str) -> bytes:
+        """
+        Encode the image and tag it with the codec id.
+        A codec may hand the image to another codec, e.g. tiled frames without text are tagged as jpeg.
+
+        :param img: np.ndarray: The image
+        :param codec: int | str: The id or name of the codec
+        :return: bytes: codec_id + encoded data
+        :raises ValueError: If the codec is unknown
+        """
+        return self.get(codec).encode_tagged(img)
+
+    def decode(self, data: bytes) -> np.ndarray:
+        """
+        Decode a tagged image.
+
+        :param data: bytes: codec_id + encoded data
+        :return: np.ndarray: The image in BGR
+        :raises ValueError: If the codec is unknown or the data could not be decoded
+        """
+        if not data:
+            raise ValueError("No data to decode")
+        codec = self.get(data[0])
+        try:
+            return codec.decode(memoryview(data)[1:])
+        except self.decode_errors as e:
+            raise ValueError(f"Could not decode data with {codec.name}: {e!r}") from e
+
+
+registry = YardCodecRegistry()
+registry.register(JpegCodec())
+registry.register(WebpCodec())
+registry.register(PngCodec())
+registry.register(ZlibCodec())
+if lz4:
+    registry.register(Lz4Codec())
+registry.register(PaletteCodec())
+registry.register(TileCodec(registry))
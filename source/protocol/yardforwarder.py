@@ -0,0 +1,221 @@
+"""
+Forwarding between the workers (or nodes) of a server.
+
+A message is a tuple of JSON types, the first item is the message type:
+
+('push', client_id, ses, payload): Push a package to the local client
+('terminate', client_id, ses, partner_id): The partner deleted the session
+('evict', client_id): The client moved to another worker
+('udp', password, [ip, port]): UDP message of a REQ that was received by another worker
+"""
+
+import hmac
+import json
+import logging
+import queue
+import socket
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Any, Optional, Tuple, Set
+
+Message = tuple
+
+
+class YardForwarder(ABC):
+    """
+    Sends messages to the other workers and passes the received messages to the handler.
+
+    :param node: str: The name of the own worker
+    """
+    node: str = None
+    handler: Callable[[Message], Any] = None
+    thread: threading.Thread = None
+
+    def __init__(self, node: str):
+        self.node = node
+
+    @abstractmethod
+    def send(self, node: str, message: Message) -> None:
+        """
+        Send a message to a worker.
+
+        :param node: str: The name of the worker
+        :param message: tuple: The message
+        :return: None
+        """
+
+    @abstractmethod
+    def receive(self) -> Optional[Message]:
+        """
+        :return: tuple | None: The next message, None when the forwarder is closed
+        """
+
+    def start(self, handler: Callable[[Message], Any]) -> None:
+        """
+        Start receiving, the handler is called in the thread of the forwarder.
+
+        :param handler: Callable[[message], Any]: The handler of the received messages
+        :return: None
+        """
+        self.handler = handler
+        self.thread = threading.Thread(target=self.run, name=f'forwarder-{self.node}', daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while (message := self.receive()) is not None:
+            try:
+                self.handler(message)
+            except Exception as e:
+                logging.getLogger('yard_server.forwarder').exception(e)
+
+    def close(self) -> None:
+        pass
+
+
+class QueueForwarder(YardForwarder):
+    """
+    Forwarder over one queue per worker, e.g. multiprocessing.Queue for forked workers or queue.Queue
+    for servers in one process.
+
+    :param node: str: The name of the own worker
+    :param queues: Dict[node, queue]: The queues of all workers (including the own)
+    """
+    close_timeout = 1
+    queues: Dict[str, Any] = None
+
+    def __init__(self, node: str, queues: Dict[str, Any]):
+        super().__init__(node)
+        self.queues = queues
+
+    def send(self, node: str, message: Message) -> None:
+        self.queues[node].put(message)
+
+    def receive(self) -> Optional[Message]:
+        return self.queues[self.node].get()
+
+    def close(self) -> None:
+        self.queues[self.node].put(None)
+        # A forked worker must not exit while the thread still reads the queue
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(self.close_timeout)
+
+
+class TcpForwarder(YardForwarder):
+    """
+    Forwarder between the nodes of a cluster, one JSON message per line over TCP.
+
+    The messages are sent by a sender thread, so a slow or unreachable node doesn't block the server.
+    Messages for a node that can't be reached are dropped, like packages of an offline client.
+
+    Only connections from the addresses of the nodes are accepted. With a secret, the first line of a connection
+    must be the secret, otherwise the connection is closed. The forwarder port belongs into a private network,
+    the messages are not encrypted.
+
+    TcpForwarder(node, nodes, secret) -> TcpForwarder
+
+    :param node: str: The name of the own node
+    :param nodes: Dict[node, Tuple[host, port]]: The forwarder addresses of all nodes (including the own)
+    :param secret: str(Optional): Shared secret of the nodes
+    """
+    connect_timeout = 5
+    close_timeout = 1
+
+    nodes: Dict[str, Tuple[str, int]] = None
+    allowed_ips: Set[str] = None
+    secret: Optional[str] = None
+    server: socket.socket = None
+    inbox: queue.Queue = None
+    outbox: queue.Queue = None
+    connections: Dict[str, socket.socket] = None
+
+    def __init__(self, node: str, nodes: Dict[str, Tuple[str, int]], secret: str = None):
+        super().__init__(node)
+        self.nodes = {name: tuple(address) for name, address in nodes.items()}
+        self.allowed_ips = {info[4][0] for host, port in self.nodes.values()
+                            for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+        self.secret = secret or None
+        self.inbox = queue.Queue()
+        self.outbox = queue.Queue()
+        self.connections = {}
+        # Bind before start, so the other nodes can connect as soon as the node is created
+        self.server = socket.create_server(self.nodes[node])
+
+    def send(self, node: str, message: Message) -> None:
+        self.outbox.put((node, message))
+
+    def receive(self) -> Optional[Message]:
+        return self.inbox.get()
+
+    def start(self, handler: Callable[[Message], Any]) -> None:
+        threading.Thread(target=self.accept_loop, name=f'forwarder-accept-{self.node}', daemon=True).start()
+        threading.Thread(target=self.send_loop, name=f'forwarder-send-{self.node}', daemon=True).start()
+        super().start(handler)
+
+    def accept_loop(self) -> None:
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                # Server socket closed
+                return
+            ip = address[0].removeprefix('::ffff:')
+            if ip not in self.allowed_ips:
+                logging.getLogger('yard_server.forwarder').warning(f"Rejected forwarder connection from {ip}")
+                connection.close()
+                continue
+            threading.Thread(target=self.read_loop, args=(connection,), daemon=True).start()
+
+    def read_loop(self, connection: socket.socket) -> None:
+        """
+        Read the messages of one node into the inbox.
+
+        :param connection: socket.socket: The connection of the node
+        :return: None
+        """
+        try:
+            with connection, connection.makefile('r', encoding='utf-8') as lines:
+                if self.secret and not hmac.compare_digest(lines.readline().rstrip('\n').encode('utf-8'),
+                                                           self.secret.encode('utf-8')):
+                    logging.getLogger('yard_server.forwarder').warning(
+                        f"Rejected forwarder connection from {connection.getpeername()[0]}: wrong secret")
+                    return
+                for line in lines:
+                    self.inbox.put(tuple(json.loads(line)))
+        except (OSError, ValueError) as e:
+            logging.getLogger('yard_server.forwarder').warning(f"Forwarder connection aborted: {e}")
+
+    def send_loop(self) -> None:
+        while (item := self.outbox.get()) is not None:
+            node, message = item
+            data = (json.dumps(message) + '\n').encode('utf-8')
+            try:
+                self.get_connection(node).sendall(data)
+            except OSError as e:
+                logging.getLogger('yard_server.forwarder').warning(f"Dropped message for {node}: {e}")
+                connection = self.connections.pop(node, None)
+                if connection:
+                    connection.close()
+
+    def get_connection(self, node: str) -> socket.socket:
+        """
+        :param node: str: The name of the node
+        :return: socket.socket: The connection to the node, it is created on first use
+        :raises OSError: The node can't be reached
+        """
+        connection = self.connections.get(node, None)
+        if not connection:
+            connection = socket.create_connection(self.nodes[node], timeout=self.connect_timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.secret:
+                connection.sendall((self.secret + '\n').encode('utf-8'))
+            self.connections[node] = connection
+        return connection
+
+    def close(self) -> None:
+        self.outbox.put(None)
+        self.inbox.put(None)
+        self.server.close()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(self.close_timeout)
+        for connection in list(self.connections.values()):
+            connection.close()
@@ -1,12 +1,32 @@
 import logging
+import select
 import socket
 import ssl
+import struct
 import threading
+import time
 import uuid
-from typing import Tuple, Union, Any, List, Dict
-
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union, Any, Dict, Optional, Set
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Not available on Windows, writable() falls back to select
+    fcntl = termios = None
+
+from objects.clientdirectory import ClientDirectory
+from objects.clientregistry import ClientRegistry
+from objects.clientobj import ClientObj, RemoteClientObj
+from objects.ratelimiter import TokenBucketLimiter
+from objects.rendezvous import RendezvousTable
 from objects.storage import ClientStorage
+from objects.timerwheel import TimerWheel
+from objects.yardexceptions import PendingQueueFull
+from objects.yardmetrics import YardMetrics
 from protocol.protocol import YardControlChannel, YardTransmissionChannel
+from protocol.yardforwarder import YardForwarder
 
 
 class YardServer:
@@ -14,6 +34,15 @@ class YardServer:
     Class for handling yard client connections.
 
     YardServer(control_socket, control_server)
+
+    With a directory and a forwarder the server is one worker of several (see YardServerPool),
+    packages for clients of other workers are forwarded to them.
+
+    Connections that send no message for 'idle_timeout' seconds are reaped (see check_idle()),
+    their handler closes them and sets the client offline.
+
+    The messages of every client and of every source ip are limited by token buckets (see admit()),
+    at most 'max_rendezvous' REQs wait for their UDP message at once.
     """
 
     control_socket: Union[Tuple[Any, ...], str] = None
@@ -28,31 +57,63 @@ class YardServer:
     transmission_channel: YardTransmissionChannel = None
 
     client_storage: ClientStorage = None
-    connections: List = None
-    timers: List[threading.Timer] = None
+    connections: Dict[Any, float] = None  # connection -> time of its last message (time.monotonic())
+    metrics: YardMetrics = None
     udp_wait_timeout = 10
     udp_save_timeout = 10
+    udp_forward_delay = 1  # Seconds until the home of an unmatched UDP message is looked up again
+    push_version = 1  # Lowest control protocol version that receives pushed packages
+    push_timeout = 0.5  # Seconds a push waits for the send lock of the target before the package is pending
+    drain_delay = 1  # Seconds until the pending packages of a target are pushed again, see drain_pending()
+    batch_version = 1  # Lowest control protocol version that receives BATCH answers
+    batch_size = 0xFFFF  # Maximum bytes of a BATCH payload
+    handshake_timeout = 10  # Seconds for waiting on a handshake slot and for the TLS handshake
+    max_handshakes = 64  # Maximum number of concurrent TLS handshakes
+    idle_timeout = 180  # Seconds without a message until a connection is reaped, the clients ping every 60 seconds
+    client_rate = 50  # Messages per second of a client
+    client_burst = 100
+    ip_rate = 200  # Messages per second of a source ip, clients behind a NAT share it
+    ip_burst = 400
+    max_rendezvous = 4096  # Maximum number of REQs that wait for their UDP message
+    max_workers = 8  # Threads that wait for the directory and answer the REQs outside the UDP loop
+    answer_timeout = 2  # Seconds the answer of a REQ waits for the send buffer of a requester that doesn't read
     stopping = False
 
-    udp_receive_event: threading.Event = None
-    udp_received: Dict[Any, Tuple[str, Union[str, int]]]
+    rendezvous: RendezvousTable = None
+    forwarder: Optional[YardForwarder] = None
+    ssl_context: ssl.SSLContext = None
+    handshakes: threading.BoundedSemaphore = None
+    timer_wheel: TimerWheel = None
+    workers: ThreadPoolExecutor = None
+    draining: Set[ClientObj] = None  # Targets with a scheduled drain_pending()
+    client_limiter: TokenBucketLimiter = None
+    ip_limiter: TokenBucketLimiter = None
 
     # TODO Create fingerprint check (fingerprint and socket are connected MITM) Send fingerprint encrypted
     # TODO Check if really fingerprint malicious data
-    # TODO add timeout to clear connections
 
     def __init__(self,
                  server_socket: Union[Tuple[Any, ...], str],
                  control_server: socket.socket,
                  transmission_server: socket.socket,
                  cert_path: str,
-                 key_path: str):
+                 key_path: str,
+                 *,
+                 directory: ClientDirectory = None,
+                 forwarder: YardForwarder = None,
+                 registry: ClientRegistry = None):
+        """
+        :param directory: ClientDirectory(Optional, keyword-only): The client directory shared by all workers
+        :param forwarder: YardForwarder(Optional, keyword-only): The forwarder to the other workers
+        :param registry: ClientRegistry(Optional, keyword-only): Keeps the client IDs across restarts
+        """
 
         logging.getLogger('yard_server.init').debug("Initializing Control server")
 
         self.control_socket = server_socket
         self.control_server = control_server
-        self.control_channel = YardControlChannel()
+        self.metrics = YardMetrics()
+        self.control_channel = YardControlChannel(metrics=self.metrics)
 
         self.cert_path = cert_path
         self.key_path = key_path
@@ -61,11 +122,26 @@ class YardServer:
         self.transmission_server = transmission_server
         self.transmission_channel = YardTransmissionChannel()
 
-        self.client_storage = ClientStorage()
-        self.connections = []
-        self.timers = []
-        self.udp_receive_event = threading.Event()
-        self.udp_received = {}
+        self.forwarder = forwarder
+        self.client_storage = ClientStorage(directory, forwarder, registry)
+        self.connections = {}
+        self.timer_wheel = TimerWheel(tick=1, logger='yard_server.timer_wheel')
+        self.workers = ThreadPoolExecutor(self.max_workers, thread_name_prefix='yard-worker')
+        self.draining = set()
+        self.handshakes = threading.BoundedSemaphore(self.max_handshakes)
+        self.rendezvous = RendezvousTable(self.udp_wait_timeout, self.udp_save_timeout, self.max_rendezvous)
+        self.client_limiter = TokenBucketLimiter(self.client_rate, self.client_burst)
+        self.ip_limiter = TokenBucketLimiter(self.ip_rate, self.ip_burst)
+        self.metrics.register_gauge('server.rendezvous_waiters', lambda: len(self.rendezvous.waiters))
+        self.metrics.register_gauge('server.rendezvous_received', lambda: len(self.rendezvous.received))
+        self.metrics.register_gauge('server.rendezvous_expired', lambda: self.rendezvous.expired)
+        self.metrics.register_gauge('server.rendezvous_dropped', lambda: self.rendezvous.dropped)
+        self.metrics.register_gauge('server.rendezvous_rate_limited', lambda: self.rendezvous.rate_limited)
+        self.metrics.register_gauge('server.connections', lambda: len(self.connections))
+        self.metrics.register_gauge('server.throttled_clients', lambda: self.client_limiter.limited)
+        self.metrics.register_gauge('server.throttled_ips', lambda: self.ip_limiter.limited)
+        self.metrics.register_gauge('server.client_buckets_evicted', lambda: self.client_limiter.evicted)
+        self.metrics.register_gauge('server.ip_buckets_evicted', lambda: self.ip_limiter.evicted)
 
         self.control_server.bind(self.control_socket)
         self.transmission_server.bind(self.transmission_socket)
@@ -90,6 +166,122 @@ class YardServer:
                                   ac=ac,
                                   data=data)
 
+    def push(self, target: ClientObj, ses: int, package: list) -> None:
+        """
+        Write a package for a client to its socket immediately.
+        Clients speaking protocol version 0 can't route unrequested packages, they get it with the next PING.
+        A push never waits for a slow target: when its send lock is held for 'push_timeout' seconds or its send
+        buffer is full (see writable()), the package is pending as well and pushed by drain_pending() once the
+        socket drains. Packages don't overtake the pending packages of the target.
+
+        :param target: ClientObj: The receiving client
+        :param ses: int: The session of the package
+        :param package: [header, payload]: The package
+        :return: None
+        :raises PendingQueueFull: The package can't be pushed and the target doesn't drain its pending packages
+        """
+        if isinstance(target, RemoteClientObj):
+            # The home of the client may have changed since the session was created
+            target = self.client_storage.get_remote_client(target.client_id) or target
+            self.forwarder.send(target.node, ('push', target.client_id, ses, package[1]))
+            self.metrics.increment('server.forwarded_packages')
+            return
+        sock = target.socket
+        version = self.control_channel.get_version(sock)
+        if version is not None and version >= self.push_version:
+            data = self.control_channel.create_package(ses, self.control_channel.ANS, package[1], ver=version)
+            send_lock = self.control_channel.get_send_lock(sock)
+            if send_lock.acquire(timeout=self.push_timeout):
+                try:
+                    if not target.pending_packages and self.writable(sock, len(data)):
+                        sock.sendall(data)
+                        self.metrics.increment('server.pushed_packages')
+                        return
+                except OSError as e:
+                    logging.getLogger('yard_server.connection').warning(
+                        f"Push to {target.client_id} failed, package is pending: {e}")
+                finally:
+                    send_lock.release()
+            self.metrics.increment('server.pushes_deferred')
+        try:
+            with target.locked():
+                # raises PendingQueueFull
+                target.pending_packages.append((ses, package))
+        except PendingQueueFull:
+            self.metrics.increment('server.pending_rejected')
+            raise
+        self.metrics.increment('server.pending_packages')
+        if version is not None and version >= self.push_version:
+            self.schedule_drain(target)
+
+    def schedule_drain(self, target: ClientObj) -> None:
+        """
+        Push the pending packages of the target in 'drain_delay' seconds, unless that is already scheduled.
+
+        :param target: ClientObj: The target of a deferred push
+        :return: None
+        """
+        if target not in self.draining:
+            self.draining.add(target)
+            # The timer wheel must not wait for the send lock
+            self.timer_wheel.schedule(self.drain_delay, self.workers.submit, self.drain_pending, target)
+
+    def drain_pending(self, target: ClientObj) -> None:
+        """
+        Push the pending packages of a target as long as they fit into its send buffer.
+        Scheduled again until no package is pending or the target is offline, so a deferred push doesn't
+        wait for the next PING of the target.
+
+        :param target: ClientObj: The target of a deferred push
+        :return: None
+        """
+        self.draining.discard(target)
+        sock = target.socket
+        if not target.online or sock is None:
+            return
+        version = self.control_channel.get_version(sock)
+        send_lock = self.control_channel.get_send_lock(sock)
+        if send_lock.acquire(timeout=self.push_timeout):
+            try:
+                while True:
+                    # The send lock is held, so no push or drain of another thread interleaves
+                    with target.locked():
+                        if not target.pending_packages:
+                            return
+                        ses, package = target.pending_packages.peek()
+                        data = self.control_channel.create_package(ses, self.control_channel.ANS, package[1],
+                                                                   ver=version)
+                        if not self.writable(sock, len(data)):
+                            break
+                        target.pending_packages.popleft()
+                    sock.sendall(data)
+                    self.metrics.increment('server.drained_packages')
+            except OSError as e:
+                logging.getLogger('yard_server.connection').warning(
+                    f"Drain of {target.client_id} failed: {e}")
+                return
+            finally:
+                send_lock.release()
+        self.schedule_drain(target)
+
+    def writable(self, sock: socket.socket, size: int) -> bool:
+        """
+        Check without blocking whether 'size' bytes fit into the send buffer of the socket.
+        Must be called with the send lock of the socket held.
+
+        :param sock: socket.socket: The socket
+        :param size: int: Bytes to send
+        :return: bool: True when sendall() returns without waiting for the peer
+        """
+        try:
+            if fcntl:
+                # Bytes in the send queue of the kernel, the reported SO_SNDBUF includes the bookkeeping overhead
+                queued = struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+                return queued + size <= sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) // 2
+            return bool(select.select([], [sock], [], 0)[1])
+        except (OSError, ValueError):
+            return False
+
     def answer_message(self, sock: socket.socket, package: Tuple[dict, str]) -> bool:
         """
         Answer to the received message.
@@ -131,17 +323,28 @@ class YardServer:
                     #     pass
                     case self.control_channel.PING:
                         # If packages are pending send them else send nothing
-                        if len(clt.pending_packages) > 0:
-                            package = clt.pending_packages.pop(0)[1]
-                            ses = package[0]['ses']
-                            data = package[1]
+                        batch = None
+                        data = ""
+                        with clt.locked():
+                            if clt.pending_packages and self.control_channel.get_version(sock) >= self.batch_version:
+                                # All pending packages (up to batch_size) in one answer,
+                                # a package that doesn't fit into a batch is sent alone
+                                batch = self.control_channel.create_batch(clt.pending_packages, self.batch_size) or None
+                            if batch is None and clt.pending_packages:
+                                package = clt.pending_packages.popleft()[1]
+                                ses = package[0]['ses']
+                                data = package[1]
+                        if batch is not None:
+                            self.send(sock=sock,
+                                      typ=self.control_channel.BATCH,
+                                      ac=ac,
+                                      data=batch)
                         else:
-                            data = ""
-                        self.send(sock=sock,
-                                  ses=ses,
-                                  typ=self.control_channel.ANS,
-                                  ac=ac,
-                                  data=str(data))
+                            self.send(sock=sock,
+                                      ses=ses,
+                                      typ=self.control_channel.ANS,
+                                      ac=ac,
+                                      data=str(data))
                     case self.control_channel.REQ:
                         # Check if target client exists and then create session
                         msg = payload.split(' ')
@@ -150,50 +353,38 @@ class YardServer:
                             target = self.client_storage.get_client(client_id)
                             try:
                                 if target:
-                                    # Create session and send the id to the client else send ''
-                                    # raises OverflowError: No session left for client
-
-                                    timeout = False
-
-                                    def start_timeout():
-                                        nonlocal timeout
-                                        timeout = True
-
-                                    # Start timeout
-                                    timer = threading.Timer(self.udp_wait_timeout, start_timeout)
-                                    self.timers.append(timer)
-                                    timer.start()
-
-                                    # As long as no timeout -> wait for answer
-                                    while not timeout:
-                                        # If already in cache return
-                                        self.udp_receive_event.wait(self.udp_wait_timeout)
-                                        ip = self.udp_received.get(password, None)
-                                        if ip and ip[0] == clt.socket.getpeername()[0]:
-                                            logging.getLogger('yard_server.udp').info(
-                                                f"Received corresponding UDP message from {ip[0]}")
-                                            timer.cancel()
-                                            self.udp_receive_event.clear()
-                                            session_id = self.client_storage.create_session(clt, target)
-                                            logging.getLogger('yard_server.session').info(
-                                                f"Create Session {session_id} ({clt}, {target})")
-                                            self.send(sock=sock,
-                                                      typ=self.control_channel.ANS,
-                                                      ac=ac,
-                                                      data=f"{session_id} {ip[0]} {ip[1]}")
-                                            break
+                                    # Answer when the UDP message with the password arrives,
+                                    # meanwhile the connection keeps serving other messages
+                                    def answer(address):
+                                        # Called in the UDP loop, which must not wait for the session or the requester
+                                        self.workers.submit(self.answer_rendezvous,
+                                                            sock, ac, clt, target, password, address)
+
+                                    # The UDP message may arrive at another worker
+                                    self.share_rendezvous(password)
+                                    try:
+                                        # raises OverflowError: Rendezvous table is full
+                                        waiting = self.rendezvous.wait(password, clt.socket.getpeername()[0], answer)
+                                    except OverflowError:
+                                        self.unshare_rendezvous(password)
+                                        raise
+                                    if not waiting:
+                                        self.send(sock=sock,
+                                                  typ=self.control_channel.ERR,
+                                                  ac=ac,
+                                                  data="Password is already used")
                                 else:
                                     self.send(sock=sock,
                                               typ=self.control_channel.ANS,
                                               ac=ac,
                                               data='')
-                            except OverflowError:
-                                logging.getLogger('yard_server.session').error(
-                                    f"No session left for client {clt.client_id} and {target.client_id}")
+                            except OverflowError as e:
+                                logging.getLogger('yard_server.session').error(e.__str__())
+                                self.metrics.increment('server.rendezvous_rejected')
                                 self.send(sock=sock,
                                           typ=self.control_channel.ERR,
                                           ac=ac,
-                                          data="No session left for you and your target")
+                                          data="Server is busy, try again later")
                             except Exception as e:
                                 logging.getLogger('yard_server.session').error(e.__str__())
                         else:
@@ -207,16 +398,26 @@ class YardServer:
                         # Get target and add it to pending packages
                         target_client = clt.get_partner_of_session(ses)
                         if target_client:
-                            if target_client.socket:
+                            if target_client.online:
                                 # raises OverflowError
                                 package = [
                                     self.control_channel.create_header(ses, self.control_channel.ANS, pl=payload),
                                     payload
                                 ]
-                                target_client.pending_packages.append((ses, package))
-                                self.send(sock=sock,
-                                          typ=self.control_channel.ANS,
-                                          ac=ac)
+                                try:
+                                    self.push(target_client, ses, package)
+                                except PendingQueueFull as e:
+                                    # Backpressure: The sender has to wait until the target drained its packages
+                                    logging.getLogger('yard_server.session').warning(
+                                        f"Package for {target_client.client_id} rejected: {e}")
+                                    self.send(sock=sock,
+                                              typ=self.control_channel.ERR,
+                                              ac=ac,
+                                              data="Target is not receiving, try again later")
+                                else:
+                                    self.send(sock=sock,
+                                              typ=self.control_channel.ANS,
+                                              ac=ac)
                             else:
                                 self.send(sock=sock,
                                           typ=self.control_channel.WARN,
@@ -308,6 +509,78 @@ class YardServer:
                 logging.getLogger('yard_server.connection').exception(e)
                 return False
 
+    def answer_rendezvous(self,
+                          sock: socket.socket,
+                          ac: int,
+                          clt: ClientObj,
+                          target: ClientObj,
+                          password: str,
+                          address: Optional[Tuple[str, int]]) -> None:
+        """
+        Answer a REQ after its UDP message arrived or the waiting timed out.
+        Runs in the workers, the rendezvous table hands the answer over from the UDP loop or from wait() if the
+        UDP message arrived first.
+
+        :param sock: socket.socket: The socket of the requesting client
+        :param ac: int: The answer code of the REQ
+        :param clt: ClientObj: The requesting client
+        :param target: ClientObj: The requested client
+        :param password: str: The password of the rendezvous
+        :param address: Tuple[ip, port] | None: The public UDP address of the requesting client, None on timeout
+        :return: None
+        """
+        session_logger = logging.getLogger('yard_server.session')
+        try:
+            self.unshare_rendezvous(password)
+            if not address:
+                self.metrics.increment('server.rendezvous_timeouts')
+                typ, data = self.control_channel.ANS, ''
+            else:
+                logging.getLogger('yard_server.udp').info(f"Received corresponding UDP message from {address[0]}")
+                try:
+                    # raises OverflowError: No session left for client
+                    session_id = self.client_storage.create_session(clt, target)
+                    session_logger.info(f"Create Session {session_id} ({clt}, {target})")
+                    typ, data = self.control_channel.ANS, f"{session_id} {address[0]} {address[1]}"
+                except OverflowError:
+                    session_logger.error(f"No session left for client {clt.client_id} and {target.client_id}")
+                    typ, data = self.control_channel.ERR, "No session left for you and your target"
+            if not self.send_answer(sock, typ, data=data, ac=ac):
+                session_logger.warning(f"Dropped the answer to the REQ of {clt.client_id}, the client doesn't read")
+                self.metrics.increment('server.rendezvous_unanswered')
+        except OSError as e:
+            # The requesting client is already gone
+            session_logger.warning(f"Could not answer REQ of {clt.client_id}: {e}")
+        except Exception as e:
+            session_logger.exception(e)
+
+    def send_answer(self, sock: socket.socket, typ: int, *, data: Union[str, bytes] = b"", ac: int = 0) -> bool:
+        """
+        Send an answer from a worker without waiting longer than 'answer_timeout' for the requester.
+        Like a push, the answer is only written when it fits into the send buffer (see writable()).
+
+        :param sock: socket.socket: The socket where to send the answer
+        :param typ: int: The desired message type
+        :param data: str | bytes: The payload
+        :param ac: int(Optional, keyword-only): The answer code
+        :return: bool: False when the answer was dropped, because the requester didn't read in time
+        :raises OSError: When the connection is broken
+        """
+        package = self.control_channel.create_package(0, typ, data, ac=ac, ver=self.control_channel.get_version(sock))
+        deadline = time.monotonic() + self.answer_timeout
+        send_lock = self.control_channel.get_send_lock(sock)
+        if not send_lock.acquire(timeout=self.answer_timeout):
+            return False
+        try:
+            while not self.writable(sock, len(package)):
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.05)
+            sock.sendall(package)
+            return True
+        finally:
+            send_lock.release()
+
     def handle_client(self, connection: 'socket.socket', address: Tuple[str, Union[str, int]]) -> None:
         """
         Handle the client.
@@ -319,13 +592,19 @@ class YardServer:
         """
 
         connection_logger = logging.getLogger('yard_server.connection')
-        self.connections.append(connection)
+        connection = self.handshake(connection, address)
+        if not connection:
+            return
+        self.track_connection(connection)
         try:
             connection_logger.info("Accepting {}:{}".format(*address))
             while not self.stopping:
                 package = self.control_channel.receive(connection)
+                self.connections[connection] = time.monotonic()
                 connection_logger.info(  # TODO: Change to debug in production
                     "Received data from {}:{} || Header: {} || Payload: {}".format(*address, *package))
+                if not self.admit(connection, address, package):
+                    continue
                 connection_logger.debug("Answer to {}:{}".format(*address))
                 # If answer_message returns false close connection
                 if not self.answer_message(connection, package):
@@ -344,6 +623,107 @@ class YardServer:
             if cl:
                 cl.set_offline()
             connection.close()
+            self.connections.pop(connection, None)
+
+    def admit(self, sock: Any, address: Tuple[str, Union[str, int]], package: Tuple[dict, str]) -> bool:
+        """
+        Take a token of the client and of the source ip of the message, a throttled message is answered
+        at once with ERR and not passed to answer_message().
+
+        :param sock: socket.socket | YardStreamConnection: The connection of the message
+        :param address: Tuple[address, port]: The address of the connection
+        :param package: Tuple[header, payload]: The received package
+        :return: bool: True -> Answer the message, False -> the message is throttled
+        """
+        now = time.monotonic()
+        clt = self.client_storage.get_client_by_socket(sock)
+        if (clt is None or self.client_limiter.allow(clt.client_id, now)) and self.ip_limiter.allow(address[0], now):
+            return True
+        logging.getLogger('yard_server.connection').warning(
+            f"Throttled message of {clt.client_id if clt else 'guest'} from {address[0]}")
+        self.send(sock=sock,
+                  typ=self.control_channel.ERR,
+                  ac=package[0]['ac'],
+                  data="Too many messages, try again later")
+        return False
+
+    def track_connection(self, connection: Any) -> None:
+        """
+        Add the connection to the tracked connections and schedule its idle check.
+
+        :param connection: socket.socket | YardStreamConnection: The connection
+        :return: None
+        """
+        self.connections[connection] = time.monotonic()
+        self.timer_wheel.schedule(self.idle_timeout, self.check_idle, connection)
+
+    def check_idle(self, connection: Any) -> None:
+        """
+        Called by the timer wheel, reap the connection if it was idle for 'idle_timeout' seconds.
+        Otherwise, the check is scheduled again for the time the connection would become idle,
+        so a message only updates the timestamp of its connection.
+
+        :param connection: socket.socket | YardStreamConnection: The connection
+        :return: None
+        """
+        last = self.connections.get(connection, None)
+        if last is None:
+            # The connection is already closed
+            return
+        idle = time.monotonic() - last
+        if idle < self.idle_timeout:
+            self.timer_wheel.schedule(self.idle_timeout - idle, self.check_idle, connection)
+            return
+        logging.getLogger('yard_server.connection').info(f"Reaping connection, idle for {idle:.0f} seconds")
+        self.metrics.increment('server.reaped_connections')
+        self.reap(connection)
+
+    def reap(self, connection: Any) -> None:
+        """
+        Wake the handler of the connection, it closes the connection and sets the client offline.
+        The socket is only shut down here, closing it would release the descriptor while the handler reads.
+
+        :param connection: socket.socket: The connection
+        :return: None
+        """
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Already closed by the peer
+            pass
+
+    def handshake(self, connection: socket.socket, address: Tuple[str, Union[str, int]]) -> Optional[ssl.SSLSocket]:
+        """
+        Perform the TLS handshake of an accepted connection in the thread of the connection.
+        At most 'max_handshakes' handshakes run at the same time, waiting for a slot and the handshake
+        itself are limited by 'handshake_timeout'.
+
+        :param connection: socket.socket: The accepted plain TCP socket
+        :param address: Tuple[address, port]
+        :return: ssl.SSLSocket | None: The TLS socket, None if the handshake failed (the socket is closed)
+        """
+        connection_logger = logging.getLogger('yard_server.connection')
+        if not self.handshakes.acquire(timeout=self.handshake_timeout):
+            connection_logger.warning("Too many TLS handshakes, rejecting {}:{}".format(*address))
+            self.metrics.increment('server.handshake_rejected')
+            connection.close()
+            return None
+        start = time.perf_counter()
+        try:
+            # Control messages are small, send them immediately
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.settimeout(self.handshake_timeout)
+            connection = self.ssl_context.wrap_socket(connection, server_side=True)
+            connection.settimeout(None)
+            self.metrics.observe('server.handshake_seconds', time.perf_counter() - start)
+            return connection
+        except (ssl.SSLError, OSError) as e:
+            connection_logger.warning("TLS handshake with {}:{} failed: {}".format(*address, e))
+            self.metrics.increment('server.handshake_failures')
+            connection.close()
+            return None
+        finally:
+            self.handshakes.release()
 
     def server_loop(self) -> None:
         """
@@ -358,12 +738,10 @@ class YardServer:
                 main_logger.info("Control server is waiting for connections")
                 connection, address = self.control_server.accept()
 
-                # Start new thread and handle client
+                # Start new thread, handshake and handle client
                 thread = threading.Thread(target=self.handle_client, args=(connection, address))
                 main_logger.debug("Control server starts new thread")
                 thread.start()
-        except ssl.SSLError as sslE:
-            main_logger.error(sslE)
         except Exception as e:
             main_logger.exception(e)
             self.stop()
@@ -371,51 +749,127 @@ class YardServer:
     def server_udp_loop(self) -> None:
         """
         Starts the main server udp loop.
-        Waits for a new connection and then starts a new thread to handle the udp client.
+        Receives the UDP messages of the clients and passes them to the rendezvous table.
+        Also expires the entries of the rendezvous table, so it wakes up at least every 'rendezvous.tick' seconds.
         :return: None
         """
         main_logger = logging.getLogger('yard_server.main')
-
-        def clear(password):
-            nonlocal main_logger
-            event = threading.Event()
-
-            def start_event():
-                nonlocal event
-                event.set()
-
-            # Start timeout
-            timer = threading.Timer(self.udp_save_timeout, start_event)
-            self.timers.append(timer)
-            timer.start()
-
-            event.wait()
-            self.udp_received.pop(password)
-            main_logger.debug("Pop UDP receive message")
-            if not self.udp_received:
-                self.udp_receive_event.clear()
-                main_logger.debug("Clear UDP receive event")
-
+        self.transmission_server.settimeout(self.rendezvous.tick)
         try:
+            main_logger.info("Waiting for UDP connections")
             while not self.stopping:
-                main_logger.info("Waiting for UDP connections")
-                data, address = self.transmission_channel.receive_raw(self.transmission_server)
-                data = str(data, self.transmission_channel.encoding)
-                main_logger.info(f"Received UDP data from {address} || Data: {data}")
-                if not self.udp_received.get(data, None):
-                    self.udp_receive_event.set()
-                    self.udp_received[data] = address
-                    thread = threading.Thread(target=clear, args=[data])
-                    thread.start()
+                try:
+                    data, address = self.transmission_channel.receive_raw(self.transmission_server)
+                except socket.timeout:
+                    data = None
+                now = time.monotonic()
+                self.rendezvous.expire(now)
+                if data is not None:
+                    self.handle_datagram(data, address, now)
         except Exception as e:
             main_logger.exception(e)
             self.stop()
 
-    def test_event(self):
-        while not self.stopping:
-            self.udp_receive_event.wait()
-            print(self.udp_received['data'])
-            self.udp_receive_event.clear()
+    def handle_datagram(self, data: bytes, address: Tuple[str, int], now: float) -> None:
+        """
+        Pass a received UDP message to the rendezvous table.
+
+        :param data: bytes: The payload (the password of a REQ)
+        :param address: Tuple[ip, port]: The source of the UDP message
+        :param now: float: The current time (time.monotonic())
+        :return: None
+        """
+        if not self.rendezvous.allow(address[0], now):
+            return
+        try:
+            data = str(data, self.transmission_channel.encoding)
+        except UnicodeDecodeError:
+            logging.getLogger('yard_server.udp').debug(f"Received invalid UDP data from {address}")
+            return
+        logging.getLogger('yard_server.udp').debug(f"Received UDP data from {address} || Data: {data}")
+        if not self.rendezvous.receive(data, address) and self.forwarder:
+            # The REQ may wait at another worker, the lookup in the directory must not stop the UDP loop
+            self.workers.submit(self.forward_datagram, data, address, True)
+
+    def share_rendezvous(self, password: str) -> None:
+        """
+        Record in the directory that the REQ of the password waits at this worker.
+
+        :param password: str: The password of the REQ
+        :return: None
+        """
+        if self.client_storage.directory:
+            self.client_storage.directory.add_rendezvous(password, self.forwarder.node)
+
+    def unshare_rendezvous(self, password: str) -> None:
+        """
+        :param password: str: The password of the answered or timed out REQ
+        :return: None
+        """
+        if self.client_storage.directory:
+            self.client_storage.directory.remove_rendezvous(password, self.forwarder.node)
+
+    def forward_datagram(self, password: str, address: Tuple[str, int], retry: bool) -> None:
+        """
+        Forward an unmatched UDP message to the worker where the REQ of the password waits, see share_rendezvous().
+        The client sends the UDP message right after the REQ, so it can overtake the REQ. Then the lookup is
+        repeated once after 'udp_forward_delay' seconds, meanwhile the message is kept by the rendezvous table.
+
+        :param password: str: The password of the UDP message
+        :param address: Tuple[ip, port]: The source of the UDP message
+        :param retry: bool: Look up again if no REQ waits for the password
+        :return: None
+        """
+        node = self.client_storage.directory.get_rendezvous(password)
+        if node is None:
+            if retry:
+                self.timer_wheel.schedule(self.udp_forward_delay,
+                                          self.workers.submit, self.forward_datagram, password, address, False)
+        elif node != self.forwarder.node:
+            self.forwarder.send(node, ('udp', password, address))
+
+    def handle_forwarded(self, message: tuple) -> None:
+        """
+        Handle a message of another worker, see protocol.yardforwarder.
+
+        :param message: tuple: The message
+        :return: None
+        """
+        forward_logger = logging.getLogger('yard_server.forwarder')
+        forward_logger.debug(f"Received forwarded message {message}")
+        match message:
+            case ('push', client_id, ses, payload):
+                client = self.client_storage.clients.get(client_id, None)
+                if client and client.online:
+                    try:
+                        self.push(client, ses, [self.control_channel.create_header(ses, self.control_channel.ANS,
+                                                                                   pl=payload), payload])
+                    except PendingQueueFull as e:
+                        # The sender is served by another worker and already got its answer
+                        forward_logger.warning(f"Forwarded package for {client_id} dropped: {e}")
+                else:
+                    forward_logger.warning(f"Forwarded package for {client_id}, but it is not online")
+            case ('terminate', client_id, ses, partner_id):
+                self.client_storage.terminate_session(client_id, ses, partner_id)
+            case ('evict', client_id):
+                client = self.client_storage.clients.get(client_id, None)
+                if client:
+                    client.set_offline(leave_sock=not client.socket)
+                    self.client_storage.pop_client(client_id)
+            case ('udp', password, address):
+                self.rendezvous.receive(password, tuple(address))
+            case _:
+                forward_logger.warning(f"Unknown forwarded message {message}")
+
+    def create_ssl_context(self) -> ssl.SSLContext:
+        """
+        :return: ssl.SSLContext: Server context with the certificate and private key of the server
+        """
+        # Create SSL Context for a server
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        # Load the public and private key
+        context.load_cert_chain(self.cert_path, self.key_path)
+        return context
 
     def start(self) -> None:
         """
@@ -429,13 +883,14 @@ class YardServer:
         self.control_server.listen()
         start_logger.info("Control server is now listening")
 
-        start_logger.info("Control server starting SSL/TLS wrapper")
-        # Create SSL Context for a server
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        # Load the public and private key
-        context.load_cert_chain(self.cert_path, self.key_path)
-        # Wrap socket in TLS
-        self.control_server = context.wrap_socket(self.control_server, server_side=True)
+        # The TLS handshakes are performed by the connection threads, so a slow client can't block accept()
+        self.ssl_context = self.create_ssl_context()
+
+        if self.forwarder:
+            start_logger.debug("Forwarder starts new thread")
+            self.forwarder.start(self.handle_forwarded)
+
+        self.timer_wheel.start()
 
         start_logger.debug("Control server starts new thread")
         thread = threading.Thread(target=self.server_loop)
@@ -452,11 +907,13 @@ class YardServer:
         stop_logger = logging.getLogger('yard_server.client')
         stop_logger.info("Control server is now stopping")
         stop_logger.debug("Closing connections")
-        for i in self.connections:
+        for i in list(self.connections):
             i.close()
-        stop_logger.debug("Stop timers")
-        for i in self.timers:
-            i.cancel()
+        if self.forwarder:
+            self.forwarder.close()
+        self.client_storage.close()
+        self.timer_wheel.stop()
+        self.workers.shutdown(wait=False, cancel_futures=True)
         stop_logger.debug("Stop endless loops")
         self.stopping = True
         self.control_server.close()
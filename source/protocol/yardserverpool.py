@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+import socket
+from typing import Tuple, Any, Dict, List, Type
+
+from objects.clientdirectory import DirectoryManager, ClientDirectory
+from protocol.yardforwarder import QueueForwarder
+from protocol.yardserver import YardServer
+
+
+class YardServerPool:
+    """
+    Forks worker processes that serve the same control and UDP port with SO_REUSEPORT.
+
+    The kernel distributes the connections and datagrams among the workers. All workers share one client
+    directory that is hosted by a DirectoryManager process, packages for clients of other workers are forwarded
+    over one multiprocessing queue per worker.
+
+    YardServerPool(server_class, server_socket, cert_path, key_path, workers) -> YardServerPool
+
+    :param server_class: Type[YardServer]: YardServer or YardAsyncServer
+    :param server_socket: Tuple[host, port]: The address of the control and UDP server
+    :param cert_path: str: Path of the certificate
+    :param key_path: str: Path of the private key
+    :param workers: int: Number of worker processes
+    """
+    stop_timeout = 5
+
+    server_class: Type[YardServer] = None
+    server_socket: Tuple[Any, ...] = None
+    cert_path: str = None
+    key_path: str = None
+    workers: int = None
+
+    context: multiprocessing.context.BaseContext = None
+    manager: DirectoryManager = None
+    directory: ClientDirectory = None
+    queues: Dict[str, multiprocessing.Queue] = None
+    processes: List[multiprocessing.Process] = None
+    stopping: multiprocessing.Event = None
+
+    def __init__(self,
+                 server_class: Type[YardServer],
+                 server_socket: Tuple[Any, ...],
+                 cert_path: str,
+                 key_path: str,
+                 workers: int):
+        self.server_class = server_class
+        self.server_socket = server_socket
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.workers = workers
+        # Forked workers inherit the sockets options, the queues and the proxy of the directory
+        self.context = multiprocessing.get_context('fork')
+        self.processes = []
+
+    def create_sockets(self) -> Tuple[socket.socket, socket.socket]:
+        """
+        :return: Tuple[control_server, transmission_server]: Not bound sockets that share the port with the other workers
+        """
+        control_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        transmission_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for sock in (control_server, transmission_server):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        return control_server, transmission_server
+
+    def run_worker(self, node: str) -> None:
+        """
+        Run one worker until the pool is stopped.
+
+        :param node: str: The name of the worker
+        :return: None
+        """
+        logging.getLogger('yard_server.pool').info(f"Worker {node} is starting")
+        control_server, transmission_server = self.create_sockets()
+        server = self.server_class(self.server_socket,
+                                   control_server,
+                                   transmission_server,
+                                   self.cert_path,
+                                   self.key_path,
+                                   directory=self.directory,
+                                   forwarder=QueueForwarder(node, self.queues))
+        server.start()
+        self.stopping.wait()
+        server.stop()
+
+    def start(self) -> None:
+        """
+        Start the directory and the workers.
+
+        :return: None
+        """
+        self.manager = DirectoryManager(ctx=self.context)
+        self.manager.start()
+        self.directory = self.manager.ClientDirectory()
+        self.stopping = self.context.Event()
+        nodes = [f"worker-{i}" for i in range(self.workers)]
+        self.queues = {node: self.context.Queue() for node in nodes}
+        for node in nodes:
+            process = self.context.Process(target=self.run_worker, args=(node,), name=node)
+            process.start()
+            self.processes.append(process)
+
+    def join(self) -> None:
+        for process in self.processes:
+            process.join()
+
+    def stop(self) -> None:
+        """
+        Stop the workers, workers that don't stop in time are terminated.
+
+        :return: None
+        """
+        logging.getLogger('yard_server.pool').info("Stopping workers")
+        self.stopping.set()
+        for process in self.processes:
+            process.join(self.stop_timeout)
+            if process.is_alive():
+                process.terminate()
+        self.manager.shutdown()
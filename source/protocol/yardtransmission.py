@@ -8,7 +8,9 @@ from typing import Union, Tuple, Any, Callable, Literal
 
 import numpy as np
 
+from objects.cursorobj import CursorObj
 from protocol import protocol
+from protocol.yardcodec import registry
 
 
 class YardTransmission:
@@ -27,6 +29,7 @@ class YardTransmission:
     encoding = 'utf-8'
     byte_order: Literal["little", "big"] = 'little'
     dgram_size = 1000
+    codec = 'jpeg'
 
     package_wait = 1
 
@@ -34,7 +37,7 @@ class YardTransmission:
     stopping = False
 
     def __init__(self, transmission_socket, transmission_target, transmission_server,
-                 transmission_client: socket.socket, buffer: int):
+                 transmission_client: socket.socket, buffer: int, codec: str = None):
         init_logger = logging.getLogger('yard_client.transmission.init')
         init_logger.debug("Initializing Transmission client")
         self.transmission_socket = transmission_socket
@@ -48,6 +51,8 @@ class YardTransmission:
         self.transmission_client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer)
         self.last_send = time.time()
         self.sent = 0
+        # raises ValueError: If the codec is unknown
+        self.codec = registry.get(codec or self.codec).name
 
     def get_public_sock(self):
         return self.public_sock
@@ -99,7 +104,26 @@ class YardTransmission:
         logging.getLogger('yard_client.transmission.send').debug(f"Sending CLOSE message to {self.transmission_socket}")
         self.send(self.transmission_channel.CLOSE, "")
 
-    def send_display(self, img: np.ndarray):
+    def encode_display(self, img: np.ndarray) -> bytes:
+        """
+        Encode the display with the codec of this session.
+
+        :param img: np.ndarray: The captured display
+        :return: bytes: The tagged and encoded display (see YardCodecRegistry)
+        """
+        return registry.encode(img, self.codec)
+
+    def send_display(self, img: np.ndarray | bytes, stamp: float = None):
+        """
+        Split the encoded display into fragments and send them.
+
+        Every fragment is (position, stamp, data), the last sent fragment has position 0.
+        Senders before the capture stamp send (position, data), receive_display() accepts both.
+
+        :param img: np.ndarray | bytes: The encoded display
+        :param stamp: float(Optional): The capture time, default is now
+        """
+        stamp = stamp or time.time()
         send_logger = logging.getLogger('yard_client.transmission.send')
         send_logger.debug(f"Sending DISPLAY to {self.transmission_target}")
 
@@ -109,14 +133,14 @@ class YardTransmission:
                 f"Sending display with {self.sent // 10} FPS")
             self.sent = 0
 
-        data = img.tobytes()   # TODO Check if needed
+        data = img if type(img) == bytes else img.tobytes()
         size = len(data)
         count = math.ceil(size / self.dgram_size)
 
         array_pos_start = 0
         for i in range(count-1, -1, -1):
             array_pos_end = min(size, array_pos_start + self.dgram_size)
-            pkg = pickle.dumps((i, data[array_pos_start:array_pos_end]))
+            pkg = pickle.dumps((i, stamp, data[array_pos_start:array_pos_end]))
             array_pos_start = array_pos_end
             self.send(self.transmission_channel.DISPLAY, pkg)
             time.sleep(0.000001)
@@ -127,6 +151,11 @@ class YardTransmission:
             f"Sending KEY message to {self.transmission_target}")
         self.send(self.transmission_channel.KEY, data)
 
+    def send_cursor(self, cursor: CursorObj):
+        logging.getLogger('yard_client.transmission.send').debug(
+            f"Sending CURSOR message to {self.transmission_target}")
+        self.send(self.transmission_channel.CURSOR, cursor.to_bytes())
+
     def receive(self, callback: Callable[[Tuple[dict, bytes, Any]], Any]):
         pkg = self.transmission_channel.receive(self.transmission_client)
         logging.getLogger('yard_client.transmission.receive').debug(
@@ -156,27 +185,46 @@ class YardTransmission:
             thread = threading.Thread(target=receive_parts)
             thread.start()
 
-    def receive_display(self, callback: Callable[[Tuple[dict, bytes, Any]], Any]):
+    def receive_display(self,
+                        callback: Callable[[Tuple[dict, bytes, Any]], Any],
+                        cursor_callback: Callable[[dict, 'CursorObj', Any], Any] = None):
         fragments = {}
 
         def handle_parts(pkg):
             nonlocal fragments
             header, payload, address = pkg
             if header['typ'] == self.transmission_channel.DISPLAY:
-                pkg_data = pickle.loads(payload)
-                if pkg_data[0] >= 1:
-                    fragments[pkg_data[0]] = pkg_data[1]
+                fragment = pickle.loads(payload)
+                if len(fragment) == 3:
+                    position, stamp, part = fragment
+                else:
+                    # Fragment of an older sender without the capture stamp
+                    position, part = fragment
+                    stamp = None
+                if position >= 1:
+                    fragments[position] = part
                 else:
-                    fragments[pkg_data[0]] = pkg_data[1]
+                    fragments[position] = part
                     data = b''.join([x[1] for x in sorted(fragments.items(), reverse=True)])
                     fragments = {}
-                    callback((header, data, address))
+                    callback((header | {'stamp': stamp}, data, address))
 
         def receive_parts():
             while not self.stopping or not self.receiving:
                 try:
                     pkg = self.transmission_channel.receive(
                         self.transmission_client)  # TODO: Check if correct address als top level like a filter bind udp to address maybe
+                    header, payload, address = pkg
+                    if header['typ'] == self.transmission_channel.CURSOR:
+                        # Cursor messages are tiny, so they are handled directly without reassembly
+                        try:
+                            cursor = CursorObj.from_bytes(payload)
+                        except ValueError as e:
+                            logging.getLogger('yard_client.transmission.receive').warning(e)
+                            continue
+                        if cursor_callback:
+                            cursor_callback(header, cursor, address)
+                        continue
                     thread_part = threading.Thread(target=handle_parts, args=[pkg])
                     thread_part.start()
                 except Exception as e:
@@ -6,13 +6,21 @@ import ssl
 from OpenSSL import crypto
 
 from objects import yardlogging
+from objects.clientdirectory import SqliteClientDirectory
+from objects.clientobj import ClientObj
+from objects.clientregistry import ClientRegistry
+from protocol.yardasyncserver import YardAsyncServer
+from protocol.yardforwarder import TcpForwarder
 from protocol.yardserver import YardServer
+from protocol.yardserverpool import YardServerPool
 
 # TODO: Better conf
 conf = json.load(open('settings/conf.json'))['server']
 
 yardlogging.setup_server()
 
+ClientObj.id_len = conf['id_len']
+
 # Server conf
 srv_hostname = conf['hostname'] if conf['hostname'] else socket.gethostbyname(socket.gethostname())
 srv_port = conf['port'] if conf['port'] else 1434
@@ -46,9 +54,31 @@ if not (os.path.isfile(cert_file) and os.path.isfile(key_file)):
     with open(key_file, "wt") as f:
         f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, k).decode("utf-8"))
 
-srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-udp_srv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# 'threaded': One thread per connection, 'asyncio': All connections in one event loop
+server_modes = {'threaded': YardServer, 'asyncio': YardAsyncServer}
+server_class = server_modes[conf.get('mode', 'threaded')]
 
-server = YardServer(srv_sock, srv, udp_srv, cert_file, key_file)
+cluster_conf = conf.get('cluster', {})
+if cluster_conf.get('node'):
+    # One node of a cluster, the nodes share the directory and forward packages to each other
+    if conf.get('workers', 1) > 1:
+        raise ValueError("A cluster node runs with one worker")
+    node = cluster_conf['node']
+    directory = SqliteClientDirectory(cluster_conf['directory'])
+    # The clients of the last run of the node are gone
+    directory.unregister_node(node)
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    udp_srv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    forwarder = TcpForwarder(node, cluster_conf['nodes'], cluster_conf.get('secret'))
+    server = server_class(srv_sock, srv, udp_srv, cert_file, key_file, directory=directory, forwarder=forwarder)
+elif conf.get('workers', 1) > 1:
+    # Worker processes that share the port
+    server = YardServerPool(server_class, srv_sock, cert_file, key_file, conf['workers'])
+else:
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    udp_srv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Clients keep their IDs across restarts of a single server
+    registry = ClientRegistry(conf['registry']).start() if conf.get('registry') else None
+    server = server_class(srv_sock, srv, udp_srv, cert_file, key_file, registry=registry)
 
 server.start()